@@ -2,13 +2,13 @@ import streamlit as st
 from PyPDF2 import PdfReader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 import os
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
 import google.generativeai as genai
-from langchain.vectorstores import FAISS
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.chains.question_answering import load_qa_chain
 from langchain.prompts import PromptTemplate
 from dotenv import load_dotenv
+from embedding_providers import get_embedding_provider, EmbeddingMismatchError
+from faiss_store import load_index, update_index
 
 load_dotenv()
 os.getenv("GOOGLE_API_KEY")
@@ -32,13 +32,13 @@ def get_text_chunks(text):
     return chunks
 
 
-def get_vector_store(text_chunks):
-    embeddings = GoogleGenerativeAIEmbeddings(model = "models/embedding-001")
-    vector_store = FAISS.from_texts(text_chunks, embedding=embeddings)
-    vector_store.save_local("faiss_index")
-    
+def get_vector_store(pdf_docs):
+    # Chunks are tracked per file, so re-processing a PDF only embeds what changed
+    chunks_by_source = {pdf.name: get_text_chunks(get_pdf_text([pdf])) for pdf in pdf_docs}
+    return update_index("faiss_index", get_embedding_provider(), chunks_by_source)
 
 
+@st.cache_resource
 def get_conversational_chain():
 
     prompt_template = """
@@ -61,9 +61,13 @@ def get_conversational_chain():
 
 
 def user_input(user_question):
-    embeddings = GoogleGenerativeAIEmbeddings(model = "models/embedding-001")
+    embeddings = get_embedding_provider()
+    try:
+        new_db = load_index("faiss_index", embeddings)
+    except EmbeddingMismatchError as e:
+        st.error(str(e))
+        return
     
-    new_db = FAISS.load_local("faiss_index", embeddings,allow_dangerous_deserialization=True)
     docs = new_db.similarity_search(user_question)
 
     chain = get_conversational_chain()
@@ -93,9 +97,7 @@ def main():
         pdf_docs = st.file_uploader("Upload your PDF Files and Click on the Submit & Process Button", accept_multiple_files=True)
         if st.button("Submit & Process"):
             with st.spinner("Processing..."):
-                raw_text = get_pdf_text(pdf_docs)
-                text_chunks = get_text_chunks(raw_text)
-                get_vector_store(text_chunks)
+                get_vector_store(pdf_docs)
                 st.success("Done")
 
 
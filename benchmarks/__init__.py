@@ -0,0 +1 @@
+"""Offline benchmark suite for the PDF Chat API"""
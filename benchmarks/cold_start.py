@@ -0,0 +1,116 @@
+"""Cold-start benchmark: import time of main and latency of each first request.
+
+    python -m benchmarks.cold_start --runs 5 --output cold.json
+
+Every measurement runs in a fresh interpreter. ``import_main`` times a bare
+``import main``; ``first_request`` boots the app with the offline models and
+times the first and second call of each endpoint, once per STARTUP_WARMUP
+setting. The offline stand-ins import langchain_core before main, so its
+import cost is not attributed to the first request.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.harness import ResultSet, make_claims_list_csv, make_document_pdf, reset_tables
+from benchmarks.local_db import LocalDatabase
+
+ENDPOINTS = ["upload", "chat", "text2sql", "upload_csv"]
+
+
+def child_first_requests():
+    """Runs inside the subprocess; prints one JSON line of timings in seconds"""
+    boot_start = time.perf_counter()
+    from benchmarks.fakes import FakeChatModel, HashingEmbeddings
+    from benchmarks.harness import benchmark_user, load_app
+    from fastapi.testclient import TestClient
+
+    app_module = load_app(os.environ["DATABASE_URL"], HashingEmbeddings(), FakeChatModel())
+    user = benchmark_user()
+    app_module.app.dependency_overrides[app_module.get_current_user] = lambda: user
+    app_module.app.dependency_overrides[app_module.get_admin_user] = lambda: user
+
+    pdf = make_document_pdf(5)
+    csv = make_claims_list_csv(200)
+    calls = {
+        "upload": lambda c: c.post("/upload", files=[("files", ("cold.pdf", pdf, "application/pdf"))]),
+        "chat": lambda c: c.post("/chat", json={"question": "what is in the document"}),
+        "text2sql": lambda c: c.post("/text2sql", json={"question": "claims by status"}),
+        "upload_csv": lambda c: c.post("/upload-csv", files={"file": ("c.csv", csv, "text/csv")},
+                                       data={"table_name": "claims_list"}),
+    }
+    timings = {}
+    with TestClient(app_module.app) as client:
+        while client.get("/status/ready").status_code == 503:
+            time.sleep(0.01)
+        timings["boot_to_ready"] = time.perf_counter() - boot_start
+        for name in ENDPOINTS:
+            for attempt in ("first", "second"):
+                start = time.perf_counter()
+                calls[name](client).raise_for_status()
+                timings[f"{name}_{attempt}"] = time.perf_counter() - start
+    print(json.dumps(timings))
+
+
+def run_child(args, env):
+    output = subprocess.run(args, env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", help="write JSON results to this path")
+    parser.add_argument("--database-url", help="use this database instead of a throwaway one")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--warmup-modes", default="none,all", help="STARTUP_WARMUP values to compare")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        child_first_requests()
+        return
+
+    results = ResultSet({"runs": args.runs, "warmup_modes": args.warmup_modes})
+    import_code = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+    samples = [
+        float(subprocess.run([sys.executable, "-c", import_code], capture_output=True, text=True, check=True)
+              .stdout.strip().splitlines()[-1])
+        for _ in range(args.runs)
+    ]
+    results.add("import_main", {}, {"median_seconds": round(statistics.median(samples), 4),
+                                    "min_seconds": round(min(samples), 4)})
+
+    with LocalDatabase(args.database_url) as local_db:
+        from sqlalchemy import create_engine
+        engine = create_engine(local_db.url)
+        for mode in args.warmup_modes.split(","):
+            env = dict(os.environ, DATABASE_URL=local_db.url, STARTUP_WARMUP=mode)
+            runs = []
+            for _ in range(args.runs):
+                reset_tables_if_present(engine)
+                runs.append(run_child([sys.executable, "-m", "benchmarks.cold_start", "--child"], env))
+            metrics = {
+                f"{key}_ms": round(statistics.median(run[key] for run in runs) * 1000, 3)
+                for key in runs[0]
+            }
+            results.add("first_request", {"warmup": mode}, metrics)
+        engine.dispose()
+
+    if args.output:
+        results.write(args.output)
+
+
+def reset_tables_if_present(engine):
+    from sqlalchemy import inspect
+    tables = [t for t in ("document_chunks", "chat_history", "claims_detail", "claims_list")
+              if inspect(engine).has_table(t)]
+    if tables:
+        reset_tables(engine, *tables)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Compare two benchmark result files and flag regressions.
+
+    python -m benchmarks.compare baseline.json candidate.json --threshold 10
+
+Metrics ending in _ms or seconds are lower-is-better, metrics ending in
+_per_sec are higher-is-better, anything else is reported but never flagged.
+Exits with status 1 when any metric regresses by more than the threshold.
+"""
+import argparse
+import json
+import sys
+
+
+def metric_direction(name: str) -> int:
+    """-1 when lower is better, +1 when higher is better, 0 when informational"""
+    if name.endswith("_ms") or name.endswith("seconds"):
+        return -1
+    if name.endswith("_per_sec"):
+        return 1
+    return 0
+
+
+def index_results(document: dict) -> dict:
+    return {
+        (row["benchmark"], json.dumps(row["params"], sort_keys=True)): row["metrics"]
+        for row in document["results"]
+    }
+
+
+def compare(baseline: dict, candidate: dict, threshold: float):
+    """Yield (benchmark, params, metric, old, new, change_pct, regressed) for shared metrics"""
+    old_rows, new_rows = index_results(baseline), index_results(candidate)
+    for key in sorted(old_rows.keys() & new_rows.keys()):
+        old_metrics, new_metrics = old_rows[key], new_rows[key]
+        for metric in sorted(old_metrics.keys() & new_metrics.keys()):
+            old, new = old_metrics[metric], new_metrics[metric]
+            if not isinstance(old, (int, float)) or not isinstance(new, (int, float)) or old == 0:
+                continue
+            change = (new - old) / abs(old) * 100
+            direction = metric_direction(metric)
+            regressed = direction != 0 and -direction * change > threshold
+            yield key[0], key[1], metric, old, new, change, regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=10.0, help="percent change counted as a regression")
+    args = parser.parse_args(argv)
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    print(f"baseline  {baseline['meta'].get('git_commit')}")
+    print(f"candidate {candidate['meta'].get('git_commit')}")
+    regressions = 0
+    for benchmark, params, metric, old, new, change, regressed in compare(baseline, candidate, args.threshold):
+        flag = "REGRESSION" if regressed else ""
+        regressions += regressed
+        print(f"{benchmark:<12} {params:<48} {metric:<18} {old:>12.3f} {new:>12.3f} {change:>+8.1f}% {flag}")
+
+    if regressions:
+        print(f"{regressions} metric(s) regressed by more than {args.threshold}%")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""Export benchmark: server memory and throughput of streamed exports against the JSON endpoints.
+
+    python -m benchmarks.export --claims 100000,300000 --output export.json
+
+For each size, claims_list gets that many claims and claims_detail twice
+as many rows. Each request goes to a fresh ``uvicorn main:app`` process
+(offline models, auth bypassed) over real HTTP, since TestClient buffers
+streamed bodies. ``peak_rss_growth_mb`` is the server's peak RSS during
+the request above its RSS just before it (the peak is reset through
+/proc/<pid>/clear_refs). /claims and /text2sql build the whole result in
+memory; the exports should stay flat as the result grows.
+"""
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+
+from benchmarks.harness import ResultSet, make_claims_detail_csv, make_claims_list_csv, reset_tables
+from benchmarks.local_db import LocalDatabase
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEXT2SQL_SQL = """
+    SELECT d.id, d.claim_id, d.denial_reason, d.cpt_code_list, c.insurer_name, c.billed_amount
+    FROM claims_detail d JOIN claims_list c ON c.id = d.claim_id
+"""
+TEXT2SQL_QUESTION = "Which patients have billed amounts above the insurer average?"
+
+
+def int_list(value: str):
+    return [int(v) for v in value.split(",") if v]
+
+
+def serve(port: int):
+    """Runs inside the server subprocess"""
+    import uvicorn
+    from benchmarks.fakes import FakeChatModel, HashingEmbeddings
+    from benchmarks.harness import benchmark_user, load_app
+
+    app_module = load_app(os.environ["DATABASE_URL"], HashingEmbeddings(), FakeChatModel(sql=TEXT2SQL_SQL))
+    user = benchmark_user()
+    app_module.app.dependency_overrides[app_module.get_current_user] = lambda: user
+    app_module.app.dependency_overrides[app_module.get_admin_user] = lambda: user
+    uvicorn.run(app_module.app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def rss_kb(pid: int, field: str) -> int:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    return 0
+
+
+def request(url: str, body: dict = None):
+    """Read the whole response in 64 KiB reads; returns (seconds to first byte, seconds, bytes)"""
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"} if data else {})
+    start = time.perf_counter()
+    first_byte, size = None, 0
+    with urllib.request.urlopen(req, timeout=600) as response:
+        while True:
+            chunk = response.read(65536)
+            if first_byte is None:
+                first_byte = time.perf_counter() - start
+            if not chunk:
+                break
+            size += len(chunk)
+    return first_byte, time.perf_counter() - start, size
+
+
+def measure(database_url: str, port: int, path: str, body: dict = None) -> dict:
+    env = dict(os.environ, DATABASE_URL=database_url, STARTUP_WARMUP="imports,db_pool")
+    server = subprocess.Popen([sys.executable, "-m", "benchmarks.export", "--serve", "--port", str(port)],
+                              cwd=ROOT, env=env, stdout=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + 120
+        while True:
+            try:
+                with urllib.request.urlopen(f"{base_url}/status/ready", timeout=2) as response:
+                    if response.status == 200:
+                        break
+            except Exception:
+                if time.monotonic() > deadline:
+                    raise RuntimeError("server did not become ready")
+            time.sleep(0.2)
+        # Imports the export path (and pyarrow) before the peak is reset
+        request(f"{base_url}/claims/export?format=parquet&status=none")
+        with open(f"/proc/{server.pid}/clear_refs", "w") as f:
+            f.write("5")
+        rss_before = rss_kb(server.pid, "VmRSS")
+        first_byte, seconds, size = request(base_url + path, body)
+        peak = rss_kb(server.pid, "VmHWM")
+    finally:
+        server.terminate()
+        server.wait(timeout=60)
+    return {
+        "seconds": round(seconds, 3),
+        "first_byte_ms": round(first_byte * 1000, 1),
+        "response_mb": round(size / 2 ** 20, 1),
+        "peak_rss_growth_mb": round((peak - rss_before) / 1024, 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", help="write JSON results to this path")
+    parser.add_argument("--database-url", help="use this database instead of a throwaway one")
+    parser.add_argument("--claims", type=int_list, default=[100000, 300000])
+    parser.add_argument("--formats", default="csv,ndjson,arrow,parquet")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        serve(args.port)
+        return
+
+    results = ResultSet({k: v for k, v in vars(args).items() if k not in ("output", "database_url", "serve")})
+    formats = [f for f in args.formats.split(",") if f]
+    with LocalDatabase(args.database_url) as local_db:
+        os.environ["DATABASE_URL"] = local_db.url
+        from claims_loader import load_claims_csv
+        from database import create_tables, engine
+        create_tables()
+        for claims in args.claims:
+            reset_tables(engine, "claims_detail", "claims_list")
+            load_claims_csv(io.BytesIO(make_claims_list_csv(claims)), "claims_list", engine)
+            load_claims_csv(io.BytesIO(make_claims_detail_csv(claims * 2, claims)), "claims_detail", engine)
+
+            runs = [("claims", "json", "/claims", None)]
+            runs += [("claims", f, f"/claims/export?format={f}", None) for f in formats]
+            runs += [("text2sql", "json", "/text2sql", {"question": TEXT2SQL_QUESTION})]
+            runs += [("text2sql", f, "/text2sql/export", {"question": TEXT2SQL_QUESTION, "format": f}) for f in formats]
+            for source, export_format, path, body in runs:
+                rows = claims if source == "claims" else claims * 2
+                metrics = measure(local_db.url, args.port, path, body)
+                metrics["rows_per_sec"] = round(rows / metrics["seconds"], 1)
+                results.add("export", {"source": source, "format": export_format, "rows": rows}, metrics)
+                print(source, export_format, rows, metrics, flush=True)
+        engine.dispose()
+
+    if args.output:
+        results.write(args.output)
+
+
+if __name__ == "__main__":
+    main()
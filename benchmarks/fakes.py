@@ -0,0 +1,109 @@
+"""Deterministic stand-ins for the Gemini embedding and chat models"""
+import asyncio
+import hashlib
+import re
+import time
+from typing import Any, List, Optional
+
+import numpy as np
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from embedding_providers import EmbeddingProvider
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def count_tokens(text: str) -> int:
+    """Approximate token count used by the fake model's usage metadata"""
+    return len(TOKEN_PATTERN.findall(text))
+
+
+class HashingEmbeddings(EmbeddingProvider):
+    """Feature-hashing embedder: same text, same vector, no network.
+
+    Unigrams and bigrams are hashed with blake2b into a signed bag of words,
+    so texts sharing vocabulary land close together and retrieval results
+    are meaningful as well as reproducible across processes.
+    """
+
+    def __init__(self, dimension: int = 768, latency_ms: float = 0.0):
+        self.dimension = dimension
+        self.latency_ms = latency_ms
+        self.model_id = f"benchmark-hashing:{dimension}"
+
+    def _features(self, text: str):
+        tokens = TOKEN_PATTERN.findall(text.lower())
+        features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        indices = np.empty(len(features), dtype=np.int64)
+        signs = np.empty(len(features), dtype=np.float32)
+        for i, feature in enumerate(features):
+            digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+            value = int.from_bytes(digest, "little")
+            indices[i] = value % self.dimension
+            signs[i] = 1.0 if value >> 63 else -1.0
+        return indices, signs
+
+    def _embed(self, text: str) -> List[float]:
+        indices, signs = self._features(text)
+        vector = np.bincount(indices, weights=signs, minlength=self.dimension).astype(np.float32)
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        return self._embed(text)
+
+
+class FakeChatModel(BaseChatModel):
+    """Chat model returning canned replies after a configurable delay.
+
+    Prompts produced by the SQL query chain get ``sql`` back, everything else
+    gets ``answer``. The delay is ``latency_ms`` plus ``latency_per_token_ms``
+    for every output token, which approximates a streaming LLM backend.
+    """
+
+    answer: str = "This answer was generated offline by the benchmark model."
+    sql: str = "SELECT status, COUNT(*) AS claims FROM claims_list GROUP BY status"
+    latency_ms: float = 0.0
+    latency_per_token_ms: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "benchmark-fake-chat"
+
+    def _reply(self, messages: List[BaseMessage]):
+        prompt = "\n".join(str(message.content) for message in messages)
+        content = self.sql if "SQLQuery:" in prompt else self.answer
+        input_tokens, output_tokens = count_tokens(prompt), count_tokens(content)
+        message = AIMessage(
+            content=content,
+            usage_metadata={
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+                "total_tokens": input_tokens + output_tokens,
+            },
+        )
+        delay = (self.latency_ms + self.latency_per_token_ms * output_tokens) / 1000
+        return ChatResult(generations=[ChatGeneration(message=message)]), delay
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        result, delay = self._reply(messages)
+        time.sleep(delay)
+        return result
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        result, delay = self._reply(messages)
+        await asyncio.sleep(delay)
+        return result
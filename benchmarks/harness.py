@@ -0,0 +1,262 @@
+"""Shared plumbing for the benchmarks: app wiring, timing and synthetic data"""
+import json
+import os
+import platform
+import random
+import subprocess
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from typing import Dict, List
+
+CLAIM_STATUSES = ["Paid", "Denied", "Pending", "Partially Paid"]
+INSURERS = ["Aetna", "Blue Cross", "Cigna", "Humana", "Kaiser", "Medicare", "UnitedHealthcare"]
+DENIAL_REASONS = [
+    "Missing prior authorization",
+    "Service not covered",
+    "Duplicate claim",
+    "Incorrect patient information",
+    "Timely filing limit exceeded",
+]
+FIRST_NAMES = ["James", "Mary", "John", "Patricia", "Robert", "Jennifer", "Michael", "Linda", "David", "Elizabeth",
+               "William", "Barbara", "Richard", "Susan", "Joseph", "Jessica", "Thomas", "Sarah", "Carlos", "Maria",
+               "Wei", "Aisha", "Mohammed", "Priya", "Olga", "Kenji", "Fatima", "Diego", "Anna", "Sean"]
+LAST_NAMES = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez",
+              "Hernandez", "Lopez", "Gonzalez", "Wilson", "Anderson", "Thomas", "Taylor", "Moore", "Jackson", "Martin",
+              "Lee", "Perez", "Thompson", "White", "Harris", "Sanchez", "Clark", "Ramirez", "Lewis", "Robinson",
+              "Walker", "Young", "Allen", "King", "Wright", "Scott", "Torres", "Nguyen", "Hill", "Flores",
+              "Green", "Adams", "Nelson", "Baker", "Hall", "Rivera", "Campbell", "Mitchell", "Carter", "Roberts",
+              "O'Brien", "Kowalski", "Chen", "Patel", "Kim", "Schmidt", "Ivanova", "Tanaka", "Okafor", "Haddad"]
+CPT_CODES = ["99213", "99214", "99215", "93000", "36415", "80053", "85025", "71046", "99283", "97110"]
+
+
+def load_app(database_url: str, embeddings, llm):
+    """Import main against the given database with the offline models injected.
+
+    database.py builds its engine and vector column at import time, so
+    DATABASE_URL and EMBEDDING_DIMENSION have to be in the environment before
+    the first import of main.
+    """
+    os.environ["DATABASE_URL"] = database_url
+    os.environ["EMBEDDING_DIMENSION"] = str(embeddings.dimension)
+    os.environ.setdefault("GOOGLE_API_KEY", "offline-benchmark")
+    import main
+    main.use_models(embeddings=embeddings, llm=llm)
+    return main
+
+
+def benchmark_user():
+    """Admin user injected in place of JWT auth so bcrypt stays out of the numbers"""
+    from database import User, UserRole
+    return User(id=uuid.uuid4(), username="benchmark", email="benchmark@example.com", role=UserRole.ADMIN)
+
+
+def reset_tables(engine, *tables: str):
+    from sqlalchemy import text
+    with engine.begin() as conn:
+        conn.execute(text(f"TRUNCATE {', '.join(tables)} RESTART IDENTITY CASCADE"))
+
+
+@contextmanager
+def stopwatch():
+    """Yield a dict whose 'seconds' key is filled in when the block exits"""
+    timing = {}
+    start = time.perf_counter()
+    try:
+        yield timing
+    finally:
+        timing["seconds"] = time.perf_counter() - start
+
+
+def percentile(sorted_samples: List[float], q: float) -> float:
+    """Linearly interpolated percentile of pre-sorted samples, q in [0, 100]"""
+    if not sorted_samples:
+        return float("nan")
+    position = (len(sorted_samples) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_samples) - 1)
+    return sorted_samples[lower] + (sorted_samples[upper] - sorted_samples[lower]) * (position - lower)
+
+
+def latency_summary(samples_seconds: List[float], prefix: str = "") -> Dict[str, float]:
+    """Summarize latencies in milliseconds; keys end in _ms so compare.py knows lower is better"""
+    ordered = sorted(s * 1000 for s in samples_seconds)
+    return {
+        f"{prefix}count": len(ordered),
+        f"{prefix}mean_ms": round(sum(ordered) / len(ordered), 3) if ordered else float("nan"),
+        f"{prefix}p50_ms": round(percentile(ordered, 50), 3),
+        f"{prefix}p90_ms": round(percentile(ordered, 90), 3),
+        f"{prefix}p99_ms": round(percentile(ordered, 99), 3),
+        f"{prefix}max_ms": round(ordered[-1], 3) if ordered else float("nan"),
+    }
+
+
+class ResultSet:
+    """Collects benchmark rows and writes them as a single JSON document"""
+
+    def __init__(self, config: dict):
+        self.config = config
+        self.results = []
+
+    def add(self, benchmark: str, params: dict, metrics: dict):
+        self.results.append({"benchmark": benchmark, "params": params, "metrics": metrics})
+        print(f"{benchmark} {json.dumps(params, sort_keys=True)}: {json.dumps(metrics)}", flush=True)
+
+    def to_dict(self) -> dict:
+        return {"meta": run_metadata(self.config), "results": self.results}
+
+    def write(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2, default=str)
+
+
+def run_metadata(config: dict) -> dict:
+    def git(*args):
+        try:
+            return subprocess.run(["git", *args], capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    return {
+        "git_commit": git("rev-parse", "HEAD"),
+        "git_dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+        "timestamp": datetime.utcnow().isoformat() + "Z",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": config,
+    }
+
+
+def make_vocabulary(size: int = 2000, seed: int = 7) -> List[str]:
+    rng = random.Random(seed)
+    syllables = ["ka", "lo", "mi", "ra", "te", "su", "no", "vi", "pe", "da", "zu", "ho", "ri", "ma", "ne"]
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def synthetic_text(rng: random.Random, vocabulary: List[str], words: int) -> str:
+    return " ".join(rng.choice(vocabulary) for _ in range(words))
+
+
+def _pdf_escape(line: str) -> str:
+    return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def make_pdf(pages: List[List[str]]) -> bytes:
+    """Build a minimal text PDF (Helvetica, one line per entry) that PyPDF2 can extract"""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for lines in pages:
+        stream = "BT /F1 9 Tf 40 800 Td 11 TL " + " ".join(f"({_pdf_escape(line)}) Tj T*" for line in lines) + " ET"
+        stream_bytes = stream.encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream_bytes), stream_bytes))
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        page_ids.append(len(objects))
+    kids = " ".join(f"{i} 0 R" for i in page_ids).encode()
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref_offset = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset)
+    return bytes(out)
+
+
+def make_document_pdf(page_count: int, seed: int = 1, lines_per_page: int = 60, words_per_line: int = 12) -> bytes:
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary()
+    pages = [
+        [synthetic_text(rng, vocabulary, words_per_line) for _ in range(lines_per_page)]
+        for _ in range(page_count)
+    ]
+    return make_pdf(pages)
+
+
+def make_claims_list_csv(rows: int, seed: int = 11, names: bool = False) -> bytes:
+    """Claims with placeholder patient names, or with ``names`` realistic first and last names"""
+    rng = random.Random(seed)
+    start = date(2023, 1, 1)
+    lines = ["id|patient_name|billed_amount|paid_amount|status|insurer_name|discharge_date"]
+    for i in range(1, rows + 1):
+        billed = round(rng.uniform(100, 25000), 2)
+        status = rng.choice(CLAIM_STATUSES)
+        paid = 0.0 if status == "Denied" else round(billed * rng.uniform(0.3, 1.0), 2)
+        discharge = start + timedelta(days=rng.randint(0, 729))
+        patient = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}" if names else f"Patient {i:07d}"
+        lines.append(f"{i}|{patient}|{billed}|{paid}|{status}|{rng.choice(INSURERS)}|{discharge.isoformat()}")
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def make_claims_detail_csv(rows: int, claims: int, seed: int = 13, codes: List[str] = None) -> bytes:
+    """Detail rows with 1-3 CPT codes each; from ``codes`` they are drawn with a long tail,
+    codes[0] the most frequent (the rank is log-uniform), as in real claims"""
+    rng = random.Random(seed)
+    lines = ["id|claim_id|denial_reason|cpt_codes"]
+    for i in range(1, rows + 1):
+        reason = rng.choice(DENIAL_REASONS) if rng.random() < 0.3 else "N/A"
+        if codes:
+            picked = {codes[int(len(codes) ** rng.random()) - 1] for _ in range(rng.randint(1, 3))}
+            cpt_codes = ",".join(sorted(picked))
+        else:
+            cpt_codes = ",".join(rng.sample(CPT_CODES, rng.randint(1, 3)))
+        lines.append(f"{i}|{rng.randint(1, claims)}|{reason}|{cpt_codes}")
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def make_faiss_index(index_dir: str, embeddings, vectors: int, seed: int = 17, words_per_chunk: int = 60,
+                     block: int = 10000):
+    """LangChain FAISS index on disk, as the Streamlit apps save it, with random unit vectors"""
+    import faiss
+    import numpy as np
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from langchain_community.vectorstores import FAISS
+    from langchain_core.documents import Document
+    from embedding_providers import write_index_metadata
+
+    rng = random.Random(seed)
+    generator = np.random.default_rng(seed)
+    vocabulary = make_vocabulary()
+    index = faiss.IndexFlatL2(embeddings.dimension)
+    for start in range(0, vectors, block):
+        batch = generator.standard_normal((min(block, vectors - start), embeddings.dimension), dtype=np.float32)
+        index.add(batch / np.linalg.norm(batch, axis=1, keepdims=True))
+    ids = [str(uuid.UUID(int=rng.getrandbits(128))) for _ in range(vectors)]
+    docstore = InMemoryDocstore({
+        doc_id: Document(page_content=synthetic_text(rng, vocabulary, words_per_chunk),
+                         metadata={"source": f"doc-{i // 100}.pdf", "page": i % 100})
+        for i, doc_id in enumerate(ids)
+    })
+    FAISS(embeddings, index, docstore, dict(enumerate(ids))).save_local(index_dir)
+    write_index_metadata(index_dir, embeddings)
+
+
+def make_local_model(model_dir: str, vocab_size: int, hidden: int, tokens: List[str] = (), seed: int = 3) -> int:
+    """Random static embedding model in LocalEmbeddingProvider's layout; returns the matrix size in bytes.
+
+    ``tokens`` become the first vocabulary entries (e.g. make_vocabulary()
+    so synthetic text embeds meaningfully), padded to ``vocab_size``.
+    """
+    import numpy as np
+
+    os.makedirs(model_dir, exist_ok=True)
+    vocab = ["[UNK]"] + list(tokens)
+    vocab += [f"token{i}" for i in range(vocab_size - len(vocab))]
+    with open(os.path.join(model_dir, "vocab.txt"), "w") as f:
+        f.write("".join(f"{token}\n" for token in vocab))
+    vectors = np.random.default_rng(seed).standard_normal((len(vocab), hidden), dtype=np.float32)
+    np.save(os.path.join(model_dir, "embeddings.npy"), vectors)
+    return vectors.nbytes
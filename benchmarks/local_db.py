@@ -0,0 +1,44 @@
+"""Throwaway PostgreSQL + pgvector instance for running benchmarks locally"""
+import shutil
+import tempfile
+
+from sqlalchemy import create_engine, text
+
+
+class LocalDatabase:
+    """Start an embedded PostgreSQL server, or wrap an existing one.
+
+    With no URL a private server is started from the ``pgserver`` wheel
+    (PostgreSQL 16 with pgvector bundled) in a temporary directory and torn
+    down on exit, so runs never touch a developer's real database. Passing
+    ``url`` benchmarks against that server instead.
+    """
+
+    def __init__(self, url: str = None):
+        self.url = url
+        self._server = None
+        self._data_dir = None
+
+    def __enter__(self):
+        if self.url is None:
+            try:
+                import pgserver
+            except ImportError as e:
+                raise RuntimeError(
+                    "pgserver is required for the local database; "
+                    "pip install -r benchmarks/requirements.txt or pass --database-url"
+                ) from e
+            self._data_dir = tempfile.mkdtemp(prefix="pdfchat-bench-")
+            self._server = pgserver.get_server(self._data_dir, cleanup_mode="stop")
+            self.url = self._server.get_uri()
+
+        engine = create_engine(self.url)
+        with engine.begin() as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+        engine.dispose()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._server is not None:
+            self._server.cleanup()
+            shutil.rmtree(self._data_dir, ignore_errors=True)
@@ -0,0 +1,83 @@
+"""Routing cases for the Text2SQL question router: expected route and SQL per question.
+
+    python -m benchmarks.router_cases
+
+Runs offline against a fixed set of known insurer and status values, so no
+database is needed. A case expecting ``sql`` must fall back to the SQL
+chain (no fixed query); an ``aggregate`` case must produce exactly the
+given SQL, compared with whitespace normalised. Exits with status 1 when
+any case fails.
+"""
+import sys
+
+from claims_aggregates import route_question
+
+VALUES = [("insurer_name", name) for name in ["Aetna Health", "Blue Cross", "Cigna", "O'Brien Mutual"]] + [
+    ("status", status) for status in ["Paid", "Denied", "Pending", "Partially Paid"]
+]
+
+CASES = [
+    # Anything outside the known vocabulary and values goes to the SQL chain
+    ("How many claims in March?", "sql", None),
+    ("How many claims does John Smith have?", "sql", None),
+    ("Total billed for Aetna", "sql", None),
+    ("total paid for claims in Texas", "sql", None),
+    ("How many claims are under review?", "sql", None),
+    ("How many claims have no denial reason?", "sql", None),
+    ("Which patients have billed amounts above the insurer average?", "sql", None),
+    ("How many insurers are there?", "sql", None),
+    ("How many claims were denied by reason?", "aggregate",
+     "SELECT denial_reason, detail_count, claim_count FROM claims_agg_denial_reason "
+     "ORDER BY detail_count DESC, denial_reason"),
+    ("What are the denial reasons?", "aggregate",
+     "SELECT denial_reason, detail_count, claim_count FROM claims_agg_denial_reason "
+     "ORDER BY detail_count DESC, denial_reason"),
+    ("How many claims are there in each status?", "aggregate",
+     "SELECT status, SUM(claim_count) AS claim_count FROM claims_agg_status_month GROUP BY status ORDER BY status"),
+    ("How many claims per status per month?", "aggregate",
+     "SELECT month, status, SUM(claim_count) AS claim_count FROM claims_agg_status_month "
+     "GROUP BY month, status ORDER BY month, status"),
+    ("How many claims were paid?", "aggregate",
+     "SELECT SUM(claim_count) AS claim_count FROM claims_agg_status_month WHERE status IN ('Paid')"),
+    ("total paid for partially paid claims", "aggregate",
+     "SELECT SUM(total_paid) AS total_paid FROM claims_agg_status_month WHERE status IN ('Partially Paid')"),
+    ("How many denied claims per month?", "aggregate",
+     "SELECT month, SUM(claim_count) AS claim_count FROM claims_agg_status_month WHERE status IN ('Denied') "
+     "GROUP BY month ORDER BY month"),
+    ("How many claims were denied?", "aggregate",
+     "SELECT SUM(denied_count) AS denied_count FROM claims_agg_insurer"),
+    ("How many claims were denied by insurer?", "aggregate",
+     "SELECT insurer_name, SUM(denied_count) AS denied_count FROM claims_agg_insurer "
+     "GROUP BY insurer_name ORDER BY insurer_name"),
+    ("Total billed and paid by insurer", "aggregate",
+     "SELECT insurer_name, SUM(total_billed) AS total_billed, SUM(total_paid) AS total_paid FROM claims_agg_insurer "
+     "GROUP BY insurer_name ORDER BY insurer_name"),
+    ("Total billed for Aetna Health", "aggregate",
+     "SELECT insurer_name, SUM(total_billed) AS total_billed FROM claims_agg_insurer "
+     "WHERE insurer_name IN ('Aetna Health') GROUP BY insurer_name ORDER BY insurer_name"),
+    ("Total billed for O'Brien Mutual", "aggregate",
+     "SELECT insurer_name, SUM(total_billed) AS total_billed FROM claims_agg_insurer "
+     "WHERE insurer_name IN ('O''Brien Mutual') GROUP BY insurer_name ORDER BY insurer_name"),
+    ("What is the total billed and paid overall?", "aggregate",
+     "SELECT SUM(total_billed) AS total_billed, SUM(total_paid) AS total_paid FROM claims_agg_insurer"),
+]
+
+
+def normalise(sql):
+    return " ".join(sql.split()) if sql else None
+
+
+def main():
+    failures = 0
+    for question, route, sql in CASES:
+        result = route_question(None, question, values=VALUES)
+        got = result.name
+        if got != route or normalise(result.sql) != normalise(sql):
+            failures += 1
+            print(f"FAIL {question!r}\n  expected {route}: {sql}\n  got      {got}: {normalise(result.sql)}")
+    print(f"{len(CASES) - failures}/{len(CASES)} routing cases passed")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,845 @@
+"""Run the offline benchmark suite and write machine-readable results.
+
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.compare baseline.json results.json
+
+Gemini is replaced by HashingEmbeddings and FakeChatModel, and Postgres by
+a throwaway embedded server unless --database-url is given, so numbers are
+comparable between commits on the same machine.
+"""
+import argparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.fakes import FakeChatModel, HashingEmbeddings
+from benchmarks.harness import (
+    ResultSet, benchmark_user, latency_summary, load_app, make_claims_detail_csv,
+    make_claims_list_csv, make_document_pdf, make_faiss_index, make_local_model, make_vocabulary, reset_tables,
+    stopwatch, synthetic_text,
+)
+from benchmarks.local_db import LocalDatabase
+from embedding_providers import LocalEmbeddingProvider
+
+BENCHMARKS = ["upload", "chat", "chat_batch", "conversation", "text2sql", "csv", "cpt", "search", "migrate", "faiss", "reembed",
+              "shards"]
+
+
+def int_list(value: str):
+    return [int(v) for v in value.split(",") if v]
+
+
+def bench_upload(client, engine, results, args):
+    """Ingestion throughput of /upload: PDF parse, chunking, embedding and insert"""
+    for pages in args.pdf_pages:
+        pdf = make_document_pdf(pages, seed=pages)
+        samples, chunks = [], 0
+        for _ in range(args.upload_repeats):
+            reset_tables(engine, "document_chunks")
+            with stopwatch() as timing:
+                response = client.post("/upload", files=[("files", ("bench.pdf", pdf, "application/pdf"))])
+            response.raise_for_status()
+            chunks = response.json()["chunks_count"]
+            samples.append(timing["seconds"])
+        best = min(samples)
+        results.add("upload", {"pages": pages}, {
+            "chunks": chunks,
+            "pdf_bytes": len(pdf),
+            "seconds": round(best, 4),
+            "pages_per_sec": round(pages / best, 2),
+            "chunks_per_sec": round(chunks / best, 2),
+            **latency_summary(samples),
+        })
+
+
+def seed_chunks(engine, embeddings, count: int, words_per_chunk: int):
+    from sqlalchemy import insert
+    from database import DocumentChunk
+
+    rng = random.Random(count)
+    vocabulary = make_vocabulary()
+    batch = []
+    with engine.begin() as conn:
+        for i in range(count):
+            content = synthetic_text(rng, vocabulary, words_per_chunk)
+            batch.append({
+                "content": content,
+                "embedding": embeddings.embed_query(content),
+                "embedding_model": embeddings.model_id,
+                "document_name": "benchmark.pdf",
+                "chunk_index": i,
+            })
+            if len(batch) == 1000:
+                conn.execute(insert(DocumentChunk), batch)
+                batch = []
+        if batch:
+            conn.execute(insert(DocumentChunk), batch)
+        conn.exec_driver_sql("ANALYZE document_chunks")
+
+
+def bench_chat(client, main, results, args):
+    """Retrieval (embed + vector search) and end-to-end /chat latency by corpus size"""
+    from database import SessionLocal, engine
+
+    rng = random.Random(0)
+    vocabulary = make_vocabulary()
+    questions = [synthetic_text(rng, vocabulary, 12) for _ in range(args.requests)]
+    embeddings = main.get_embeddings()
+
+    for corpus in args.corpus_sizes:
+        reset_tables(engine, "document_chunks", "chat_history")
+        seed_chunks(engine, embeddings, corpus, args.words_per_chunk)
+
+        embed_samples, search_samples = [], []
+        db = SessionLocal()
+        try:
+            for question in questions[:args.warmup]:
+                main.search_similar_chunks(db, embeddings.embed_query(question), embeddings.model_id)
+            for question in questions:
+                with stopwatch() as embed_timing:
+                    query_embedding = embeddings.embed_query(question)
+                with stopwatch() as search_timing:
+                    main.search_similar_chunks(db, query_embedding, embeddings.model_id)
+                embed_samples.append(embed_timing["seconds"])
+                search_samples.append(search_timing["seconds"])
+        finally:
+            db.close()
+        results.add("retrieval", {"corpus_chunks": corpus}, {
+            **latency_summary([e + s for e, s in zip(embed_samples, search_samples)]),
+            **latency_summary(search_samples, prefix="search_"),
+        })
+
+        for question in questions[:args.warmup]:
+            client.post("/chat", json={"question": question}).raise_for_status()
+        samples = []
+        for question in questions:
+            with stopwatch() as timing:
+                response = client.post("/chat", json={"question": question})
+            response.raise_for_status()
+            samples.append(timing["seconds"])
+        results.add("chat", {"corpus_chunks": corpus, "llm_latency_ms": args.llm_latency_ms},
+                    latency_summary(samples))
+
+
+def bench_chat_batch(client, main, results, args):
+    """Questions per second of /chat/batch by batch size, against the same questions sent one by one to /chat"""
+    import json
+    from database import SessionLocal, engine
+    from embedding_providers import embed_queries
+
+    rng = random.Random(2)
+    vocabulary = make_vocabulary()
+    questions = [synthetic_text(rng, vocabulary, 12) for _ in range(max(args.batch_sizes))]
+    embeddings = main.get_embeddings()
+    corpus = args.corpus_sizes[-1]
+    reset_tables(engine, "document_chunks", "chat_history")
+    seed_chunks(engine, embeddings, corpus, args.words_per_chunk)
+    client.post("/chat/batch", json={"questions": questions[:args.warmup]}).raise_for_status()
+
+    for size in args.batch_sizes:
+        batch = questions[:size]
+        db = SessionLocal()
+        try:
+            with stopwatch() as one_by_one:
+                for question in batch:
+                    main.search_similar_chunks(db, embeddings.embed_query(question), embeddings.model_id)
+            with stopwatch() as batched:
+                main.search_similar_chunks_batch(db, embed_queries(embeddings, batch), embeddings.model_id)
+        finally:
+            db.close()
+
+        with stopwatch() as sequential:
+            for question in batch:
+                client.post("/chat", json={"question": question}).raise_for_status()
+
+        # TestClient hands over the body once it is complete, so only the total is timed here
+        answered, failed = 0, 0
+        with stopwatch() as timing:
+            with client.stream("POST", "/chat/batch", json={"questions": batch}) as response:
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    item = json.loads(line)
+                    answered += item["error"] is None
+                    failed += item["error"] is not None
+        results.add("chat_batch", {"corpus_chunks": corpus, "batch_size": size, "llm_latency_ms": args.llm_latency_ms,
+                                   "embed_latency_ms": args.embed_latency_ms}, {
+            "answered": answered,
+            "failed": failed,
+            "retrieval_one_by_one_ms": round(one_by_one["seconds"] * 1000, 3),
+            "retrieval_batched_ms": round(batched["seconds"] * 1000, 3),
+            "sequential_seconds": round(sequential["seconds"], 4),
+            "batch_seconds": round(timing["seconds"], 4),
+            "sequential_questions_per_sec": round(size / sequential["seconds"], 2),
+            "batch_questions_per_sec": round(size / timing["seconds"], 2),
+        })
+
+
+def bench_conversation(client, engine, embeddings, results, args):
+    """Prompt tokens and latency per turn of one long /chat session.
+
+    For comparison, the same turns are sent statelessly with the previous
+    exchanges pasted into the question, which is what users had to do before
+    sessions existed.
+    """
+    rng = random.Random(1)
+    vocabulary = make_vocabulary()
+    questions = [synthetic_text(rng, vocabulary, 12) for _ in range(args.conversation_turns)]
+    reset_tables(engine, "document_chunks", "chat_history", "chat_sessions")
+    seed_chunks(engine, embeddings, args.corpus_sizes[0], args.words_per_chunk)
+
+    session_id = client.post("/chat/sessions").json()["session_id"]
+    transcript = []
+    runs = {"session": ([], []), "pasted_history": ([], [])}
+    for question in questions:
+        for mode, (tokens, samples) in runs.items():
+            if mode == "session":
+                payload = {"question": question, "session_id": session_id}
+            else:
+                payload = {"question": "\n".join(transcript + [question])}
+            with stopwatch() as timing:
+                response = client.post("/chat", json=payload)
+            response.raise_for_status()
+            samples.append(timing["seconds"])
+            tokens.append(response.json()["prompt_tokens"])
+        transcript.append(f"Q: {question}\nA: {response.json()['answer']}")
+
+    for mode, (tokens, samples) in runs.items():
+        results.add("conversation", {"mode": mode, "turns": args.conversation_turns,
+                                     "llm_latency_ms": args.llm_latency_ms}, {
+            "prompt_tokens_first_turn": tokens[0],
+            "prompt_tokens_last_turn": tokens[-1],
+            "prompt_tokens_max": max(tokens),
+            **latency_summary(samples),
+        })
+
+
+def bench_text2sql(client, engine, llm, results, args):
+    """/text2sql latency by route with a fixed model delay; overhead is everything except the model.
+
+    The aggregate question is answered from the precomputed claims
+    aggregates; the other one goes through the SQL chain, whose fake model
+    returns a full-table aggregate.
+    """
+    from sqlalchemy import text
+
+    reset_tables(engine, "claims_detail", "claims_list")
+    csv = make_claims_list_csv(args.text2sql_rows)
+    client.post("/upload-csv", files={"file": ("claims.csv", csv, "text/csv")},
+                data={"table_name": "claims_list"}).raise_for_status()
+
+    sql_samples = []
+    with engine.connect() as conn:
+        for _ in range(args.requests):
+            with stopwatch() as timing:
+                conn.execute(text(llm.sql)).fetchall()
+            sql_samples.append(timing["seconds"])
+
+    questions = {
+        "aggregate": "How many claims are there in each status?",
+        "sql_hint": "Which patients have billed amounts above the insurer average?",
+    }
+    for route, question in questions.items():
+        payload = {"question": question, "top_k": 3}
+        for _ in range(args.warmup):
+            client.post("/text2sql", json=payload).raise_for_status()
+        samples = []
+        for _ in range(args.requests):
+            with stopwatch() as timing:
+                response = client.post("/text2sql", json=payload)
+            response.raise_for_status()
+            samples.append(timing["seconds"])
+        if response.json()["route"] != route:
+            raise RuntimeError(f"{question!r} took route {response.json()['route']}, expected {route}")
+
+        summary = latency_summary(samples)
+        model_ms = args.llm_latency_ms if route != "aggregate" else 0
+        results.add("text2sql", {"route": route, "claims_rows": args.text2sql_rows,
+                                 "llm_latency_ms": args.llm_latency_ms}, {
+            **summary,
+            **latency_summary(sql_samples, prefix="sql_exec_"),
+            "overhead_p50_ms": round(summary["p50_ms"] - model_ms, 3),
+            "overhead_p99_ms": round(summary["p99_ms"] - model_ms, 3),
+        })
+
+
+class TableReader:
+    """Background thread querying claims_list while a load runs, to check readers never see it empty"""
+
+    def __init__(self, engine, interval: float = 0.01):
+        import threading
+        self.engine = engine
+        self.interval = interval
+        self.samples, self.empty_reads = [], 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        from sqlalchemy import text
+        with self.engine.connect() as conn:
+            while not self._stop.wait(self.interval):
+                with stopwatch() as timing:
+                    count = conn.execute(text("SELECT COUNT(*) FROM claims_agg_insurer")).scalar()
+                    exists = conn.execute(text("SELECT EXISTS (SELECT 1 FROM claims_list)")).scalar()
+                conn.rollback()
+                self.samples.append(timing["seconds"])
+                if not count or not exists:
+                    self.empty_reads += 1
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def bench_csv(client, engine, results, args):
+    """/upload-csv load rate for claims_list and claims_detail, and reader availability during a reload"""
+    def upload(table_name, csv, mode="replace"):
+        with stopwatch() as timing:
+            response = client.post("/upload-csv", files={"file": (f"{table_name}.csv", csv, "text/csv")},
+                                   data={"table_name": table_name, "mode": mode})
+        response.raise_for_status()
+        return timing["seconds"]
+
+    for rows in args.csv_rows:
+        reset_tables(engine, "claims_detail", "claims_list")
+        claims_csv = make_claims_list_csv(rows)
+        for table_name, csv in (("claims_list", claims_csv), ("claims_detail", make_claims_detail_csv(rows, rows))):
+            seconds = upload(table_name, csv)
+            results.add("upload_csv", {"table": table_name, "rows": rows, "mode": "replace"}, {
+                "seconds": round(seconds, 4),
+                "rows_per_sec": round(rows / seconds, 2),
+                "csv_bytes": len(csv),
+            })
+
+        seconds = upload("claims_list", claims_csv, mode="upsert")
+        results.add("upload_csv", {"table": "claims_list", "rows": rows, "mode": "upsert"}, {
+            "seconds": round(seconds, 4),
+            "rows_per_sec": round(rows / seconds, 2),
+        })
+
+        with TableReader(engine) as reader:
+            seconds = upload("claims_list", claims_csv)
+        results.add("upload_csv_concurrent_reads", {"rows": rows}, {
+            "load_seconds": round(seconds, 4),
+            "empty_reads": reader.empty_reads,
+            **latency_summary(reader.samples, prefix="read_"),
+        })
+
+
+def bench_cpt(client, engine, results, args):
+    """CPT code lookups on claims_detail: LIKE over the raw text against the GIN-indexed cpt_code_list.
+
+    Codes have a long-tailed frequency, so lookups are timed for the most
+    common code and those at the 10th and 50th percentile of ranks.
+    """
+    from sqlalchemy import text
+
+    rows = args.cpt_detail_rows
+    claims = max(rows // 5, 1)
+    rng = random.Random(9)
+    codes = sorted({f"{rng.randint(10000, 99999)}" for _ in range(args.cpt_codes)})
+    reset_tables(engine, "claims_detail", "claims_list")
+    for table_name, csv in (("claims_list", make_claims_list_csv(claims)),
+                            ("claims_detail", make_claims_detail_csv(rows, claims, codes=codes))):
+        with stopwatch() as load:
+            client.post("/upload-csv", files={"file": (f"{table_name}.csv", csv, "text/csv")},
+                        data={"table_name": table_name}).raise_for_status()
+    results.add("cpt_load", {"rows": rows, "codes": len(codes)}, {
+        "detail_load_seconds": round(load["seconds"], 4),
+        "rows_per_sec": round(rows / load["seconds"], 2),
+    })
+
+    filters = {
+        "like": "d.cpt_codes LIKE '%' || :code || '%'",
+        "cpt_code_list": "d.cpt_code_list @> ARRAY[CAST(:code AS text)]",
+    }
+    queries = {
+        "count": "SELECT COUNT(*) FROM claims_detail d WHERE {filter}",
+        "by_insurer": """
+            SELECT c.insurer_name, COUNT(*) FROM claims_detail d JOIN claims_list c ON c.id = d.claim_id
+            WHERE {filter} GROUP BY c.insurer_name
+        """,
+    }
+    repeats = max(args.requests // 5, 3)
+    with engine.connect() as conn:
+        for rank, code in (("most_common", codes[0]), ("p10", codes[len(codes) // 10]), ("p50", codes[len(codes) // 2])):
+            for query_name, query in queries.items():
+                for method, condition in filters.items():
+                    sql = text(query.format(filter=condition))
+                    conn.execute(sql, {"code": code}).fetchall()
+                    samples = []
+                    for _ in range(repeats):
+                        with stopwatch() as timing:
+                            result = conn.execute(sql, {"code": code}).fetchall()
+                        samples.append(timing["seconds"])
+                    matches = sum(row[-1] for row in result)
+                    results.add("cpt_lookup", {"rows": rows, "code": rank, "query": query_name, "method": method},
+                                {"matches": matches, **latency_summary(samples)})
+
+
+def bench_search(client, engine, results, args):
+    """/claims/search latency by kind of query, against an unindexed ILIKE scan of the same columns.
+
+    Claims get realistic names; "typo" only finds anything when pg_trgm is
+    installed (``fuzzy`` in the results).
+    """
+    from sqlalchemy import text
+
+    claims = args.search_claims
+    reset_tables(engine, "claims_detail", "claims_list")
+    for table_name, csv in (("claims_list", make_claims_list_csv(claims, names=True)),
+                            ("claims_detail", make_claims_detail_csv(claims * 3, claims))):
+        client.post("/upload-csv", files={"file": (f"{table_name}.csv", csv, "text/csv")},
+                    data={"table_name": table_name}).raise_for_status()
+
+    queries = {
+        "full_name": "Kenji Tanaka",
+        "name_prefixes": "tana ken",
+        "last_name": "Kowalski",
+        "typo": "Kenji Tanka",
+        "insurer": "Humana",
+        "denial_reason": "prior authorization",
+    }
+    scan = text("""
+        SELECT c.id FROM claims_list c
+        WHERE c.patient_name ILIKE :pattern OR c.insurer_name ILIKE :pattern
+           OR EXISTS (SELECT 1 FROM claims_detail d WHERE d.claim_id = c.id AND d.denial_reason ILIKE :pattern)
+        ORDER BY c.id LIMIT 20
+    """)
+    for name, query in queries.items():
+        for _ in range(args.warmup):
+            client.get("/claims/search", params={"q": query}).raise_for_status()
+        samples = []
+        for _ in range(args.requests):
+            with stopwatch() as timing:
+                response = client.get("/claims/search", params={"q": query})
+            response.raise_for_status()
+            samples.append(timing["seconds"])
+        body = response.json()
+
+        scan_samples = []
+        with engine.connect() as conn:
+            for _ in range(max(args.requests // 5, 3)):
+                with stopwatch() as timing:
+                    conn.execute(scan, {"pattern": f"%{query}%"}).fetchall()
+                scan_samples.append(timing["seconds"])
+        results.add("claims_search", {"claims": claims, "query": name}, {
+            "first_page": len(body["results"]),
+            "more_pages": body["next_offset"] is not None,
+            "fuzzy": body["fuzzy"],
+            **latency_summary(samples),
+            **latency_summary(scan_samples, prefix="ilike_scan_"),
+        })
+
+
+def run_migration(database_url: str, index_dir: str, args, kill_at: int = None):
+    """Run migrate_faiss_to_pgvector.py in a child process; returns (seconds, peak RSS in MB).
+
+    With ``kill_at`` the child is killed once that many vectors are checkpointed.
+    """
+    from sqlalchemy import text
+    from database import engine
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, DATABASE_URL=database_url, EMBEDDING_DIMENSION=str(args.embedding_dimension))
+    command = [sys.executable, os.path.join(root, "migrate_faiss_to_pgvector.py"), "--index-dir", index_dir,
+               "--batch-size", str(args.migrate_batch_size), "--no-backup"]
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=root, env=env, stdout=subprocess.DEVNULL)
+    while kill_at is not None and process.poll() is None:
+        with engine.connect() as conn:
+            migrated = conn.execute(text("SELECT max(migrated) FROM faiss_migrations")).scalar()
+        if migrated is not None and migrated >= kill_at:
+            process.kill()
+            break
+        time.sleep(0.05)
+    _, status, usage = os.wait4(process.pid, 0)
+    seconds = time.perf_counter() - start
+    if kill_at is None and os.waitstatus_to_exitcode(status) != 0:
+        raise RuntimeError(f"migration exited with {os.waitstatus_to_exitcode(status)}")
+    # ru_maxrss is in kilobytes on Linux
+    return seconds, usage.ru_maxrss / 1024
+
+
+def bench_migrate(engine, embeddings, database_url, results, args):
+    """FAISS-to-pgvector migration rate and peak memory, and resuming after the process is killed"""
+    from sqlalchemy import text
+
+    for vectors in args.migrate_vectors:
+        with tempfile.TemporaryDirectory() as tmp:
+            index_dir = os.path.join(tmp, "faiss_index")
+            make_faiss_index(index_dir, embeddings, vectors)
+            index_bytes = os.path.getsize(os.path.join(index_dir, "index.faiss"))
+
+            reset_tables(engine, "document_chunks", "faiss_migrations")
+            seconds, peak_mb = run_migration(database_url, index_dir, args)
+            results.add("migrate_faiss", {"vectors": vectors, "batch_size": args.migrate_batch_size}, {
+                "seconds": round(seconds, 4),
+                "vectors_per_sec": round(vectors / seconds, 2),
+                "peak_rss_mb": round(peak_mb, 1),
+                "index_mb": round(index_bytes / 2 ** 20, 1),
+            })
+
+            reset_tables(engine, "document_chunks", "faiss_migrations")
+            run_migration(database_url, index_dir, args, kill_at=vectors // 2)
+            with engine.connect() as conn:
+                resumed_at = conn.execute(text("SELECT migrated FROM faiss_migrations")).scalar()
+            seconds, _ = run_migration(database_url, index_dir, args)
+            with engine.connect() as conn:
+                rows, positions = conn.execute(
+                    text("SELECT COUNT(*), COUNT(DISTINCT chunk_index) FROM document_chunks")
+                ).one()
+            results.add("migrate_faiss_resume", {"vectors": vectors}, {
+                "resumed_at": resumed_at,
+                "resume_seconds": round(seconds, 4),
+                "rows": rows,
+                "duplicate_rows": rows - positions,
+                "missing_rows": vectors - positions,
+            })
+
+
+def bench_faiss(embeddings, results, args):
+    """Streamlit apps' FAISS path: load per question vs the cached index, and re-processing a PDF"""
+    import faiss_store
+    from langchain_community.vectorstores import FAISS
+
+    rng = random.Random(5)
+    vocabulary = make_vocabulary()
+    questions = [synthetic_text(rng, vocabulary, 12) for _ in range(args.requests)]
+    pdf_chunks = [synthetic_text(rng, vocabulary, 200) for _ in range(50)]
+    for vectors in args.faiss_vectors:
+        with tempfile.TemporaryDirectory() as tmp:
+            index_dir = os.path.join(tmp, "faiss_index")
+            make_faiss_index(index_dir, embeddings, vectors)
+
+            samples = []
+            for question in questions[:10]:
+                with stopwatch() as timing:
+                    store = FAISS.load_local(index_dir, embeddings, allow_dangerous_deserialization=True)
+                    store.similarity_search(question)
+                samples.append(timing["seconds"])
+            results.add("faiss_question", {"vectors": vectors, "index": "load_local"}, latency_summary(samples))
+
+            faiss_store._cache.clear()
+            with stopwatch() as cold:
+                faiss_store.load_index(index_dir, embeddings).similarity_search(questions[0])
+            samples = []
+            for question in questions:
+                with stopwatch() as timing:
+                    faiss_store.load_index(index_dir, embeddings).similarity_search(question)
+                samples.append(timing["seconds"])
+            results.add("faiss_question", {"vectors": vectors, "index": "cached_mmap"}, {
+                "cold_ms": round(cold["seconds"] * 1000, 3), **latency_summary(samples),
+            })
+
+            with stopwatch() as rebuild:
+                FAISS.from_texts(pdf_chunks, embeddings).save_local(os.path.join(tmp, "rebuilt"))
+            with stopwatch() as first:
+                added, _ = faiss_store.update_index(index_dir, embeddings, {"bench.pdf": pdf_chunks})
+            with stopwatch() as again:
+                unchanged, _ = faiss_store.update_index(index_dir, embeddings, {"bench.pdf": pdf_chunks})
+            with stopwatch() as edited:
+                changed, removed = faiss_store.update_index(
+                    index_dir, embeddings, {"bench.pdf": pdf_chunks[:-1] + ["an edited last chunk"]}
+                )
+            results.add("faiss_process_pdf", {"vectors": vectors, "chunks": len(pdf_chunks)}, {
+                "from_texts_seconds": round(rebuild["seconds"], 4),
+                "first_update_seconds": round(first["seconds"], 4),
+                "first_update_embedded": added,
+                "unchanged_update_seconds": round(again["seconds"], 4),
+                "unchanged_update_embedded": unchanged,
+                "one_chunk_edit_seconds": round(edited["seconds"], 4),
+                "one_chunk_edit_embedded": changed,
+                "one_chunk_edit_removed": removed,
+            })
+
+
+def bench_reembed(client, main, results, args):
+    """Re-embedding the corpus with a second model while /chat and /upload keep serving.
+
+    /chat latency is measured before, during the background run, after
+    activating the new version and after rolling back. Chunks uploaded
+    during the run are checked for a vector in the new version straight
+    away, i.e. written by the upload rather than the backfill.
+    """
+    import threading
+    from sqlalchemy import text
+    import embedding_versions
+    from database import engine
+
+    rng = random.Random(3)
+    vocabulary = make_vocabulary()
+    questions = [synthetic_text(rng, vocabulary, 12) for _ in range(args.requests)]
+    embeddings = main.get_embeddings()
+    pdf = make_document_pdf(5, seed=3)
+
+    with engine.begin() as conn:
+        tables = conn.execute(text("SELECT table_name FROM embedding_versions WHERE table_name <> 'document_chunks'"))
+        for (table_name,) in tables.fetchall():
+            conn.execute(text(f"DROP TABLE IF EXISTS {table_name}"))
+    reset_tables(engine, "embedding_versions", "document_chunks", "chat_history")
+    seed_chunks(engine, embeddings, args.reembed_chunks, args.words_per_chunk)
+
+    def ask(count=None):
+        samples, failed = [], 0
+        for question in questions[:count]:
+            with stopwatch() as timing:
+                failed += client.post("/chat", json={"question": question}).status_code != 200
+            samples.append(timing["seconds"])
+        return samples, failed
+
+    def record(phase, samples, failed):
+        results.add("reembed_chat", {"phase": phase, "corpus_chunks": args.reembed_chunks,
+                                     "max_rate": args.reembed_max_rate}, {"failed": failed, **latency_summary(samples)})
+
+    ask(args.warmup)
+    record("before", *ask())
+
+    with tempfile.TemporaryDirectory() as tmp:
+        make_local_model(tmp, len(vocabulary) + 1, args.reembed_dimension, tokens=vocabulary)
+        embedding_versions.create_version("bench", "local", args.reembed_dimension, model_dir=tmp,
+                                          default_model_id=embeddings.model_id)
+        version = embedding_versions.active_version(refresh=True)
+        assert version.is_default
+
+        run = {}
+        def backfill():
+            with stopwatch() as timing:
+                run["embedded"] = embedding_versions.run_version(
+                    "bench", args.reembed_batch_size, args.reembed_max_rate, report=lambda line: None
+                )
+            run["seconds"] = timing["seconds"]
+        worker = threading.Thread(target=backfill)
+        worker.start()
+        samples, failed, uploaded, missing = [], 0, 0, 0
+        while worker.is_alive():
+            more, more_failed = ask(10)
+            samples += more
+            failed += more_failed
+            response = client.post("/upload", files=[("files", ("during.pdf", pdf, "application/pdf"))])
+            failed += response.status_code != 200
+            uploaded += response.json().get("chunks_count", 0) if response.status_code == 200 else 0
+            with engine.connect() as conn:
+                missing = conn.execute(text("""
+                    SELECT COUNT(*) FROM document_chunks c WHERE c.document_name = 'during.pdf'
+                    AND NOT EXISTS (SELECT 1 FROM chunk_embeddings_bench e WHERE e.chunk_id = c.id)
+                """)).scalar()
+        worker.join()
+        record("during_run", samples, failed)
+        results.add("reembed", {"corpus_chunks": args.reembed_chunks, "dimension": args.reembed_dimension,
+                                "batch_size": args.reembed_batch_size, "max_rate": args.reembed_max_rate}, {
+            "chunks_embedded": run["embedded"],
+            "seconds": round(run["seconds"], 3),
+            "chunks_per_sec": round(run["embedded"] / run["seconds"], 1),
+            "chunks_uploaded_during_run": uploaded,
+            "uploaded_chunks_missing_new_vector": missing,
+        })
+
+        with stopwatch() as switch:
+            embedding_versions.activate_version("bench")
+        record("after_activate", *ask())
+        with stopwatch() as rollback:
+            embedding_versions.rollback_version()
+        record("after_rollback", *ask())
+        results.add("reembed_switch", {"corpus_chunks": args.reembed_chunks}, {
+            "activate_ms": round(switch["seconds"] * 1000, 3),
+            "rollback_ms": round(rollback["seconds"] * 1000, 3),
+        })
+        embedding_versions.retire_version("bench", drop=True)
+
+
+def seed_random_vectors(engine, count: int, dimension: int, model_id: str, seed: int = 0, batch_size: int = 2000):
+    """Unit-length random vectors as document_chunks; returns them (float32, in id order)"""
+    import numpy as np
+    from sqlalchemy import text
+
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((count, dimension), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    with engine.begin() as conn:
+        for start in range(0, count, batch_size):
+            batch = vectors[start:start + batch_size]
+            conn.execute(text("""
+                INSERT INTO document_chunks (content, embedding, embedding_model, document_name, chunk_index)
+                SELECT 'chunk ' || i, v, :model_id, 'benchmark.pdf', i
+                FROM unnest(CAST(:vectors AS vector[])) WITH ORDINALITY AS t(v, i)
+            """), {"vectors": ["[" + ",".join(map(repr, row.tolist())) + "]" for row in batch], "model_id": model_id})
+        conn.exec_driver_sql("ANALYZE document_chunks")
+    return vectors
+
+
+def bench_shards(main, results, args):
+    """p50/p99 of one nearest-neighbour query (k=4) in the sharded in-memory index by shard count and corpus size.
+
+    pgvector's exact scan (search_similar_chunks without the index) is the
+    baseline; ``recall`` is the share of pgvector's top 4 the index returns.
+    After the shard runs, 1000 chunks are added and the incremental sync is timed,
+    then a sync with nothing to apply.
+    """
+    import numpy as np
+    from database import SessionLocal, engine
+    from vector_shards import SyncedVectorIndex
+
+    model_id = main.get_embeddings().model_id
+    rng = np.random.default_rng(42)
+    queries = rng.standard_normal((args.shard_queries, args.embedding_dimension), dtype=np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    queries = queries.tolist()
+    for corpus in args.shard_corpus_sizes:
+        reset_tables(engine, "document_chunks", "chat_history")
+        seed_random_vectors(engine, corpus, args.embedding_dimension, model_id, seed=corpus)
+
+        db = SessionLocal()
+        try:
+            expected = [[row.id for row in main.search_similar_chunks(db, query, model_id)]
+                        for query in queries[:args.warmup]]
+            samples = []
+            for query in queries[:max(args.shard_queries // 4, 20)]:
+                with stopwatch() as timing:
+                    expected.append([row.id for row in main.search_similar_chunks(db, query, model_id)])
+                samples.append(timing["seconds"])
+        finally:
+            db.close()
+        expected = expected[args.warmup:]
+        results.add("vector_shards", {"corpus_chunks": corpus, "engine": "pgvector", "shards": 0},
+                    latency_summary(samples))
+
+        for shards in args.shard_counts:
+            index = SyncedVectorIndex(lambda: (model_id, None), shards, threads=args.shard_threads or None,
+                                      engine=engine)
+            with stopwatch() as build:
+                index.sync()
+            for query in queries[:args.warmup]:
+                index.search([query], model_id, None)
+            samples, found = [], 0
+            for i, query in enumerate(queries):
+                with stopwatch() as timing:
+                    matches = index.search([query], model_id, None)[0]
+                samples.append(timing["seconds"])
+                if i < len(expected):
+                    found += len(set(chunk_id for _, chunk_id in matches) & set(expected[i]))
+            stats = index.stats()
+            results.add("vector_shards", {"corpus_chunks": corpus, "engine": "sharded", "shards": shards}, {
+                "threads": stats["threads"],
+                "build_seconds": round(build["seconds"], 3),
+                "index_mb": round(corpus * args.embedding_dimension * 4 / 2 ** 20, 1),
+                "recall": round(found / (4 * len(expected)), 4),
+                "largest_shard": max(stats["shard_sizes"]),
+                **latency_summary(samples),
+            })
+
+        seed_random_vectors(engine, 1000, args.embedding_dimension, model_id, seed=corpus + 1)
+        with stopwatch() as sync:
+            added = index.sync()
+        with stopwatch() as idle:
+            index.sync()
+        results.add("vector_shards_sync", {"corpus_chunks": corpus, "added_chunks": 1000}, {
+            "synced": added,
+            "sync_ms": round(sync["seconds"] * 1000, 3),
+            "unchanged_sync_ms": round(idle["seconds"] * 1000, 3),
+        })
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", help="write JSON results to this path")
+    parser.add_argument("--database-url", help="benchmark against this database instead of a throwaway one")
+    parser.add_argument("--only", default=",".join(BENCHMARKS), help="comma-separated subset of " + ",".join(BENCHMARKS))
+    parser.add_argument("--requests", type=int, default=50, help="timed requests per latency benchmark")
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--pdf-pages", type=int_list, default=[10, 50, 200])
+    parser.add_argument("--upload-repeats", type=int, default=3)
+    parser.add_argument("--corpus-sizes", type=int_list, default=[100, 1000, 10000])
+    parser.add_argument("--words-per-chunk", type=int, default=200)
+    parser.add_argument("--batch-sizes", type=int_list, default=[1, 10, 50, 100], help="questions per /chat/batch request")
+    parser.add_argument("--conversation-turns", type=int, default=30)
+    parser.add_argument("--text2sql-rows", type=int, default=10000)
+    parser.add_argument("--csv-rows", type=int_list, default=[10000, 100000, 1000000])
+    parser.add_argument("--cpt-detail-rows", type=int, default=1000000)
+    parser.add_argument("--cpt-codes", type=int, default=5000, help="distinct CPT codes in the generated details")
+    parser.add_argument("--search-claims", type=int, default=200000, help="claims (with 3 detail rows each) to search")
+    parser.add_argument("--migrate-vectors", type=int_list, default=[10000, 100000])
+    parser.add_argument("--migrate-batch-size", type=int, default=5000)
+    parser.add_argument("--faiss-vectors", type=int_list, default=[10000, 100000])
+    parser.add_argument("--reembed-chunks", type=int, default=20000)
+    parser.add_argument("--reembed-dimension", type=int, default=256, help="dimension of the new embedding version")
+    parser.add_argument("--reembed-batch-size", type=int, default=256)
+    parser.add_argument("--reembed-max-rate", type=float, default=0.0, help="throttle in chunks/s (0 = unthrottled)")
+    parser.add_argument("--shard-corpus-sizes", type=int_list, default=[10000, 100000, 300000])
+    parser.add_argument("--shard-counts", type=int_list, default=[1, 2, 4, 8])
+    parser.add_argument("--shard-queries", type=int, default=200, help="timed queries per shard count")
+    parser.add_argument("--shard-threads", type=int, default=0, help="search threads (0 = one per shard up to the CPU count)")
+    parser.add_argument("--embedding-dimension", type=int, default=768)
+    parser.add_argument("--local-model-dir", help="embed with LocalEmbeddingProvider from this directory instead of hashing")
+    parser.add_argument("--embed-latency-ms", type=float, default=0.0, help="simulated embedding round trip")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="simulated model latency per call")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    selected = set(args.only.split(","))
+    unknown = selected - set(BENCHMARKS)
+    if unknown:
+        sys.exit(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    results = ResultSet({k: v for k, v in vars(args).items() if k not in ("output", "database_url")})
+    if args.local_model_dir:
+        embeddings = LocalEmbeddingProvider(args.local_model_dir, dimension=args.embedding_dimension)
+    else:
+        embeddings = HashingEmbeddings(args.embedding_dimension, latency_ms=args.embed_latency_ms)
+    llm = FakeChatModel(latency_ms=args.llm_latency_ms)
+
+    with LocalDatabase(args.database_url) as local_db:
+        app_module = load_app(local_db.url, embeddings, llm)
+        from fastapi.testclient import TestClient
+        from database import engine
+
+        user = benchmark_user()
+        app_module.app.dependency_overrides[app_module.get_current_user] = lambda: user
+        app_module.app.dependency_overrides[app_module.get_admin_user] = lambda: user
+
+        with TestClient(app_module.app) as client:
+            while client.get("/status/ready").status_code == 503:
+                time.sleep(0.05)
+            if "upload" in selected:
+                bench_upload(client, engine, results, args)
+            if "chat" in selected:
+                bench_chat(client, app_module, results, args)
+            if "chat_batch" in selected:
+                bench_chat_batch(client, app_module, results, args)
+            if "conversation" in selected:
+                bench_conversation(client, engine, embeddings, results, args)
+            if "text2sql" in selected:
+                bench_text2sql(client, engine, llm, results, args)
+            if "csv" in selected:
+                bench_csv(client, engine, results, args)
+            if "cpt" in selected:
+                bench_cpt(client, engine, results, args)
+            if "search" in selected:
+                bench_search(client, engine, results, args)
+            if "migrate" in selected:
+                bench_migrate(engine, embeddings, local_db.url, results, args)
+            if "faiss" in selected:
+                bench_faiss(embeddings, results, args)
+            if "reembed" in selected:
+                bench_reembed(client, app_module, results, args)
+            if "shards" in selected:
+                bench_shards(app_module, results, args)
+        engine.dispose()
+
+    if args.output:
+        results.write(args.output)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
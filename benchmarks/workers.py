@@ -0,0 +1,176 @@
+"""Multi-worker serving benchmark: per-worker memory and availability across a graceful reload.
+
+    python -m benchmarks.workers --workers 1,2,4 --output workers.json
+
+Starts ``gunicorn main:app`` with gunicorn.conf.py for each worker count,
+using a generated local embedding model so the workers have a sizeable
+read-only matrix to share and no network is needed. Memory is read from
+/proc/<pid>/smaps_rollup: ``private`` is what a worker costs on its own,
+``pss`` splits shared pages among the processes mapping them. A client
+polls /status/live while the master is sent SIGHUP; ``failed_requests``
+counts requests that got no 200 during the worker swap. Each worker count
+runs with PRELOAD_APP on and off.
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+from benchmarks.harness import ResultSet, make_local_model
+from benchmarks.local_db import LocalDatabase
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def int_list(value: str):
+    return [int(v) for v in value.split(",") if v]
+
+
+def memory(pid: int) -> dict:
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[1].isdigit():
+                fields[parts[0].rstrip(":")] = int(parts[1])
+    return {
+        "rss_mb": fields.get("Rss", 0) / 1024,
+        "pss_mb": fields.get("Pss", 0) / 1024,
+        "private_mb": (fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)) / 1024,
+    }
+
+
+def worker_pids(master: int):
+    pids = []
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    # ppid is the 4th field, after the parenthesized command name
+                    if int(f.read().rsplit(")", 1)[1].split()[1]) == master:
+                        pids.append(int(entry))
+            except (OSError, IndexError, ValueError):
+                continue
+    return sorted(pids)
+
+
+def get(url: str, timeout: float = 2.0) -> int:
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            return response.status
+    except Exception:
+        return 0
+
+
+def wait_ready(base_url: str, master: int, workers: int, exclude=(), timeout: float = 120):
+    """Wait until ``workers`` new workers exist and /status/ready answers 200 repeatedly"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        pids = [pid for pid in worker_pids(master) if pid not in exclude]
+        if len(pids) == workers and all(get(f"{base_url}/status/ready") == 200 for _ in range(workers * 4)):
+            return pids
+        time.sleep(0.2)
+    raise RuntimeError("gunicorn workers did not become ready")
+
+
+class Poller(threading.Thread):
+    def __init__(self, url: str):
+        super().__init__(daemon=True)
+        self.url = url
+        self.ok = 0
+        self.failed = 0
+        self._stopping = threading.Event()
+
+    def run(self):
+        while not self._stopping.is_set():
+            if get(self.url) == 200:
+                self.ok += 1
+            else:
+                self.failed += 1
+
+    def stop(self):
+        self._stopping.set()
+        self.join()
+
+
+def run_workers(workers: int, preload: bool, database_url: str, model_dir: str, hidden: int, port: int) -> dict:
+    env = dict(
+        os.environ,
+        DATABASE_URL=database_url,
+        EMBEDDING_BACKEND="local",
+        LOCAL_EMBEDDING_MODEL_DIR=model_dir,
+        EMBEDDING_DIMENSION=str(hidden),
+        GOOGLE_API_KEY=os.environ.get("GOOGLE_API_KEY", "offline-benchmark"),
+        STARTUP_WARMUP="imports,db_pool,vector_index",
+        WEB_CONCURRENCY=str(workers),
+        PRELOAD_APP="true" if preload else "false",
+        BIND=f"127.0.0.1:{port}",
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    master = subprocess.Popen([sys.executable, "-m", "gunicorn", "main:app", "-c", "gunicorn.conf.py"],
+                              cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        pids = wait_ready(base_url, master.pid, workers)
+        boot_seconds = time.perf_counter() - start
+        usage = [memory(pid) for pid in pids]
+        master_usage = memory(master.pid)
+
+        poller = Poller(f"{base_url}/status/live")
+        poller.start()
+        time.sleep(0.5)
+        reload_start = time.perf_counter()
+        master.send_signal(signal.SIGHUP)
+        wait_ready(base_url, master.pid, workers, exclude=pids)
+        reload_seconds = time.perf_counter() - reload_start
+        time.sleep(0.5)
+        poller.stop()
+    finally:
+        master.terminate()
+        master.wait(timeout=60)
+
+    return {
+        "boot_seconds": round(boot_seconds, 3),
+        "master_rss_mb": round(master_usage["rss_mb"], 1),
+        "worker_rss_mb": round(sum(u["rss_mb"] for u in usage) / len(usage), 1),
+        "worker_pss_mb": round(sum(u["pss_mb"] for u in usage) / len(usage), 1),
+        "worker_private_mb": round(sum(u["private_mb"] for u in usage) / len(usage), 1),
+        "total_private_mb": round(sum(u["private_mb"] for u in usage), 1),
+        "reload_seconds": round(reload_seconds, 3),
+        "requests_during_reload": poller.ok + poller.failed,
+        "failed_requests": poller.failed,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", help="write JSON results to this path")
+    parser.add_argument("--database-url", help="use this database instead of a throwaway one")
+    parser.add_argument("--workers", type=int_list, default=[1, 2, 4])
+    parser.add_argument("--preload", default="true,false", help="PRELOAD_APP values to compare")
+    parser.add_argument("--vocab-size", type=int, default=200000)
+    parser.add_argument("--hidden", type=int, default=256)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args(argv)
+
+    results = ResultSet({k: v for k, v in vars(args).items() if k not in ("output", "database_url")})
+    with tempfile.TemporaryDirectory() as tmp, LocalDatabase(args.database_url) as local_db:
+        model_dir = os.path.join(tmp, "model")
+        model_bytes = make_local_model(model_dir, args.vocab_size, args.hidden)
+        for preload in args.preload.split(","):
+            for workers in args.workers:
+                metrics = run_workers(workers, preload == "true", local_db.url, model_dir, args.hidden, args.port)
+                metrics["model_mb"] = round(model_bytes / 2 ** 20, 1)
+                results.add("gunicorn_workers", {"workers": workers, "preload": preload}, metrics)
+
+    if args.output:
+        results.write(args.output)
+
+
+if __name__ == "__main__":
+    main()
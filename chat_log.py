@@ -0,0 +1,149 @@
+"""Write-behind logging of chat history.
+
+``/chat`` used to insert and commit a ``ChatHistory`` row before replying.
+``ChatHistoryWriter`` takes that round trip off the response path: entries
+go into a bounded in-memory queue and a background task inserts them in
+batches. When the queue is full, ``submit`` waits for space rather than
+dropping entries, and ``stop`` drains everything still queued on shutdown.
+Batches that keep failing are appended to a JSONL spill file so they can be
+replayed instead of being lost.
+
+Rows are stamped from the database clock, like the ``func.now()`` defaults
+of every other table: each flush reads LOCALTIMESTAMP and backdates every
+entry by the time it spent in the queue, so the timestamp is still when
+the answer was given.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import List, Tuple
+
+from sqlalchemy import func, insert, select
+
+from database import ChatHistory, SessionLocal
+from observability import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+CHAT_LOG_QUEUE_DEPTH = Gauge("pdfchat_chat_log_queue_depth", "Chat history entries waiting to be written.")
+CHAT_LOG_ROWS = Counter("pdfchat_chat_log_rows_total", "Chat history rows by outcome.", ["outcome"])
+CHAT_LOG_FLUSH_SECONDS = Histogram("pdfchat_chat_log_flush_seconds", "Time to insert one batch of chat history.")
+
+
+class ChatHistoryWriter:
+    def __init__(self, session_factory=SessionLocal, max_queue: int = 10000, batch_size: int = 200,
+                 flush_interval: float = 0.5, max_attempts: int = 3, spill_path: str = "chat_history_spill.jsonl"):
+        self.session_factory = session_factory
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.spill_path = spill_path
+        self._queue = None
+        self._task = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def submit(self, entry: dict):
+        """Queue a ChatHistory row (column -> value, without timestamp); writes inline if the writer is not running"""
+        item = (time.monotonic(), entry)
+        if not self.running:
+            await asyncio.get_running_loop().run_in_executor(None, self._write_batch, [item])
+            return
+        await self._queue.put(item)
+        CHAT_LOG_QUEUE_DEPTH.set(self._queue.qsize())
+
+    async def stop(self, timeout: float = 30.0):
+        """Flush everything queued, then stop the background task"""
+        if not self.running:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.error("Chat history writer did not drain within %.0fs", timeout)
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        leftover = self._take_batch(self._queue.qsize())
+        if leftover:
+            try:
+                self._spill(leftover)
+            except Exception:
+                logger.exception("Lost %d chat history entries on shutdown", len(leftover))
+                CHAT_LOG_ROWS.inc(len(leftover), outcome="lost")
+
+    def _take_batch(self, limit: int) -> List[Tuple[float, dict]]:
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            first = await self._queue.get()
+            # Give a burst a moment to accumulate so inserts are batched.
+            if self._queue.qsize() < self.batch_size - 1:
+                await asyncio.sleep(self.flush_interval)
+            batch = [first] + self._take_batch(self.batch_size - 1)
+            try:
+                await loop.run_in_executor(None, self._write_with_retry, batch)
+            except Exception:
+                # e.g. the spill file is not writable; keep serving later entries
+                logger.exception("Lost %d chat history entries", len(batch))
+                CHAT_LOG_ROWS.inc(len(batch), outcome="lost")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+                CHAT_LOG_QUEUE_DEPTH.set(self._queue.qsize())
+
+    def _write_with_retry(self, batch: List[Tuple[float, dict]]):
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                self._write_batch(batch)
+                return
+            except Exception as e:
+                logger.warning("Chat history batch of %d failed (attempt %d): %s", len(batch), attempt, e)
+                time.sleep(min(2 ** attempt * 0.1, 5))
+        self._spill(batch)
+
+    def _write_batch(self, batch: List[Tuple[float, dict]]):
+        start = time.perf_counter()
+        db = self.session_factory()
+        try:
+            # The value func.now() would store in a timestamp column
+            now, flushed_at = db.execute(select(func.localtimestamp())).scalar(), time.monotonic()
+            rows = [dict(entry, timestamp=now - timedelta(seconds=flushed_at - queued_at)) for queued_at, entry in batch]
+            db.execute(insert(ChatHistory), rows)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        CHAT_LOG_FLUSH_SECONDS.observe(time.perf_counter() - start)
+        CHAT_LOG_ROWS.inc(len(batch), outcome="written")
+
+    def _spill(self, batch: List[Tuple[float, dict]]):
+        # No database clock to hand; queued_at is UTC, for whoever replays the file
+        now, wall = time.monotonic(), datetime.now(timezone.utc)
+        with open(self.spill_path, "a") as f:
+            for queued_at, entry in batch:
+                spilled = dict(entry, queued_at=(wall - timedelta(seconds=now - queued_at)).isoformat())
+                f.write(json.dumps(spilled, default=str) + "\n")
+        CHAT_LOG_ROWS.inc(len(batch), outcome="spilled")
+        logger.error("Spilled %d chat history entries to %s", len(batch), os.path.abspath(self.spill_path))
@@ -2,13 +2,13 @@ import streamlit as st
 from PyPDF2 import PdfReader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 import os
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
 import google.generativeai as genai
-from langchain.vectorstores import FAISS
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.chains.question_answering import load_qa_chain
 from langchain.prompts import PromptTemplate
 from dotenv import load_dotenv
+from embedding_providers import get_embedding_provider, EmbeddingMismatchError
+from faiss_store import load_index, update_index
 
 # Load environment variables
 load_dotenv()
@@ -29,11 +29,12 @@ def get_text_chunks(text):
     chunks = text_splitter.split_text(text)
     return chunks
 
-def get_vector_store(text_chunks):
-    embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
-    vector_store = FAISS.from_texts(text_chunks, embedding=embeddings)
-    vector_store.save_local("faiss_index")
+def get_vector_store(pdf_docs):
+    # Chunks are tracked per file, so re-processing a PDF only embeds what changed
+    chunks_by_source = {pdf.name: get_text_chunks(get_pdf_text([pdf])) for pdf in pdf_docs}
+    return update_index("faiss_index", get_embedding_provider(), chunks_by_source)
 
+@st.cache_resource
 def get_conversational_chain():
     prompt_template = """
     Answer the question as detailed as possible from the provided context. If the answer is not in
@@ -65,9 +66,7 @@ def main():
         if st.button("Submit & Process"):
             if pdf_docs:
                 with st.spinner("Processing PDFs..."):
-                    raw_text = get_pdf_text(pdf_docs)
-                    text_chunks = get_text_chunks(raw_text)
-                    get_vector_store(text_chunks)
+                    get_vector_store(pdf_docs)
                     st.success("PDFs processed successfully! Start chatting.")
             else:
                 st.warning("Please upload at least one PDF file.")
@@ -90,8 +89,12 @@ def main():
             st.session_state["messages"].append({"role": "user", "content": prompt})
 
             # Load FAISS index and query
-            embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
-            new_db = FAISS.load_local("faiss_index", embeddings, allow_dangerous_deserialization=True)
+            embeddings = get_embedding_provider()
+            try:
+                new_db = load_index("faiss_index", embeddings)
+            except EmbeddingMismatchError as e:
+                st.error(str(e))
+                st.stop()
             docs = new_db.similarity_search(prompt)
 
             # Get conversational chain and generate response
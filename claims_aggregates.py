@@ -0,0 +1,385 @@
+"""Precomputed claims aggregates and the question router in front of Text2SQL.
+
+Most /text2sql questions are one of a few aggregates: totals by insurer,
+denials by reason, status breakdowns by month. ``route_question`` answers
+those from small aggregate tables with a fixed query, skipping the model
+and the full-table scan. It only does so when every word of the question is
+known: a measure, a grouping, filler, or an insurer or status value stored
+in the aggregates. Anything else (date ranges, patients, unknown values...)
+still goes to the SQL chain, with a hint pointing it at the aggregate tables
+when they are relevant, and at the indexed cpt_code_list column for
+questions about CPT codes.
+
+The aggregates are kept up to date inside the same transaction as each
+CSV load, so readers never see aggregates that disagree with the base
+tables. The loader records the rows it removes and adds in temporary delta
+tables (``create_delta_tables``), and ``apply_claims_delta`` adds the
+signed delta to the affected groups only. ``refresh_claims_aggregates``
+rebuilds them from scratch, e.g. for claims loaded before they existed.
+"""
+import re
+import time
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import text
+
+AGGREGATE_SOURCES = {
+    "claims_agg_insurer": "claims_list",
+    "claims_agg_status_month": "claims_list",
+    "claims_agg_denial_reason": "claims_detail",
+}
+
+REFRESH_SQL = {
+    "claims_agg_insurer": """
+        INSERT INTO claims_agg_insurer (insurer_name, claim_count, denied_count, total_billed, total_paid, refreshed_at)
+        SELECT insurer_name, COUNT(*), COUNT(*) FILTER (WHERE status = 'Denied'),
+               SUM(billed_amount), SUM(paid_amount), now()
+        FROM claims_list
+        GROUP BY insurer_name
+    """,
+    "claims_agg_status_month": """
+        INSERT INTO claims_agg_status_month (month, status, claim_count, total_billed, total_paid, refreshed_at)
+        SELECT date_trunc('month', discharge_date)::date, status, COUNT(*),
+               SUM(billed_amount), SUM(paid_amount), now()
+        FROM claims_list
+        GROUP BY 1, 2
+    """,
+    "claims_agg_denial_reason": """
+        INSERT INTO claims_agg_denial_reason (denial_reason, detail_count, claim_count, refreshed_at)
+        SELECT denial_reason, COUNT(*), COUNT(DISTINCT claim_id), now()
+        FROM claims_detail
+        WHERE denial_reason IS NOT NULL
+        GROUP BY denial_reason
+    """,
+}
+
+AGGREGATE_HINT = """
+
+Precomputed aggregate tables are available and are much faster than scanning the base tables:
+claims_agg_insurer(insurer_name, claim_count, denied_count, total_billed, total_paid),
+claims_agg_status_month(month, status, claim_count, total_billed, total_paid) where month is the first day of the discharge month,
+claims_agg_denial_reason(denial_reason, detail_count, claim_count).
+Query them instead of claims_list/claims_detail whenever they can answer the question."""
+
+CPT_WORDS = re.compile(r"\b(cpt|procedure codes?|codes?)\b")
+CPT_HINT = """
+
+claims_detail.cpt_code_list holds each detail row's CPT codes as an upper-case text[] with a GIN index (cpt_codes is the raw text).
+Filter on codes with cpt_code_list @> ARRAY['99213'] (all of several: @> ARRAY['99213','93000']; any of several: && ARRAY[...]), never with LIKE on cpt_codes,
+and count or group by code with unnest(cpt_code_list)."""
+
+# Columns of the rows a load removes (sign -1) and adds (sign +1), per base table
+DELTA_COLUMNS = {
+    "claims_list": {
+        "insurer_name": "text", "status": "text", "discharge_date": "date",
+        "billed_amount": "numeric", "paid_amount": "numeric",
+    },
+    "claims_detail": {"claim_id": "integer", "denial_reason": "text"},
+}
+
+DELTA_SQL = {
+    "claims_agg_insurer": """
+        INSERT INTO claims_agg_insurer AS a (insurer_name, claim_count, denied_count, total_billed, total_paid, refreshed_at)
+        SELECT insurer_name, SUM(sign), COALESCE(SUM(sign) FILTER (WHERE status = 'Denied'), 0),
+               SUM(sign * billed_amount), SUM(sign * paid_amount), now()
+        FROM claims_list_delta
+        GROUP BY insurer_name
+        ON CONFLICT (insurer_name) DO UPDATE SET
+            claim_count = a.claim_count + EXCLUDED.claim_count,
+            denied_count = a.denied_count + EXCLUDED.denied_count,
+            total_billed = a.total_billed + EXCLUDED.total_billed,
+            total_paid = a.total_paid + EXCLUDED.total_paid,
+            refreshed_at = now()
+    """,
+    "claims_agg_status_month": """
+        INSERT INTO claims_agg_status_month AS a (month, status, claim_count, total_billed, total_paid, refreshed_at)
+        SELECT date_trunc('month', discharge_date)::date, status, SUM(sign),
+               SUM(sign * billed_amount), SUM(sign * paid_amount), now()
+        FROM claims_list_delta
+        GROUP BY 1, 2
+        ON CONFLICT (month, status) DO UPDATE SET
+            claim_count = a.claim_count + EXCLUDED.claim_count,
+            total_billed = a.total_billed + EXCLUDED.total_billed,
+            total_paid = a.total_paid + EXCLUDED.total_paid,
+            refreshed_at = now()
+    """,
+    # claim_count counts distinct claims, so it is not additive: a claim joins
+    # a reason when its first row with it appears and leaves with its last.
+    # Rows per (claim, reason) after the load come from the claim_id index.
+    "claims_agg_denial_reason": """
+        WITH pairs AS (
+            SELECT claim_id, denial_reason, SUM(sign) AS change
+            FROM claims_detail_delta
+            WHERE denial_reason IS NOT NULL
+            GROUP BY claim_id, denial_reason
+        ), counted AS (
+            SELECT p.denial_reason, p.change,
+                   (SELECT COUNT(*) FROM claims_detail d
+                    WHERE d.claim_id = p.claim_id AND d.denial_reason = p.denial_reason) AS rows_after
+            FROM pairs p
+        )
+        INSERT INTO claims_agg_denial_reason AS a (denial_reason, detail_count, claim_count, refreshed_at)
+        SELECT denial_reason, SUM(change), SUM((rows_after > 0)::int - (rows_after - change > 0)::int), now()
+        FROM counted
+        GROUP BY denial_reason
+        ON CONFLICT (denial_reason) DO UPDATE SET
+            detail_count = a.detail_count + EXCLUDED.detail_count,
+            claim_count = a.claim_count + EXCLUDED.claim_count,
+            refreshed_at = now()
+    """,
+}
+# Groups the delta emptied
+EMPTY_GROUP = {
+    "claims_agg_insurer": "claim_count = 0",
+    "claims_agg_status_month": "claim_count = 0",
+    "claims_agg_denial_reason": "detail_count = 0",
+}
+
+_known_values = {"loaded_at": 0.0, "values": None}
+KNOWN_VALUES_TTL = 60.0
+
+
+def create_delta_tables(conn):
+    """Temporary claims_list_delta and claims_detail_delta tables, dropped at commit.
+
+    A load inserts a row with sign -1 for every base row it deletes or
+    changes (old values) and +1 for every row it inserts or changes (new
+    values); apply_claims_delta then folds them into the aggregates.
+    """
+    for table_name, columns in DELTA_COLUMNS.items():
+        conn.execute(text(f"""
+            CREATE TEMP TABLE {table_name}_delta (
+                sign integer NOT NULL, {', '.join(f'{column} {column_type}' for column, column_type in columns.items())}
+            ) ON COMMIT DROP
+        """))
+
+
+def apply_claims_delta(conn):
+    """Add the load's recorded delta to the affected aggregate groups, on the load's connection"""
+    for aggregate, source in AGGREGATE_SOURCES.items():
+        if conn.execute(text(f"SELECT EXISTS (SELECT 1 FROM {source}_delta)")).scalar():
+            conn.execute(text(DELTA_SQL[aggregate]))
+            conn.execute(text(f"DELETE FROM {aggregate} WHERE {EMPTY_GROUP[aggregate]}"))
+    _known_values["values"] = None
+
+
+def refresh_claims_aggregates(conn, tables: Iterable[str] = ("claims_list", "claims_detail")):
+    """Rebuild the aggregates derived from the given base tables.
+
+    Runs on the caller's connection so it commits (or rolls back) together
+    with the load. DELETE rather than TRUNCATE keeps the old rows visible to
+    concurrent readers until that commit.
+    """
+    tables = set(tables)
+    for aggregate, source in AGGREGATE_SOURCES.items():
+        if source in tables:
+            conn.execute(text(f"DELETE FROM {aggregate}"))
+            conn.execute(text(REFRESH_SQL[aggregate]))
+    _known_values["values"] = None
+
+
+def refresh_if_missing(engine):
+    """Build the aggregates for claims loaded before they existed"""
+    with engine.begin() as conn:
+        stale = conn.execute(text("""
+            SELECT EXISTS (SELECT 1 FROM claims_list) AND NOT EXISTS (SELECT 1 FROM claims_agg_insurer)
+        """)).scalar()
+        if stale:
+            refresh_claims_aggregates(conn)
+    return bool(stale)
+
+
+class Route(NamedTuple):
+    """How to answer a question: ``sql`` over the aggregates, or ``hint`` for the SQL chain"""
+    name: str
+    sql: Optional[str] = None
+    hint: str = ""
+
+
+DIMENSION_WORDS = {
+    "insurer": re.compile(r"\b(insurers?|insurance( compan(y|ies))?|payers?|payors?|carriers?)\b"),
+    "status": re.compile(r"\b(status|statuses)\b"),
+    "month": re.compile(r"\b(month|months|monthly)\b"),
+    "reason": re.compile(r"\b(reasons?|causes?)\b"),
+}
+MEASURE_WORDS = {
+    "claim_count": re.compile(r"\b(how many|number of|count|counts|volume)\b"),
+    "total_billed": re.compile(r"\b(billed|billing|charges?|charged)\b"),
+    "total_paid": re.compile(r"\b(paid|payments?|reimburse(d|ment)?)\b"),
+    "denied": re.compile(r"\b(denied|denials?)\b"),
+    "average": re.compile(r"\b(average|avg|mean)\b"),
+}
+GROUPING = re.compile(r"\b(by|per|each|every|across|breakdown|broken down|grouped|split|monthly)\b")
+TOTAL = re.compile(r"\b(total|overall|all claims|sum)\b")
+# Every word of a question answered from the aggregates must be one of these
+# or part of a known insurer or status; anything else (dates, names, places,
+# negations, rankings, partial names...) may narrow the rows in a way the
+# aggregates cannot, so the question goes to the SQL chain.
+ALLOWED_WORDS = frozenset("""
+    how many much number count counts volume billed billing bill charge charges charged paid payment payments
+    reimbursed reimbursement reimbursements denied denial denials average avg mean total totals sum amount amounts
+    overall
+    insurer insurers insurance company companies payer payers payor payors carrier carriers status statuses
+    month months monthly reason reasons cause causes
+    by per each every across breakdown broken down grouped split
+    what what's whats which is are was were be been the a an of there do does did have has had all claim claims
+    show me list give get tell please and or with for in to that our we us
+""".split())
+# "total (billed and) paid", "sum of paid", "how much was paid", "paid amount":
+# a status named like a measure is the measure there, not a filter
+MEASURE_LEAD = frozenset({"total", "sum", "amount", "amounts", "average", "avg", "mean", "much"})
+MEASURE_TAIL = frozenset({"amount", "amounts", "total", "totals", "sum", "sums"})
+MEASURE_JOIN = frozenset({"billed", "paid", "denied", "and", "or", "of"})
+
+
+def _tokens(value: str) -> List[str]:
+    return re.findall(r"[a-z0-9']+", value.lower())
+
+
+def known_values(conn) -> List[Tuple[str, str]]:
+    """(column, value) of every insurer name and status, so questions naming them can filter on them"""
+    now = time.monotonic()
+    if _known_values["values"] is None or now - _known_values["loaded_at"] > KNOWN_VALUES_TTL:
+        rows = conn.execute(text("""
+            SELECT 'insurer_name', insurer_name FROM claims_agg_insurer
+            UNION SELECT DISTINCT 'status', status FROM claims_agg_status_month
+        """)).fetchall()
+        _known_values["values"] = [(row[0], row[1]) for row in rows if row[1]]
+        _known_values["loaded_at"] = now
+    return _known_values["values"]
+
+
+def _names_measure(tokens: List[str], position: int) -> bool:
+    if position + 1 < len(tokens) and tokens[position + 1] in MEASURE_TAIL:
+        return True
+    before = position - 1
+    while before >= 0 and tokens[before] in MEASURE_JOIN:
+        before -= 1
+    # "how much was paid"
+    if before >= 1 and tokens[before - 1] == "much":
+        before -= 1
+    return before >= 0 and tokens[before] in MEASURE_LEAD
+
+
+def value_filters(tokens: List[str], values: List[Tuple[str, str]]) -> Tuple[List[Tuple[str, str]], set, set]:
+    """Known values the question names exactly, as (column, value) filters, the token
+    positions of every value named and those of the values filtered on.
+
+    Longer values are matched first ("partially paid" before "paid"). A
+    single-word status that doubles as a measure ("paid", "denied") is no
+    filter where it names the measure, as in "total paid".
+    """
+    filters, covered, filtered = [], set(), set()
+    for column, value in sorted(values, key=lambda item: -len(_tokens(item[1]))):
+        words = _tokens(value)
+        for start in range(len(tokens) - len(words) + 1):
+            span = set(range(start, start + len(words)))
+            if tokens[start:start + len(words)] != words or span & covered:
+                continue
+            covered |= span
+            if len(words) == 1 and words[0] in ALLOWED_WORDS and _names_measure(tokens, start):
+                continue
+            filtered |= span
+            if (column, value) not in filters:
+                filters.append((column, value))
+    return filters, covered, filtered
+
+
+def _literals(values: List[str]) -> str:
+    return ", ".join("'" + value.replace("'", "''") + "'" for value in values)
+
+
+def _measure_columns(measures: set, dimension: str) -> List[str]:
+    columns = []
+    if "claim_count" in measures or not measures:
+        columns.append("SUM(claim_count) AS claim_count")
+    if "denied" in measures and dimension in ("insurer", "total"):
+        columns.append("SUM(denied_count) AS denied_count")
+    if "total_billed" in measures or not measures:
+        columns.append("SUM(total_billed) AS total_billed")
+    if "total_paid" in measures or not measures:
+        columns.append("SUM(total_paid) AS total_paid")
+    if "average" in measures:
+        if "total_paid" in measures:
+            columns.append("ROUND(SUM(total_paid) / NULLIF(SUM(claim_count), 0), 2) AS average_paid")
+        if "total_billed" in measures or "total_paid" not in measures:
+            columns.append("ROUND(SUM(total_billed) / NULLIF(SUM(claim_count), 0), 2) AS average_billed")
+    return columns
+
+
+def route_question(conn, question: str, values: Optional[List[Tuple[str, str]]] = None) -> Route:
+    """Pick the cheapest way to answer a Text2SQL question.
+
+    ``values`` are the known (column, value) pairs, read from the
+    aggregates through ``conn`` when not given.
+    """
+    normalized = " ".join(question.lower().split())
+    tokens = _tokens(normalized)
+    filters, covered, filtered = value_filters(tokens, known_values(conn) if values is None else values)
+    # Words of filter values are not measures or dimensions: "paid claims" counts claims
+    remaining = " ".join(token for position, token in enumerate(tokens) if position not in filtered)
+    dimensions = {name for name, pattern in DIMENSION_WORDS.items() if pattern.search(remaining)}
+    measures = {name for name, pattern in MEASURE_WORDS.items() if pattern.search(remaining)}
+    mentions_claims = bool(dimensions or measures or filters or "claim" in normalized)
+    hint = AGGREGATE_HINT if mentions_claims else ""
+    if CPT_WORDS.search(normalized):
+        hint += CPT_HINT
+
+    if any(token not in ALLOWED_WORDS and position not in covered for position, token in enumerate(tokens)):
+        return Route("sql", hint=hint)
+    insurers = [value for column, value in filters if column == "insurer_name"]
+    statuses = [value for column, value in filters if column == "status"]
+    denied_filter = [status.lower() for status in statuses] == ["denied"]
+    grouped = bool(GROUPING.search(remaining))
+
+    if "reason" in dimensions:
+        if dimensions == {"reason"} and ("denied" in measures or denied_filter) and not insurers \
+                and (not statuses or denied_filter):
+            return Route("aggregate", sql="""
+                SELECT denial_reason, detail_count, claim_count
+                FROM claims_agg_denial_reason
+                ORDER BY detail_count DESC, denial_reason
+            """)
+        return Route("sql", hint=hint)
+
+    # Denied claims per insurer or overall are what denied_count holds
+    if denied_filter and measures <= {"claim_count", "denied"} and dimensions <= {"insurer"}:
+        columns = ["SUM(denied_count) AS denied_count"]
+        statuses = []
+    else:
+        columns = None
+
+    if not statuses and dimensions <= {"insurer"} and (insurers or (dimensions and grouped)):
+        where = f"WHERE insurer_name IN ({_literals(insurers)})" if insurers else ""
+        return Route("aggregate", sql=f"""
+            SELECT insurer_name, {', '.join(columns or _measure_columns(measures, 'insurer'))}
+            FROM claims_agg_insurer
+            {where}
+            GROUP BY insurer_name
+            ORDER BY insurer_name
+        """)
+    if not statuses and not dimensions and not insurers and measures \
+            and (TOTAL.search(remaining) or "claim_count" in measures or columns):
+        return Route("aggregate", sql=f"""
+            SELECT {', '.join(columns or _measure_columns(measures, 'total'))} FROM claims_agg_insurer
+        """)
+
+    if not insurers and "denied" not in measures and dimensions <= {"status", "month"} \
+            and (statuses or (dimensions and grouped)):
+        keys = [key for key in ("month", "status") if key in dimensions and grouped]
+        where = f"WHERE status IN ({_literals(statuses)})" if statuses else ""
+        if not keys:
+            return Route("aggregate", sql=f"""
+                SELECT {', '.join(_measure_columns(measures, 'status_month'))}
+                FROM claims_agg_status_month
+                {where}
+            """)
+        return Route("aggregate", sql=f"""
+            SELECT {', '.join(keys)}, {', '.join(_measure_columns(measures, 'status_month'))}
+            FROM claims_agg_status_month
+            {where}
+            GROUP BY {', '.join(keys)}
+            ORDER BY {', '.join(keys)}
+        """)
+
+    return Route("sql", hint=hint)
@@ -0,0 +1,254 @@
+"""Streaming exports of the claims tables and of Text2SQL results.
+
+/claims and /text2sql build the whole result as a list of dicts and send
+one JSON document. Exports instead read rows through a server-side cursor
+(``stream_results``) in batches of EXPORT_BATCH_ROWS and encode and send each
+batch before fetching the next, so memory stays flat however large the
+result. Formats are CSV, NDJSON, Arrow (IPC stream) and Parquet (one row
+group per batch); the last two need the optional pyarrow package.
+
+The query runs, and its first batch is fetched, before the response
+starts, so SQL errors are still reported with an HTTP status. A failure
+later in the stream can only abort the response: clients should treat a
+response without its final chunk as incomplete.
+"""
+import csv
+import io
+import json
+import os
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Dict, Iterator, List, Optional
+
+from sqlalchemy import text
+
+from claims_loader import TABLE_COLUMNS
+
+BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", 10000))
+# format -> (media type, file extension)
+FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+ARROW_FORMATS = ("arrow", "parquet")
+# Columns filtering the claim; claims_detail rows are filtered by their claim
+CLAIM_FILTERS = {
+    "status": "c.status = :status",
+    "insurer_name": "c.insurer_name = :insurer_name",
+    "discharge_from": "c.discharge_date >= :discharge_from",
+    "discharge_to": "c.discharge_date <= :discharge_to",
+}
+DETAIL_FILTERS = {
+    "claim_id": "d.claim_id = :claim_id",
+    "denial_reason": "d.denial_reason = :denial_reason",
+}
+
+
+class ExportError(ValueError):
+    """The export request is invalid"""
+
+
+class ExportFormatUnavailable(ExportError):
+    """The format needs a package that is not installed"""
+
+
+def check_format(export_format: str):
+    if export_format not in FORMATS:
+        raise ExportError(f"format must be one of {', '.join(FORMATS)}")
+    if export_format in ARROW_FORMATS:
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ExportFormatUnavailable(f"pyarrow is required for {export_format} exports; pip install pyarrow")
+
+
+def claims_query(table_name: str, filters: Dict[str, object]):
+    """SELECT for an export of ``table_name`` (the columns /upload-csv loads) and its parameters.
+
+    ``filters`` maps CLAIM_FILTERS and, for claims_detail, DETAIL_FILTERS
+    names to values; None values are ignored.
+    """
+    if table_name not in TABLE_COLUMNS:
+        raise ExportError(f"table_name must be one of {', '.join(TABLE_COLUMNS)}")
+    allowed = dict(CLAIM_FILTERS, **(DETAIL_FILTERS if table_name == "claims_detail" else {}))
+    params = {name: value for name, value in filters.items() if value is not None}
+    unknown = [name for name in params if name not in allowed]
+    if unknown:
+        raise ExportError(f"Unknown filter(s) for {table_name}: {', '.join(unknown)}")
+
+    alias = "c" if table_name == "claims_list" else "d"
+    source = f"{table_name} {alias}"
+    if table_name == "claims_detail" and any(name in CLAIM_FILTERS for name in params):
+        source += " JOIN claims_list c ON c.id = d.claim_id"
+    where = " AND ".join(allowed[name] for name in params)
+    sql = (f"SELECT {', '.join(f'{alias}.{column}' for column in TABLE_COLUMNS[table_name])} FROM {source}"
+           + (f" WHERE {where}" if where else "") + f" ORDER BY {alias}.id")
+    return sql, params
+
+
+class QueryStream:
+    """A query on a server-side cursor, read in batches; owns its connection until drained or closed"""
+
+    def __init__(self, engine, sql: str, params: Optional[dict] = None, batch_rows: int = BATCH_ROWS):
+        # DECLARE ... CURSOR FOR takes a single statement without the terminator
+        sql = sql.strip().rstrip(";")
+        self._conn = engine.connect()
+        try:
+            result = self._conn.execution_options(stream_results=True, max_row_buffer=batch_rows).execute(
+                text(sql), params or {}
+            )
+            self.columns = list(result.keys())
+            self.description = list(result.cursor.description)
+            # With Core statements, partitions() needs the size; yield_per alone returns one partition
+            self._partitions = result.partitions(batch_rows)
+            # Runtime errors surface on the first fetch; keep them before the response starts
+            self._first = next(self._partitions, [])
+        except Exception:
+            self._conn.close()
+            raise
+
+    def batches(self) -> Iterator[List[tuple]]:
+        try:
+            if self._first:
+                yield self._first
+                yield from self._partitions
+        finally:
+            self.close()
+
+    def close(self):
+        self._first = []
+        self._conn.close()
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+def _csv_chunks(stream: QueryStream) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(stream.columns)
+    for batch in stream.batches():
+        writer.writerows(
+            [json.dumps(value, default=_json_default) if isinstance(value, (list, dict)) else value
+             for value in row]
+            for row in batch
+        )
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        # Header only: the result was empty
+        yield buffer.getvalue().encode("utf-8")
+
+
+def _ndjson_chunks(stream: QueryStream) -> Iterator[bytes]:
+    for batch in stream.batches():
+        yield "".join(
+            json.dumps(dict(zip(stream.columns, row)), default=_json_default) + "\n" for row in batch
+        ).encode("utf-8")
+
+
+# Postgres type OIDs; columns of other types are exported as text
+BOOL, INT8, INT2, INT4, FLOAT4, FLOAT8, NUMERIC = 16, 20, 21, 23, 700, 701, 1700
+DATE, TIMESTAMP, TIMESTAMPTZ = 1082, 1114, 1184
+INT4_ARRAY, TEXT_ARRAY, INT8_ARRAY = 1007, 1009, 1016
+
+
+def _arrow_type(pa, column):
+    simple = {
+        BOOL: pa.bool_(), INT8: pa.int64(), INT2: pa.int16(), INT4: pa.int32(),
+        FLOAT4: pa.float32(), FLOAT8: pa.float64(), DATE: pa.date32(),
+        TIMESTAMP: pa.timestamp("us"), TIMESTAMPTZ: pa.timestamp("us", tz="UTC"),
+        INT4_ARRAY: pa.list_(pa.int32()), TEXT_ARRAY: pa.list_(pa.string()), INT8_ARRAY: pa.list_(pa.int64()),
+    }
+    if column.type_code == NUMERIC:
+        # numeric(p, s) stays exact; unconstrained numeric (sums, averages) reports precision 65535
+        if column.precision and column.precision <= 38:
+            return pa.decimal128(column.precision, column.scale)
+        return pa.float64()
+    return simple.get(column.type_code, pa.string())
+
+
+def arrow_schema(stream: QueryStream):
+    import pyarrow as pa
+
+    return pa.schema([pa.field(column.name, _arrow_type(pa, column)) for column in stream.description])
+
+
+def _arrow_column(pa, values: list, arrow_type):
+    if pa.types.is_floating(arrow_type):
+        values = [None if value is None else float(value) for value in values]
+    elif pa.types.is_string(arrow_type):
+        values = [value if value is None or isinstance(value, str)
+                  else json.dumps(value, default=_json_default) if isinstance(value, (list, dict))
+                  else str(value) for value in values]
+    return pa.array(values, type=arrow_type)
+
+
+class _DrainingSink(io.RawIOBase):
+    """Write-only file that hands out what was written since the last drain.
+
+    tell() keeps counting from the start: the Parquet footer records row
+    group offsets from it.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self) -> bytes:
+        data, self._chunks = b"".join(self._chunks), []
+        return data
+
+
+def _arrow_chunks(stream: QueryStream, export_format: str) -> Iterator[bytes]:
+    import pyarrow as pa
+
+    schema = arrow_schema(stream)
+    sink = _DrainingSink()
+    if export_format == "parquet":
+        import pyarrow.parquet as pq
+        writer = pq.ParquetWriter(sink, schema)
+    else:
+        writer = pa.ipc.new_stream(sink, schema)
+    try:
+        for batch in stream.batches():
+            columns = list(zip(*batch))
+            record_batch = pa.record_batch(
+                [_arrow_column(pa, list(values), field.type) for values, field in zip(columns, schema)],
+                schema=schema,
+            )
+            writer.write_batch(record_batch)
+            yield sink.drain()
+    finally:
+        # Writes the Parquet footer or the end-of-stream marker
+        writer.close()
+    yield sink.drain()
+
+
+def encode(stream: QueryStream, export_format: str) -> Iterator[bytes]:
+    """The stream's rows as chunks of ``export_format``, one per batch"""
+    if export_format == "csv":
+        return _csv_chunks(stream)
+    if export_format == "ndjson":
+        return _ndjson_chunks(stream)
+    return _arrow_chunks(stream, export_format)
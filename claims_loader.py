@@ -0,0 +1,343 @@
+"""Bulk loading of the pipe-delimited claims CSV files.
+
+Shared by /upload-csv, load_claims_data.py and populate_claims_data.py.
+The file is streamed with COPY into a temporary staging table whose
+columns carry the target types, so Postgres parses and type-checks every
+value as it arrives and the file is never held in memory. Once the whole
+file is staged and validated, the live table is brought up to date in a
+single transaction:
+
+    replace  make the table match the file: delete rows whose id is not in
+             it, insert new ids, update rows that changed
+    upsert   insert new ids and update rows that changed; keep the rest
+
+Unchanged rows are not rewritten, so reloading a mostly unchanged export
+is cheap. Readers keep seeing the previous data until the transaction
+commits and no statement takes a lock that blocks SELECTs, so /claims and
+/text2sql stay available throughout. The claims aggregates are refreshed
+in the same transaction.
+"""
+import bisect
+import codecs
+import csv
+import io
+import re
+import time
+from typing import BinaryIO, NamedTuple, Union
+
+from sqlalchemy import text
+
+from claims_aggregates import DELTA_COLUMNS, apply_claims_delta, create_delta_tables
+from observability import stage
+
+# Column -> staging type. Text columns are trimmed when applied and the
+# values in NULL_VALUES are stored as NULL. claims_detail.cpt_code_list is
+# generated from cpt_codes by Postgres as rows are written.
+TABLE_COLUMNS = {
+    "claims_list": {
+        "id": "integer",
+        "patient_name": "text",
+        "billed_amount": "numeric(12, 2)",
+        "paid_amount": "numeric(12, 2)",
+        "status": "text",
+        "insurer_name": "text",
+        "discharge_date": "date",
+    },
+    "claims_detail": {
+        "id": "integer",
+        "claim_id": "integer",
+        "denial_reason": "text",
+        "cpt_codes": "text",
+    },
+}
+OPTIONAL_COLUMNS = {"denial_reason", "cpt_codes"}
+NULL_VALUES = {"denial_reason": ("", "N/A"), "cpt_codes": ("",)}
+LOAD_MODES = ("replace", "upsert")
+MAX_REPORTED_ERRORS = 5
+COPY_BLOCK_SIZE = 1 << 20
+
+
+class CSVValidationError(ValueError):
+    """The file is malformed or its rows do not fit the target table"""
+
+
+class LoadResult(NamedTuple):
+    table_name: str
+    mode: str
+    rows_loaded: int
+    rows_skipped: int
+    seconds: float
+
+
+class _WellFormedLines(io.RawIOBase):
+    """Readable stream passing through only rows with the expected field count.
+
+    Used when bad lines are skipped; otherwise the file goes to COPY as-is
+    and a malformed line fails the load. Records how many rows were kept
+    before each skipped one, so ``file_line`` can map a staged row back to
+    its line in the file.
+    """
+
+    def __init__(self, stream: BinaryIO, columns: int, sep: str, batch_rows: int = 10000):
+        self.rows = csv.reader(codecs.getreader("utf-8")(stream), delimiter=sep)
+        self.columns = columns
+        self.batch_rows = batch_rows
+        self.skipped = 0
+        self.kept = 0
+        self._skipped_after = []
+        self._buffer = b""
+
+    def file_line(self, row: int) -> int:
+        """Line in the file of the row-th (from 1) row passed through"""
+        return _file_line(row + bisect.bisect_left(self._skipped_after, row))
+
+    def readable(self):
+        return True
+
+    def _fill(self) -> bytes:
+        out = io.StringIO()
+        writer = csv.writer(out, delimiter="|", lineterminator="\n")
+        for _, row in zip(range(self.batch_rows), self.rows):
+            if len(row) == self.columns:
+                writer.writerow(row)
+                self.kept += 1
+            else:
+                self.skipped += 1
+                self._skipped_after.append(self.kept)
+        return out.getvalue().encode("utf-8")
+
+    def read(self, size=-1):
+        while size is None or size < 0 or len(self._buffer) < size:
+            chunk = self._fill()
+            if not chunk:
+                break
+            self._buffer += chunk
+        if size is None or size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def _file_line(row: int) -> int:
+    """Line in the file of the row-th (from 1) data row; line 1 is the header"""
+    return row + 1
+
+
+def _read_header(stream: BinaryIO, sep: str):
+    header = stream.readline().decode("utf-8-sig")
+    if not header.strip():
+        raise CSVValidationError("The file is empty")
+    return [column.strip().lower() for column in next(csv.reader([header], delimiter=sep))]
+
+
+def _staging_columns(table_name: str, header):
+    """Staging column for each header column, in file order.
+
+    Names from the file never reach the SQL: known columns use the names in
+    TABLE_COLUMNS and unknown ones, loaded as text and ignored, get
+    positional names.
+    """
+    types = TABLE_COLUMNS[table_name]
+    return [column if column in types else f"extra_{position}" for position, column in enumerate(header, 1)]
+
+
+def _create_staging(conn, staging: str, table_name: str, header):
+    types = TABLE_COLUMNS[table_name]
+    missing = [column for column in types if column not in header and column not in OPTIONAL_COLUMNS]
+    if missing:
+        raise CSVValidationError(f"Missing column(s): {', '.join(missing)}")
+    if len(set(header)) != len(header):
+        raise CSVValidationError("Duplicate column names in header")
+    # Staging follows the file's column order
+    columns = [f'"{column}" {types.get(column, "text")}' for column in _staging_columns(table_name, header)]
+    columns += [f'"{column}" {types[column]}' for column in types if column not in header]
+    conn.execute(text(f"""
+        CREATE TEMP TABLE {staging} (line bigint GENERATED ALWAYS AS IDENTITY, {', '.join(columns)})
+        ON COMMIT DROP
+    """))
+
+
+def _copy(cursor, staging: str, table_name: str, header, stream, sep: str, file_line=_file_line):
+    import psycopg2
+
+    columns = ", ".join(f'"{column}"' for column in _staging_columns(table_name, header))
+    delimiter = sep.replace("'", "''")
+    try:
+        cursor.copy_expert(
+            f"COPY {staging} ({columns}) FROM STDIN WITH (FORMAT csv, DELIMITER '{delimiter}')",
+            stream, size=COPY_BLOCK_SIZE,
+        )
+    except psycopg2.DataError as e:
+        # e.g. 'invalid input syntax for type integer: "abc"' with the line in the context;
+        # COPY counts from its first row, which is the first data row of the file
+        context = ""
+        if e.diag.context:
+            context = re.sub(r"\bline (\d+)", lambda m: f"line {file_line(int(m.group(1)))}", e.diag.context.strip())
+            context = f" ({context})"
+        raise CSVValidationError(f"{e.diag.message_primary}{context}")
+
+
+def _value(table_name: str, column: str, alias: str = "s") -> str:
+    """SQL expression for a staged column as it is stored in the live table"""
+    expression = f'{alias}."{column}"'
+    if TABLE_COLUMNS[table_name][column] == "text":
+        expression = f"trim({expression})"
+        for null_value in NULL_VALUES.get(column, ()):
+            expression = f"NULLIF({expression}, '{null_value}')"
+    return expression
+
+
+def _validate_staging(conn, table_name: str, staging: str, file_line=_file_line):
+    # One pass over staging finds rows with a missing required value
+    required = [
+        (column, f"{_value(table_name, column)} IS NULL"
+                 + (f" OR {_value(table_name, column)} = ''" if column_type == "text" else ""))
+        for column, column_type in TABLE_COLUMNS[table_name].items()
+        if column not in OPTIONAL_COLUMNS
+    ]
+    first_empty = "CASE " + " ".join(f"WHEN {condition} THEN '{column}'" for column, condition in required) + " END"
+    empty = conn.execute(text(f"""
+        SELECT line, {first_empty} FROM {staging} s
+        WHERE {' OR '.join(f'({condition})' for _, condition in required)}
+        ORDER BY line LIMIT {MAX_REPORTED_ERRORS}
+    """)).fetchall()
+    if empty:
+        # staging numbers rows from 1 in the order they were copied
+        raise CSVValidationError("Empty required value: " + ", ".join(
+            f"{column} on line {file_line(line)}" for line, column in empty
+        ))
+
+    duplicates = conn.execute(text(
+        f"SELECT id FROM {staging} GROUP BY id HAVING COUNT(*) > 1 ORDER BY id LIMIT {MAX_REPORTED_ERRORS}"
+    )).scalars().all()
+    if duplicates:
+        raise CSVValidationError(f"Duplicate id(s) in file: {', '.join(map(str, duplicates))}")
+
+    if table_name == "claims_detail":
+        orphans = conn.execute(text(f"""
+            SELECT DISTINCT s.claim_id FROM {staging} s
+            WHERE NOT EXISTS (SELECT 1 FROM claims_list c WHERE c.id = s.claim_id)
+            ORDER BY s.claim_id LIMIT {MAX_REPORTED_ERRORS}
+        """)).scalars().all()
+        if orphans:
+            raise CSVValidationError(f"claim_id(s) not in claims_list: {', '.join(map(str, orphans))}")
+
+
+def _record_delta(table_name: str, sign: int, statement: str) -> str:
+    """Wrap a DELETE/INSERT ... RETURNING so the rows it touches land in the delta table"""
+    delta = list(DELTA_COLUMNS[table_name])
+    return f"""
+        WITH changed AS ({statement} RETURNING {', '.join(delta)})
+        INSERT INTO {table_name}_delta (sign, {', '.join(delta)})
+        SELECT {sign}, {', '.join(delta)} FROM changed
+    """
+
+
+def _apply_staging(conn, table_name: str, staging: str, mode: str):
+    """Delete, update and insert only the rows that differ from the file.
+
+    Separate anti-join/join statements instead of INSERT ... ON CONFLICT:
+    each runs as one hash join, and loads are serialized by the advisory
+    lock so no other writer can slip in between them. Every statement also
+    records the rows it removes and adds in the delta tables, from its own
+    RETURNING, for apply_claims_delta.
+    """
+    columns = list(TABLE_COLUMNS[table_name])
+    values = [column for column in columns if column != "id"]
+    delta = list(DELTA_COLUMNS[table_name])
+    if mode == "replace":
+        if table_name == "claims_list":
+            # Details of claims that are no longer listed would violate the foreign key
+            conn.execute(text(_record_delta("claims_detail", -1, f"""
+                DELETE FROM claims_detail d
+                WHERE NOT EXISTS (SELECT 1 FROM {staging} s WHERE s.id = d.claim_id)
+            """)))
+        conn.execute(text(_record_delta(table_name, -1, f"""
+            DELETE FROM {table_name} t
+            WHERE NOT EXISTS (SELECT 1 FROM {staging} s WHERE s.id = t.id)
+        """)))
+    # RETURNING only sees new values; the second reference to the table, o,
+    # still reads the row as it was before the update
+    conn.execute(text(f"""
+        WITH changed AS (
+            UPDATE {table_name} t
+            SET {', '.join(f'{column} = {_value(table_name, column)}' for column in values)}
+            FROM {staging} s, {table_name} o
+            WHERE t.id = s.id AND o.id = t.id
+              AND ({', '.join(f't.{column}' for column in values)})
+                  IS DISTINCT FROM ({', '.join(_value(table_name, column) for column in values)})
+            RETURNING {', '.join(f'o.{column} AS old_{column}, t.{column} AS new_{column}' for column in delta)}
+        )
+        INSERT INTO {table_name}_delta (sign, {', '.join(delta)})
+        SELECT -1, {', '.join(f'old_{column}' for column in delta)} FROM changed
+        UNION ALL
+        SELECT 1, {', '.join(f'new_{column}' for column in delta)} FROM changed
+    """))
+    conn.execute(text(_record_delta(table_name, 1, f"""
+        INSERT INTO {table_name} ({', '.join(columns)}, created_at)
+        SELECT {', '.join(_value(table_name, column) for column in columns)}, now()
+        FROM {staging} s
+        WHERE NOT EXISTS (SELECT 1 FROM {table_name} t WHERE t.id = s.id)
+    """)))
+
+
+def load_claims_csv(source: Union[str, BinaryIO], table_name: str, engine, mode: str = "replace",
+                    sep: str = "|", skip_bad_lines: bool = False) -> LoadResult:
+    """Stream a claims CSV into claims_list or claims_detail.
+
+    ``source`` is a path or a binary file object (e.g. ``UploadFile.file``).
+    Raises CSVValidationError, leaving the live table untouched, if any row
+    fails to parse or validate; with ``skip_bad_lines`` rows with the wrong
+    number of fields are dropped instead.
+    """
+    if table_name not in TABLE_COLUMNS:
+        raise CSVValidationError(f"table_name must be one of {', '.join(TABLE_COLUMNS)}")
+    if mode not in LOAD_MODES:
+        raise CSVValidationError(f"mode must be one of {', '.join(LOAD_MODES)}")
+
+    start = time.perf_counter()
+    staging = f"{table_name}_staging"
+    raw = open(source, "rb") if isinstance(source, str) else source
+    try:
+        header = _read_header(raw, sep)
+        stream, file_line = raw, _file_line
+        if skip_bad_lines:
+            stream, sep = _WellFormedLines(raw, len(header), sep), "|"
+            file_line = stream.file_line
+        with engine.begin() as conn:
+            # One load at a time; concurrent loads would interleave their deletes
+            conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('claims_csv_load'))"))
+            _create_staging(conn, staging, table_name, header)
+            with stage("csv_load", "stream_copy"):
+                cursor = conn.connection.driver_connection.cursor()
+                try:
+                    _copy(cursor, staging, table_name, header, stream, sep, file_line)
+                finally:
+                    cursor.close()
+            rows = conn.execute(text(f"SELECT COUNT(*) FROM {staging}")).scalar()
+            if rows == 0:
+                raise CSVValidationError("The file contains no rows")
+
+            with stage("csv_load", "validate"):
+                conn.execute(text(f"ANALYZE {staging}"))
+                _validate_staging(conn, table_name, staging, file_line)
+            with stage("csv_load", "apply"):
+                create_delta_tables(conn)
+                _apply_staging(conn, table_name, staging, mode)
+                # Autovacuum may not analyze for minutes; until then the planner
+                # guesses selectivities and picks seq scans for selective lookups
+                conn.execute(text(f"ANALYZE {table_name}"))
+                # Merge rows still in the GIN pending lists (CPT codes, claims search),
+                # which every lookup would otherwise scan
+                conn.execute(text(f"""
+                    SELECT gin_clean_pending_list(i.indexrelid) FROM pg_index i
+                    JOIN pg_class c ON c.oid = i.indexrelid JOIN pg_am a ON a.oid = c.relam
+                    WHERE i.indrelid = '{table_name}'::regclass AND a.amname = 'gin'
+                """))
+            with stage("csv_load", "refresh_aggregates"):
+                apply_claims_delta(conn)
+    finally:
+        if isinstance(source, str):
+            raw.close()
+    skipped = stream.skipped if skip_bad_lines else 0
+    return LoadResult(table_name, mode, rows, skipped, time.perf_counter() - start)
@@ -0,0 +1,156 @@
+"""Ranked claims search by patient name, insurer or denial reason (/claims/search).
+
+Each searchable column (database.CLAIMS_SEARCH_FIELDS) has a full-text
+GIN index, so a query matches claims containing each of its words as a
+word or word prefix: "smi jo" finds "John Smith". With the pg_trgm
+extension, trigram indexes also match misspellings ("Jon Smth") and text
+in the middle of a word; without it the search is limited to words and
+prefixes. A search is one indexed query and never calls a model.
+
+Claims are ranked by their best matching field: full-text matches first,
+then by trigram word similarity (ts_rank without pg_trgm), then by id.
+"""
+import re
+from typing import List, NamedTuple, Optional, Sequence
+
+from sqlalchemy import text
+
+from database import CLAIMS_SEARCH_FIELDS
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+MIN_QUERY_LENGTH = 2
+MAX_QUERY_LENGTH = 200
+# Letters and digits only, so the words are safe inside a to_tsquery expression
+WORDS = re.compile(r"[^\W_]+")
+
+_trigram = None
+
+
+class ClaimsSearchError(ValueError):
+    """The search request is invalid"""
+
+
+class SearchPage(NamedTuple):
+    results: List[dict]
+    next_offset: Optional[int]
+    fuzzy: bool
+
+
+def trigram_available(conn) -> bool:
+    """Whether pg_trgm is installed; checked once per process, after create_tables has run"""
+    global _trigram
+    if _trigram is None:
+        _trigram = bool(conn.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).scalar())
+    return _trigram
+
+
+def _conditions(column: str, config: str, trigram: bool, substring: bool) -> List[str]:
+    # The expressions match the indexes created by database.create_tables
+    conditions = [f"to_tsvector('{config}', {column}) @@ to_tsquery('{config}', :tsquery)"]
+    if trigram:
+        conditions.append(f":q <% {column}")
+        if substring:
+            conditions.append(f"{column} ILIKE :pattern")
+    return conditions
+
+
+def _field_ctes(column: str, trigram: bool, substring: bool) -> str:
+    """Matching rows of one field, and a score for each distinct matched value.
+
+    Insurers and denial reasons repeat across many rows; scoring each value
+    once instead of every row keeps broad queries from recomputing
+    to_tsvector tens of thousands of times. The GROUP BY also keeps the
+    planner from pulling the score expression up into the join.
+    """
+    table, config = CLAIMS_SEARCH_FIELDS[column]
+    claim_id = "claim_id" if table == "claims_detail" else "id"
+    full_text = f"to_tsvector('{config}', value) @@ to_tsquery('{config}', :tsquery)"
+    similarity = (f"word_similarity(:q, value)" if trigram
+                  else f"ts_rank(to_tsvector('{config}', value), to_tsquery('{config}', :tsquery))")
+    return f"""
+        {column}_rows AS (
+            SELECT {claim_id} AS claim_id, {column} AS value FROM {table}
+            WHERE {' OR '.join(_conditions(column, config, trigram, substring))}
+        ), {column}_scores AS (
+            SELECT value, CASE WHEN {full_text} THEN 1 ELSE 0 END + {similarity} AS score
+            FROM {column}_rows GROUP BY value
+        )
+    """
+
+
+def search_claims(conn, query: str, fields: Optional[Sequence[str]] = None,
+                  limit: int = DEFAULT_LIMIT, offset: int = 0) -> SearchPage:
+    """One page of claims matching ``query`` in ``fields`` (default: all), best first.
+
+    Raises ClaimsSearchError for an unusable query or unknown field.
+    """
+    query = " ".join(query.split())
+    words = WORDS.findall(query.lower())
+    if len(query) < MIN_QUERY_LENGTH or not words:
+        raise ClaimsSearchError(f"q must have at least {MIN_QUERY_LENGTH} characters, including a letter or digit")
+    if len(query) > MAX_QUERY_LENGTH:
+        raise ClaimsSearchError(f"q must be at most {MAX_QUERY_LENGTH} characters")
+    fields = [field.strip() for field in fields or () if field.strip()] or list(CLAIMS_SEARCH_FIELDS)
+    unknown = [field for field in fields if field not in CLAIMS_SEARCH_FIELDS]
+    if unknown:
+        raise ClaimsSearchError(f"Unknown search field(s) {', '.join(unknown)}; "
+                                f"use {', '.join(CLAIMS_SEARCH_FIELDS)}")
+    limit = max(1, min(limit, MAX_LIMIT))
+    offset = max(0, offset)
+
+    trigram = trigram_available(conn)
+    # Trigram indexes cannot narrow down patterns shorter than a trigram
+    substring = trigram and len(query) >= 3
+    params = {
+        "q": query,
+        "tsquery": " & ".join(f"{word}:*" for word in words),
+        "pattern": "%" + re.sub(r"([\\%_])", r"\\\1", query) + "%",
+        "limit": limit + 1,
+        "offset": offset,
+    }
+    rows = conn.execute(text(f"""
+        WITH {', '.join(_field_ctes(field, trigram, substring) for field in fields)},
+        matches AS (
+            {' UNION ALL '.join(
+                f"SELECT claim_id, {1 << i} AS field, score FROM {field}_rows JOIN {field}_scores USING (value)"
+                for i, field in enumerate(fields)
+            )}
+        ), ranked AS (
+            -- Fields as bit flags: bit_or lets the grouping hash instead of sorting every match
+            SELECT claim_id, max(score) AS score, bit_or(field) AS matched_fields
+            FROM matches
+            GROUP BY claim_id
+            ORDER BY score DESC, claim_id
+            LIMIT :limit OFFSET :offset
+        )
+        SELECT c.id, c.patient_name, c.billed_amount, c.paid_amount, c.status, c.insurer_name,
+               c.discharge_date, r.score, r.matched_fields
+        FROM ranked r JOIN claims_list c ON c.id = r.claim_id
+        ORDER BY r.score DESC, r.claim_id
+    """), params).mappings().all()
+
+    next_offset = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_offset = offset + limit
+
+    reasons = {}
+    if rows and "denial_reason" in fields:
+        _, config = CLAIMS_SEARCH_FIELDS["denial_reason"]
+        matched = conn.execute(text(f"""
+            SELECT DISTINCT claim_id, denial_reason FROM claims_detail
+            WHERE claim_id = ANY(:ids)
+              AND ({' OR '.join(_conditions('denial_reason', config, trigram, substring))})
+            ORDER BY claim_id, denial_reason
+        """), {**params, "ids": [row["id"] for row in rows]}).fetchall()
+        for claim_id, reason in matched:
+            reasons.setdefault(claim_id, []).append(reason)
+
+    results = [
+        {**row, "score": round(float(row["score"]), 4),
+         "matched_fields": [field for i, field in enumerate(fields) if row["matched_fields"] & (1 << i)],
+         "denial_reasons": reasons.get(row["id"], [])}
+        for row in rows
+    ]
+    return SearchPage(results, next_offset, trigram)
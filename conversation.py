@@ -0,0 +1,236 @@
+"""Multi-turn chat sessions with a bounded prompt.
+
+A session keeps its last ``recent_turns`` exchanges verbatim and folds older
+ones into a rolling summary, so the history sent to the model stays roughly
+the same size however long the conversation runs. Follow-up questions are
+rewritten into standalone queries before retrieval ("what about the second
+one?" embeds poorly on its own).
+
+Sessions are cached in memory (LRU) and persisted to ``chat_sessions``.
+Summarizing and saving happen in background tasks after the answer is
+returned; a session's own lock keeps those updates in order. The cache is
+per process, so with several workers a session should stick to one worker
+or the other workers may answer from a stale copy.
+"""
+import asyncio
+import logging
+import uuid
+from collections import OrderedDict
+from typing import Callable, List, Optional
+
+from database import ChatSession, SessionLocal
+from observability import Histogram, TOKEN_BUCKETS, record_cache, stage, token_usage_handler
+
+logger = logging.getLogger(__name__)
+
+CONVERSATION_TURN_TOKENS = Histogram(
+    "pdfchat_conversation_prompt_tokens", "Answer prompt tokens per session turn, by turn number range.",
+    ["turns"], buckets=TOKEN_BUCKETS
+)
+
+REWRITE_TEMPLATE = """Given the conversation below and a follow-up question, rewrite the follow-up
+as a standalone question that can be understood without the conversation. Keep names, numbers and
+terms from the conversation that the follow-up refers to. Return only the rewritten question.
+
+{history}
+
+Follow-up question: {question}
+
+Standalone question:"""
+
+SUMMARY_TEMPLATE = """Update the running summary of a conversation between a user and an assistant
+answering questions about their documents. Fold the new exchanges into the summary, keep facts,
+names and figures the user may refer back to, and drop small talk. Use at most {max_words} words.
+
+Current summary:
+{summary}
+
+New exchanges:
+{exchanges}
+
+Updated summary:"""
+
+
+def turn_bucket(turn_number: int) -> str:
+    for upper, label in ((1, "1"), (5, "2-5"), (20, "6-20"), (100, "21-100")):
+        if turn_number <= upper:
+            return label
+    return "100+"
+
+
+def format_turns(turns: List[dict]) -> str:
+    return "\n".join(f"User: {turn['question']}\nAssistant: {turn['answer']}" for turn in turns)
+
+
+class Conversation:
+    """In-memory state of one session"""
+
+    def __init__(self, id: uuid.UUID, user_id=None, summary: str = "", turns: Optional[List[dict]] = None,
+                 turn_count: int = 0):
+        self.id = id
+        self.user_id = user_id
+        self.summary = summary
+        self.turns = turns or []
+        self.turn_count = turn_count
+        self.deleted = False
+        self.lock = asyncio.Lock()
+
+    @property
+    def has_context(self) -> bool:
+        return bool(self.turns or self.summary)
+
+    def render_history(self) -> str:
+        """Summary plus verbatim recent turns, as inserted into the answer prompt"""
+        parts = []
+        if self.summary:
+            parts.append(f"Summary of earlier conversation:\n{self.summary}")
+        if self.turns:
+            parts.append(f"Recent conversation:\n{format_turns(self.turns)}")
+        return "\n\n".join(parts) or "(no previous conversation)"
+
+
+class ConversationStore:
+    def __init__(self, llm: Callable, session_factory=SessionLocal, recent_turns: int = 4,
+                 summary_max_words: int = 200, turn_max_chars: int = 2000, cache_size: int = 1000):
+        self.llm = llm
+        self.session_factory = session_factory
+        self.recent_turns = recent_turns
+        self.summary_max_words = summary_max_words
+        self.turn_max_chars = turn_max_chars
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._tasks = set()
+
+    def _remember(self, conversation: Conversation):
+        self._cache[conversation.id] = conversation
+        self._cache.move_to_end(conversation.id)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def create(self, user_id=None) -> Conversation:
+        conversation = Conversation(uuid.uuid4(), user_id=user_id)
+        await asyncio.get_running_loop().run_in_executor(None, self._save, conversation)
+        self._remember(conversation)
+        return conversation
+
+    async def get(self, session_id: uuid.UUID, user_id=None) -> Optional[Conversation]:
+        """Cached or stored session, or None if it does not exist or belongs to another user"""
+        conversation = self._cache.get(session_id)
+        record_cache("conversation", conversation is not None)
+        if conversation is None:
+            conversation = await asyncio.get_running_loop().run_in_executor(None, self._load, session_id)
+            if conversation is None:
+                return None
+            self._remember(conversation)
+        else:
+            self._cache.move_to_end(session_id)
+        if conversation.user_id is not None and conversation.user_id != user_id:
+            return None
+        return conversation
+
+    async def delete(self, conversation: Conversation):
+        conversation.deleted = True
+        self._cache.pop(conversation.id, None)
+        async with conversation.lock:
+            await asyncio.get_running_loop().run_in_executor(None, self._delete, conversation.id)
+
+    def rewrite_question(self, conversation: Conversation, question: str) -> str:
+        """Standalone version of a follow-up question, for embedding and retrieval"""
+        if not conversation.has_context:
+            return question
+        rewritten = self._complete(
+            REWRITE_TEMPLATE, "chat_rewrite", history=conversation.render_history(), question=question
+        ).strip()
+        return rewritten or question
+
+    def record_turn(self, conversation: Conversation, question: str, answer: str, prompt_tokens: Optional[int]):
+        """Append a finished exchange; summarizing and saving continue in the background"""
+        limit = self.turn_max_chars
+        conversation.turns.append({
+            "question": question if len(question) <= limit else question[:limit] + " ...",
+            "answer": answer if len(answer) <= limit else answer[:limit] + " ...",
+        })
+        conversation.turn_count += 1
+        if prompt_tokens is not None:
+            CONVERSATION_TURN_TOKENS.observe(prompt_tokens, turns=turn_bucket(conversation.turn_count))
+        task = asyncio.get_running_loop().create_task(self._compact_and_save(conversation))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def drain(self):
+        """Wait for pending summaries and saves, e.g. on shutdown"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _compact_and_save(self, conversation: Conversation):
+        loop = asyncio.get_running_loop()
+        async with conversation.lock:
+            if conversation.deleted:
+                return
+            overflow = len(conversation.turns) - self.recent_turns
+            if overflow > 0:
+                folded = conversation.turns[:overflow]
+                try:
+                    summary = await loop.run_in_executor(None, self._summarize, conversation.summary, folded)
+                except Exception:
+                    # Keep the turns verbatim and try again after the next turn
+                    logger.exception("Summarizing session %s failed", conversation.id)
+                else:
+                    conversation.summary = summary
+                    del conversation.turns[:overflow]
+            try:
+                await loop.run_in_executor(None, self._save, conversation)
+            except Exception:
+                logger.exception("Saving session %s failed", conversation.id)
+
+    def _summarize(self, summary: str, turns: List[dict]) -> str:
+        with stage("chat", "summarize"):
+            updated = self._complete(
+                SUMMARY_TEMPLATE, "chat_summary", summary=summary or "(empty)",
+                exchanges=format_turns(turns), max_words=self.summary_max_words
+            ).strip()
+        # The model is asked for a word budget; enforce it so the prompt stays bounded
+        words = updated.split()
+        if len(words) > self.summary_max_words * 2:
+            updated = " ".join(words[:self.summary_max_words * 2])
+        return updated
+
+    def _complete(self, template: str, operation: str, **inputs) -> str:
+        from langchain.prompts import PromptTemplate
+        from langchain_core.output_parsers import StrOutputParser
+
+        chain = PromptTemplate.from_template(template) | self.llm() | StrOutputParser()
+        return chain.invoke(inputs, config={"callbacks": [token_usage_handler(operation)]})
+
+    def _load(self, session_id: uuid.UUID) -> Optional[Conversation]:
+        db = self.session_factory()
+        try:
+            row = db.get(ChatSession, session_id)
+            if row is None:
+                return None
+            return Conversation(row.id, user_id=row.user_id, summary=row.summary or "",
+                                turns=list(row.recent_turns or []), turn_count=row.turn_count)
+        finally:
+            db.close()
+
+    def _save(self, conversation: Conversation):
+        db = self.session_factory()
+        try:
+            db.merge(ChatSession(
+                id=conversation.id,
+                user_id=conversation.user_id,
+                summary=conversation.summary,
+                recent_turns=list(conversation.turns),
+                turn_count=conversation.turn_count,
+            ))
+            db.commit()
+        finally:
+            db.close()
+
+    def _delete(self, session_id: uuid.UUID):
+        db = self.session_factory()
+        try:
+            db.query(ChatSession).filter(ChatSession.id == session_id).delete()
+            db.commit()
+        finally:
+            db.close()
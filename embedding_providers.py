@@ -0,0 +1,264 @@
+"""Pluggable embedding backends.
+
+Every backend is a LangChain ``Embeddings`` (so it also works with FAISS)
+that additionally reports ``model_id`` and ``dimension``. Vectors are tagged
+with the model id when stored and filtered by it when searched, so an index
+never mixes vectors from different models.
+
+The backend is chosen with environment variables:
+
+    EMBEDDING_BACKEND=google|local       (default: google)
+    LOCAL_EMBEDDING_MODEL_DIR=/models/x  (required for local)
+    EMBEDDING_DIMENSION=768              (output dimension, default 768)
+
+Further models can be added alongside it as embedding versions (see
+embedding_versions.py), built with create_embedding_provider.
+"""
+import json
+import os
+import re
+from typing import List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+DEFAULT_GOOGLE_MODEL = "models/embedding-001"
+DEFAULT_DIMENSION = 768
+# Gemini models whose output size is fixed, whatever EMBEDDING_DIMENSION says
+GOOGLE_MODEL_DIMENSIONS = {DEFAULT_GOOGLE_MODEL: 768, "models/text-embedding-004": 768}
+INDEX_METADATA_FILE = "embedding.json"
+
+
+class EmbeddingMismatchError(ValueError):
+    """Raised when stored vectors were produced by a different embedding model"""
+
+
+class EmbeddingProvider(Embeddings):
+    """Base class for embedding backends"""
+
+    model_id: str
+    dimension: int
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        raise NotImplementedError
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Embed several queries in one call"""
+        return self.embed_documents(texts)
+
+
+class GoogleEmbeddingProvider(EmbeddingProvider):
+    """Gemini embeddings over the network (the original backend).
+
+    The model decides the dimension. A ``dimension`` that differs from a
+    model in GOOGLE_MODEL_DIMENSIONS raises EmbeddingMismatchError here, and
+    for other models the first vectors returned are checked.
+    """
+
+    def __init__(self, model: str = DEFAULT_GOOGLE_MODEL, dimension: int = DEFAULT_DIMENSION):
+        known = GOOGLE_MODEL_DIMENSIONS.get(model)
+        if known is not None and dimension != known:
+            raise EmbeddingMismatchError(
+                f"{model} returns {known}-dimensional embeddings, not {dimension}; set EMBEDDING_DIMENSION={known}"
+            )
+        from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+        self.client = GoogleGenerativeAIEmbeddings(model=model)
+        self.model_id = f"google:{model}"
+        self.dimension = dimension
+        self._checked = known is not None
+
+    def _check(self, vectors: List[List[float]]) -> List[List[float]]:
+        if not self._checked and vectors:
+            if len(vectors[0]) != self.dimension:
+                raise EmbeddingMismatchError(
+                    f"{self.model_id} returned {len(vectors[0])}-dimensional embeddings, not {self.dimension}"
+                )
+            self._checked = True
+        return vectors
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._check(self.client.embed_documents(texts))
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._check([self.client.embed_query(text)])[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        # Batched requests, with the task type embed_query uses
+        return self._check(self.client.embed_documents(texts, task_type="RETRIEVAL_QUERY"))
+
+
+class LocalEmbeddingProvider(EmbeddingProvider):
+    """CPU-only static embedding model loaded from a directory on disk.
+
+    The directory holds ``vocab.txt`` (one token per line), ``embeddings.npy``
+    (a vocab_size x hidden float matrix) and optionally ``weights.npy``
+    (per-token weights such as IDF), ``projection.npy`` (hidden x dimension)
+    and ``config.json`` (``model_id``, ``lowercase``, ``token_pattern``).
+    Static embedding models such as Model2Vec distillations or GloVe export to
+    this layout directly.
+
+    A text is embedded as the weighted mean of its token vectors, projected
+    to ``dimension`` and L2-normalized. A batch is pooled with a single
+    bag-of-words matrix multiply, so the cost is dominated by BLAS rather
+    than per-token Python work. When no projection matrix is
+    shipped and ``dimension`` is smaller than the hidden size, a fixed
+    Gaussian random projection seeded from the model id is used.
+    """
+
+    def __init__(self, model_dir: str, dimension: Optional[int] = None, batch_size: int = 512):
+        self.model_dir = model_dir
+        self.batch_size = batch_size
+
+        config = {}
+        config_path = os.path.join(model_dir, "config.json")
+        if os.path.exists(config_path):
+            with open(config_path) as f:
+                config = json.load(f)
+        self.lowercase = config.get("lowercase", True)
+        self.token_pattern = re.compile(config.get("token_pattern", r"\w+"))
+
+        with open(os.path.join(model_dir, "vocab.txt"), encoding="utf-8") as f:
+            self.vocab = {token.rstrip("\n"): i for i, token in enumerate(f)}
+        self.unknown_id = self.vocab.get(config.get("unknown_token", "[UNK]"))
+
+        # Memory-mapped so processes loading the same model share its pages;
+        # only a matrix stored in another dtype is copied into memory
+        self.vectors = np.load(os.path.join(model_dir, "embeddings.npy"), mmap_mode="r").astype(np.float32, copy=False)
+        if self.vectors.shape[0] != len(self.vocab):
+            raise ValueError(f"{model_dir}: vocab.txt has {len(self.vocab)} tokens but embeddings.npy has {self.vectors.shape[0]} rows")
+
+        weights_path = os.path.join(model_dir, "weights.npy")
+        self.weights = (np.load(weights_path, mmap_mode="r").astype(np.float32, copy=False)
+                        if os.path.exists(weights_path) else None)
+
+        hidden = self.vectors.shape[1]
+        name = config.get("model_id", os.path.basename(os.path.normpath(model_dir)))
+        projection_path = os.path.join(model_dir, "projection.npy")
+        if os.path.exists(projection_path):
+            self.projection = np.load(projection_path).astype(np.float32)
+            self.dimension = self.projection.shape[1]
+            if dimension is not None and dimension != self.dimension:
+                raise ValueError(f"{model_dir}: projection.npy outputs {self.dimension} dimensions, not {dimension}")
+        else:
+            self.dimension = dimension or hidden
+            if self.dimension > hidden:
+                raise ValueError(f"{model_dir}: cannot produce {self.dimension} dimensions from a {hidden}-dimensional model")
+            self.projection = None
+            if self.dimension < hidden:
+                seed = int.from_bytes(name.encode("utf-8")[:8].ljust(8, b"\0"), "little")
+                rng = np.random.default_rng(seed)
+                self.projection = (rng.standard_normal((hidden, self.dimension)) / np.sqrt(self.dimension)).astype(np.float32)
+        self.model_id = f"local:{name}:{self.dimension}"
+
+    def _token_ids(self, text: str) -> List[int]:
+        if self.lowercase:
+            text = text.lower()
+        ids = []
+        for token in self.token_pattern.findall(text):
+            token_id = self.vocab.get(token, self.unknown_id)
+            if token_id is not None:
+                ids.append(token_id)
+        return ids
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        token_ids = [self._token_ids(text) for text in texts]
+        lengths = np.fromiter((len(ids) for ids in token_ids), dtype=np.int64, count=len(texts))
+        flat_ids = np.fromiter((i for ids in token_ids for i in ids), dtype=np.int64, count=int(lengths.sum()))
+        doc_index = np.repeat(np.arange(len(texts)), lengths)
+
+        # Bag-of-words over the batch's distinct tokens, then one matmul
+        # against just those rows of the embedding matrix.
+        unique_ids, columns = np.unique(flat_ids, return_inverse=True)
+        token_weights = self.weights[flat_ids] if self.weights is not None else np.ones(flat_ids.size, dtype=np.float32)
+        bag = np.bincount(
+            doc_index * unique_ids.size + columns, weights=token_weights, minlength=len(texts) * unique_ids.size
+        ).astype(np.float32).reshape(len(texts), unique_ids.size)
+        totals = bag.sum(axis=1, keepdims=True)
+        pooled = (bag @ self.vectors[unique_ids]) / np.maximum(totals, 1e-12)
+
+        if self.projection is not None:
+            pooled = pooled @ self.projection
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        return pooled / np.maximum(norms, 1e-12)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        batches = [self._embed_batch(texts[i:i + self.batch_size]) for i in range(0, len(texts), self.batch_size)]
+        if not batches:
+            return []
+        return np.vstack(batches).tolist()
+
+
+_provider = None
+
+
+def create_embedding_provider(backend: str, dimension: int = DEFAULT_DIMENSION, model: Optional[str] = None,
+                              model_dir: Optional[str] = None) -> EmbeddingProvider:
+    """Build a backend from explicit settings, e.g. those recorded for an embedding version"""
+    backend = backend.lower()
+    if backend == "google":
+        return GoogleEmbeddingProvider(model=model or DEFAULT_GOOGLE_MODEL, dimension=dimension)
+    if backend == "local":
+        if not model_dir:
+            raise ValueError("A model directory is required for the local backend")
+        return LocalEmbeddingProvider(model_dir, dimension=dimension)
+    raise ValueError(f"Unknown embedding backend '{backend}'; expected 'google' or 'local'")
+
+
+def get_embedding_provider() -> EmbeddingProvider:
+    """Return the process-wide embedding backend configured by the environment"""
+    global _provider
+    if _provider is None:
+        backend = os.getenv("EMBEDDING_BACKEND", "google").lower()
+        if backend == "local" and not os.getenv("LOCAL_EMBEDDING_MODEL_DIR"):
+            raise ValueError("LOCAL_EMBEDDING_MODEL_DIR must be set when EMBEDDING_BACKEND=local")
+        if backend not in ("google", "local"):
+            raise ValueError(f"Unknown EMBEDDING_BACKEND '{backend}'; expected 'google' or 'local'")
+        _provider = create_embedding_provider(
+            backend, int(os.getenv("EMBEDDING_DIMENSION", DEFAULT_DIMENSION)),
+            model_dir=os.getenv("LOCAL_EMBEDDING_MODEL_DIR"),
+        )
+    return _provider
+
+
+def provider_info(embeddings) -> dict:
+    """model_id/dimension of any Embeddings object, assuming the legacy Gemini model if untagged"""
+    return {
+        "model_id": getattr(embeddings, "model_id", f"google:{DEFAULT_GOOGLE_MODEL}"),
+        "dimension": getattr(embeddings, "dimension", DEFAULT_DIMENSION),
+    }
+
+
+def embed_queries(embeddings, texts: List[str]) -> List[List[float]]:
+    """Query embeddings for a batch of texts, in one call where the backend supports it"""
+    if hasattr(embeddings, "embed_queries"):
+        return embeddings.embed_queries(texts)
+    return [embeddings.embed_query(text) for text in texts]
+
+
+def write_index_metadata(index_dir: str, embeddings):
+    """Record which model produced a saved FAISS index"""
+    with open(os.path.join(index_dir, INDEX_METADATA_FILE), "w") as f:
+        json.dump(provider_info(embeddings), f)
+
+
+def read_index_metadata(index_dir: str) -> dict:
+    """Model that produced a saved FAISS index; indexes predating the metadata file used Gemini"""
+    path = os.path.join(index_dir, INDEX_METADATA_FILE)
+    if not os.path.exists(path):
+        return {"model_id": f"google:{DEFAULT_GOOGLE_MODEL}", "dimension": DEFAULT_DIMENSION}
+    with open(path) as f:
+        return json.load(f)
+
+
+def check_index_metadata(index_dir: str, embeddings):
+    """Raise EmbeddingMismatchError if the index was built with a different model"""
+    stored, current = read_index_metadata(index_dir), provider_info(embeddings)
+    if stored["model_id"] != current["model_id"] or stored["dimension"] != current["dimension"]:
+        raise EmbeddingMismatchError(
+            f"Index {index_dir} was built with {stored['model_id']} ({stored['dimension']}d) "
+            f"but the configured model is {current['model_id']} ({current['dimension']}d); re-process the PDFs"
+        )
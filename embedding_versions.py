@@ -0,0 +1,434 @@
+"""Versioned chunk embeddings: move the corpus to another model while chat keeps serving.
+
+    python embedding_versions.py create v2 --backend local --model-dir /models/x --dimension 384
+    python embedding_versions.py run v2 [--batch-size 256] [--max-rate 100]
+    python embedding_versions.py status
+    python embedding_versions.py activate v2
+    python embedding_versions.py rollback
+    python embedding_versions.py retire default
+
+document_chunks.embedding holds the vectors of the model configured by the
+environment; it is registered as the "default" version when the first
+other version is created. Every other version has its own table,
+chunk_embeddings_<name> (chunk_id, embedding vector(dimension)), so models
+of any dimension can live side by side.
+
+From the moment a version is created, uploads embed their chunks with
+every version that is not retired (dual-write), and ``run`` embeds the
+chunks that existed before in throttled batches, resuming after the last
+batch it committed. Once every chunk has a vector, ``activate`` makes the
+version the one /chat searches and embeds questions with. The version it
+replaces is still written, so ``rollback`` switches straight back; ``retire``
+stops writing a version that is no longer needed. API processes re-read
+the active version every EMBEDDING_VERSION_REFRESH seconds.
+
+Uploads hold a shared advisory lock from reading the registry until they
+commit, and registry changes take it exclusively, so an upload cannot miss
+a version created while it was running.
+"""
+import argparse
+import os
+import re
+import threading
+import time
+from typing import List, NamedTuple, Optional
+
+from sqlalchemy import text
+
+from database import EMBEDDING_DIMENSION, create_tables, engine, vector_change_triggers
+
+DEFAULT_VERSION = "default"
+DEFAULT_TABLE = "document_chunks"
+VERSION_NAME = re.compile(r"^[a-z][a-z0-9_]{0,39}$")
+REGISTRY_LOCK = "hashtext('pdfchat_embedding_versions')"
+REFRESH_SECONDS = float(os.getenv("EMBEDDING_VERSION_REFRESH", 5))
+COLUMNS = "name, model_id, backend, model, model_dir, dimension, table_name, state, previous_name"
+
+_active = {"version": None, "checked_at": None}
+_providers = {}
+_providers_lock = threading.Lock()
+
+
+class EmbeddingVersionError(ValueError):
+    """The registry does not allow the requested change"""
+
+
+class VersionInfo(NamedTuple):
+    name: str
+    model_id: str
+    backend: Optional[str]
+    model: Optional[str]
+    model_dir: Optional[str]
+    dimension: int
+    table_name: str
+    state: str
+    previous_name: Optional[str]
+
+    @property
+    def is_default(self) -> bool:
+        return self.table_name == DEFAULT_TABLE
+
+
+def _versions(conn, where: str = "TRUE", params: dict = None, lock: bool = False) -> List[VersionInfo]:
+    rows = conn.execute(text(f"""
+        SELECT {COLUMNS} FROM embedding_versions WHERE {where} ORDER BY created_at, name
+    """ + (" FOR UPDATE" if lock else "")), params or {}).fetchall()
+    return [VersionInfo(*row) for row in rows]
+
+
+def _version(conn, name: str, lock: bool = False) -> VersionInfo:
+    versions = _versions(conn, "name = :name", {"name": name}, lock=lock)
+    if not versions:
+        raise EmbeddingVersionError(f"No embedding version '{name}'")
+    return versions[0]
+
+
+def active_version(refresh: bool = False) -> Optional[VersionInfo]:
+    """Version questions are answered from, re-read every REFRESH_SECONDS; None until a version is created"""
+    now = time.monotonic()
+    if refresh or _active["checked_at"] is None or now - _active["checked_at"] >= REFRESH_SECONDS:
+        with engine.connect() as conn:
+            versions = _versions(conn, "state = 'active'")
+        _active["version"] = versions[0] if versions else None
+        _active["checked_at"] = now
+    return _active["version"]
+
+
+def version_provider(version: VersionInfo):
+    """Embedding model of a non-default version, built once per process"""
+    with _providers_lock:
+        provider = _providers.get(version.name)
+        if provider is None or provider.model_id != version.model_id:
+            from embedding_providers import create_embedding_provider
+            provider = _providers[version.name] = create_embedding_provider(
+                version.backend, version.dimension, model=version.model, model_dir=version.model_dir
+            )
+        return provider
+
+
+def vector_source(version: Optional[VersionInfo]):
+    """FROM clause, vector expression and filter for searching a version, with chunks aliased as c.
+
+    The default version filters on :model_id, as document_chunks.embedding
+    may hold vectors of models configured in the past.
+    """
+    if version is None or version.is_default:
+        return "document_chunks c", "c.embedding", "c.embedding_model = :model_id"
+    return f"{version.table_name} e JOIN document_chunks c ON c.id = e.chunk_id", "e.embedding", "TRUE"
+
+
+def has_searchable_chunks(conn, model_id: str, version: Optional[VersionInfo]) -> bool:
+    source, _, condition = vector_source(version)
+    return conn.execute(text(f"SELECT EXISTS (SELECT 1 FROM {source} WHERE {condition})"),
+                        {"model_id": model_id}).scalar()
+
+
+def lock_for_upload(conn) -> List[VersionInfo]:
+    """Take the registry lock shared until the transaction ends; returns the versions to write.
+
+    An empty list means no version has been created: only
+    document_chunks.embedding is written, as before.
+    """
+    conn.execute(text(f"SELECT pg_advisory_xact_lock_shared({REGISTRY_LOCK})"))
+    return _versions(conn, "state <> 'retired'")
+
+
+def store_embeddings(conn, version: VersionInfo, chunk_ids: List[int], vectors) -> int:
+    """Insert a version's vectors; chunks that already have one or no longer exist are skipped"""
+    if not chunk_ids:
+        return 0
+    return conn.execute(text(f"""
+        INSERT INTO {version.table_name} (chunk_id, embedding)
+        SELECT v.chunk_id, v.embedding
+        FROM unnest(CAST(:chunk_ids AS integer[]), CAST(:vectors AS vector[])) AS v(chunk_id, embedding)
+        WHERE EXISTS (SELECT 1 FROM document_chunks c WHERE c.id = v.chunk_id)
+        ON CONFLICT (chunk_id) DO NOTHING
+    """), {"chunk_ids": list(chunk_ids), "vectors": [str(list(vector)) for vector in vectors]}).rowcount
+
+
+def missing_chunks(conn, version: VersionInfo) -> int:
+    """Chunks the version has no vector for"""
+    if version.is_default:
+        return conn.execute(text("SELECT COUNT(*) FROM document_chunks WHERE embedding IS NULL")).scalar()
+    return conn.execute(text(f"""
+        SELECT COUNT(*) FROM document_chunks c
+        WHERE NOT EXISTS (SELECT 1 FROM {version.table_name} e WHERE e.chunk_id = c.id)
+    """)).scalar()
+
+
+def _register_default(conn, default_model_id: str):
+    conn.execute(text("""
+        INSERT INTO embedding_versions
+            (name, model_id, backend, model_dir, dimension, table_name, state, last_chunk_id,
+             created_at, updated_at, completed_at, activated_at)
+        VALUES (:name, :model_id, :backend, :model_dir, :dimension, :table_name, 'active', 0,
+                now(), now(), now(), now())
+        ON CONFLICT (name) DO NOTHING
+    """), {
+        "name": DEFAULT_VERSION, "model_id": default_model_id, "table_name": DEFAULT_TABLE,
+        "backend": os.getenv("EMBEDDING_BACKEND", "google").lower(),
+        "model_dir": os.getenv("LOCAL_EMBEDDING_MODEL_DIR"), "dimension": EMBEDDING_DIMENSION,
+    })
+
+
+def create_version(name: str, backend: str, dimension: int, model: Optional[str] = None,
+                   model_dir: Optional[str] = None, default_model_id: Optional[str] = None) -> VersionInfo:
+    """Register a new version and create its table; uploads start writing it right away.
+
+    ``default_model_id`` identifies the vectors in document_chunks.embedding
+    and defaults to the model configured by the environment.
+    """
+    if not VERSION_NAME.match(name) or name == DEFAULT_VERSION:
+        raise EmbeddingVersionError(
+            f"Invalid version name '{name}': use lowercase letters, digits and _, not '{DEFAULT_VERSION}'"
+        )
+    from embedding_providers import create_embedding_provider, get_embedding_provider, provider_info
+
+    provider = create_embedding_provider(backend, dimension, model=model, model_dir=model_dir)
+    if default_model_id is None:
+        default_model_id = provider_info(get_embedding_provider())["model_id"]
+    version = VersionInfo(name, provider.model_id, backend.lower(), model, model_dir, provider.dimension,
+                          f"chunk_embeddings_{name}", "building", None)
+    with engine.begin() as conn:
+        # Waits for uploads in flight; those that follow see the new version
+        conn.execute(text(f"SELECT pg_advisory_xact_lock({REGISTRY_LOCK})"))
+        _register_default(conn, default_model_id)
+        if _versions(conn, "name = :name", {"name": name}):
+            raise EmbeddingVersionError(f"Embedding version '{name}' already exists")
+        conn.execute(text(f"""
+            CREATE TABLE {version.table_name} (
+                chunk_id integer PRIMARY KEY REFERENCES document_chunks (id) ON DELETE CASCADE,
+                embedding vector({version.dimension}) NOT NULL
+            )
+        """))
+        for statement in vector_change_triggers(version.table_name, "chunk_id"):
+            conn.execute(text(statement))
+        conn.execute(text("""
+            INSERT INTO embedding_versions
+                (name, model_id, backend, model, model_dir, dimension, table_name, state, last_chunk_id,
+                 created_at, updated_at)
+            VALUES (:name, :model_id, :backend, :model, :model_dir, :dimension, :table_name, :state, 0, now(), now())
+        """), version._asdict())
+    return version
+
+
+def _next_batch(conn, version: VersionInfo, after: Optional[int], batch_size: int):
+    """Chunks without a vector in the version, in id order after ``after`` (anywhere if None)"""
+    bound = "c.id > :after AND " if after is not None else ""
+    return conn.execute(text(f"""
+        SELECT c.id, c.content FROM document_chunks c
+        WHERE {bound}NOT EXISTS (SELECT 1 FROM {version.table_name} e WHERE e.chunk_id = c.id)
+        ORDER BY c.id
+        LIMIT :limit
+    """), {"after": after, "limit": batch_size}).fetchall()
+
+
+def _embed_missing(version: VersionInfo, batch_size: int, max_rate: float, report, sleep) -> int:
+    provider = version_provider(version)
+    with engine.connect() as conn:
+        after = conn.execute(text("SELECT last_chunk_id FROM embedding_versions WHERE name = :name"),
+                             {"name": version.name}).scalar()
+        missing = missing_chunks(conn, version)
+    report(f"Embedding {missing} chunks with {version.model_id}" + (f", resuming after chunk {after}" if after else ""))
+
+    embedded, start = 0, time.perf_counter()
+    while True:
+        batch_start = time.perf_counter()
+        with engine.connect() as conn:
+            rows = _next_batch(conn, version, after, batch_size)
+        if not rows:
+            if after is None:
+                break
+            # One more pass from the start picks up chunks committed behind the cursor
+            after = None
+            continue
+        vectors = provider.embed_documents([row.content for row in rows])
+        with engine.begin() as conn:
+            embedded += store_embeddings(conn, version, [row.id for row in rows], vectors)
+            rate = embedded / (time.perf_counter() - start)
+            conn.execute(text("""
+                UPDATE embedding_versions
+                SET last_chunk_id = GREATEST(last_chunk_id, :last_chunk_id), chunks_per_second = :rate,
+                    updated_at = now()
+                WHERE name = :name
+            """), {"name": version.name, "last_chunk_id": rows[-1].id, "rate": round(rate, 1)})
+        if after is not None:
+            after = rows[-1].id
+        report(f"  {embedded}/{missing} chunks ({rate:.0f}/s)")
+        if max_rate:
+            sleep(max(0.0, len(rows) / max_rate - (time.perf_counter() - batch_start)))
+    return embedded
+
+
+def run_version(name: str, batch_size: int = 256, max_rate: float = 0.0, report=print, sleep=time.sleep) -> int:
+    """Embed every chunk the version is missing and mark a building version ready; returns chunks embedded.
+
+    ``max_rate`` caps chunks per second (0 for no limit) so the job leaves
+    database and embedding quota for live traffic. Running an active or
+    ready version again embeds any chunks it is missing.
+    """
+    with engine.connect() as conn:
+        version = _version(conn, name)
+    if version.is_default:
+        raise EmbeddingVersionError("The default version is written by uploads and cannot be rebuilt")
+    if version.state == "retired":
+        raise EmbeddingVersionError(f"Embedding version '{name}' is retired")
+
+    key = {"key": f"pdfchat_embedding_version:{name}"}
+    with engine.connect() as lock_conn:
+        if not lock_conn.execute(text("SELECT pg_try_advisory_lock(hashtext(:key))"), key).scalar():
+            raise EmbeddingVersionError(f"Embedding version '{name}' is already being built by another process")
+        try:
+            embedded = _embed_missing(version, batch_size, max_rate, report, sleep)
+            with engine.begin() as conn:
+                conn.execute(text("""
+                    UPDATE embedding_versions SET state = 'ready', completed_at = now(), updated_at = now()
+                    WHERE name = :name AND state = 'building'
+                """), {"name": name})
+        finally:
+            lock_conn.execute(text("SELECT pg_advisory_unlock(hashtext(:key))"), key)
+            lock_conn.commit()
+    report(f"Embedding version '{name}' covers every chunk ({embedded} embedded by this run)")
+    return embedded
+
+
+def activate_version(name: str) -> VersionInfo:
+    """Answer questions from a fully embedded version; the one it replaces stays ready for a rollback"""
+    with engine.begin() as conn:
+        conn.execute(text(f"SELECT pg_advisory_xact_lock({REGISTRY_LOCK})"))
+        versions = {version.name: version for version in _versions(conn, lock=True)}
+        target = versions.get(name)
+        if target is None:
+            raise EmbeddingVersionError(f"No embedding version '{name}'")
+        if target.state == "active":
+            return target
+        if target.state != "ready":
+            raise EmbeddingVersionError(f"Embedding version '{name}' is {target.state}; only ready versions can be activated")
+        missing = missing_chunks(conn, target)
+        if missing:
+            raise EmbeddingVersionError(f"{missing} chunks have no vector in '{name}' yet; run it first")
+        current = next((version for version in versions.values() if version.state == "active"), None)
+        if current is not None:
+            conn.execute(text("UPDATE embedding_versions SET state = 'ready', updated_at = now() WHERE name = :name"),
+                         {"name": current.name})
+        conn.execute(text("""
+            UPDATE embedding_versions
+            SET state = 'active', previous_name = :previous_name, activated_at = now(), updated_at = now()
+            WHERE name = :name
+        """), {"name": name, "previous_name": current.name if current else None})
+    active_version(refresh=True)
+    return target._replace(state="active", previous_name=current.name if current else None)
+
+
+def rollback_version() -> VersionInfo:
+    """Switch back to the version that was active before the current one"""
+    current = active_version(refresh=True)
+    if current is None or current.previous_name is None:
+        raise EmbeddingVersionError("There is no previous embedding version to roll back to")
+    return activate_version(current.previous_name)
+
+
+def retire_version(name: str, drop: bool = False):
+    """Stop writing a version (it can no longer be activated); ``drop`` also drops its table"""
+    with engine.begin() as conn:
+        # Waits for uploads still writing to the version
+        conn.execute(text(f"SELECT pg_advisory_xact_lock({REGISTRY_LOCK})"))
+        version = _version(conn, name, lock=True)
+        if version.state == "active":
+            raise EmbeddingVersionError(f"Embedding version '{name}' is active; activate another version first")
+        if drop and version.is_default:
+            raise EmbeddingVersionError("The default version lives in document_chunks and cannot be dropped")
+        conn.execute(text("UPDATE embedding_versions SET state = 'retired', updated_at = now() WHERE name = :name"),
+                     {"name": name})
+        conn.execute(text("UPDATE embedding_versions SET previous_name = NULL WHERE previous_name = :name"),
+                     {"name": name})
+        if drop:
+            conn.execute(text(f"DROP TABLE IF EXISTS {version.table_name}"))
+
+
+def version_status() -> List[dict]:
+    """Every version with its coverage of document_chunks and, while building, throughput and ETA"""
+    with engine.connect() as conn:
+        total = conn.execute(text("SELECT COUNT(*) FROM document_chunks")).scalar()
+        rows = conn.execute(text(f"""
+            SELECT {COLUMNS}, chunks_per_second, created_at, updated_at, completed_at, activated_at
+            FROM embedding_versions ORDER BY created_at, name
+        """)).mappings().all()
+        status = []
+        for row in rows:
+            version = VersionInfo(*(row[field] for field in VersionInfo._fields))
+            embedded = total - missing_chunks(conn, version) if version.state != "retired" else None
+            rate = row["chunks_per_second"]
+            status.append({
+                "name": version.name,
+                "model_id": version.model_id,
+                "dimension": version.dimension,
+                "state": version.state,
+                "previous_name": version.previous_name,
+                "chunks_embedded": embedded,
+                "chunks_total": total,
+                "coverage_percent": round(100 * embedded / total, 2) if embedded is not None and total else None,
+                "chunks_per_second": rate,
+                "eta_seconds": round((total - embedded) / rate) if version.state == "building" and rate else None,
+                "created_at": row["created_at"],
+                "updated_at": row["updated_at"],
+                "completed_at": row["completed_at"],
+                "activated_at": row["activated_at"],
+            })
+    return status
+
+
+def print_status():
+    versions = version_status()
+    if not versions:
+        print("No embedding versions yet: chunks are searched with the configured model")
+    for version in versions:
+        coverage = "-" if version["coverage_percent"] is None else f"{version['coverage_percent']}%"
+        line = (f"{version['name']:<12} {version['state']:<9} {coverage:>8}  {version['model_id']} "
+                f"({version['dimension']} dims)")
+        if version["eta_seconds"] is not None:
+            line += f", {version['chunks_per_second']:.0f} chunks/s, about {version['eta_seconds']}s left"
+        print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    create = commands.add_parser("create", help="register a version; uploads start writing it")
+    create.add_argument("name")
+    create.add_argument("--backend", required=True, choices=["google", "local"])
+    create.add_argument("--dimension", type=int, required=True)
+    create.add_argument("--model", help="Gemini embedding model, e.g. models/text-embedding-004")
+    create.add_argument("--model-dir", help="model directory for the local backend")
+    run = commands.add_parser("run", help="embed the chunks a version is missing")
+    run.add_argument("name")
+    run.add_argument("--batch-size", type=int, default=256, help="chunks embedded and committed together")
+    run.add_argument("--max-rate", type=float, default=0.0, help="chunks per second at most (0 = unthrottled)")
+    commands.add_parser("status", help="coverage and progress of every version")
+    activate = commands.add_parser("activate", help="answer questions from a ready version")
+    activate.add_argument("name")
+    commands.add_parser("rollback", help="reactivate the previously active version")
+    retire = commands.add_parser("retire", help="stop writing a version")
+    retire.add_argument("name")
+    retire.add_argument("--drop", action="store_true", help="also drop its table")
+    args = parser.parse_args()
+
+    create_tables()
+    try:
+        if args.command == "create":
+            version = create_version(args.name, args.backend, args.dimension, model=args.model, model_dir=args.model_dir)
+            print(f"Created embedding version '{version.name}' ({version.model_id}); uploads now write it too")
+        elif args.command == "run":
+            run_version(args.name, args.batch_size, args.max_rate)
+        elif args.command == "status":
+            print_status()
+        elif args.command == "activate":
+            activate_version(args.name)
+            print(f"Questions are now answered from '{args.name}'")
+        elif args.command == "rollback":
+            print(f"Questions are now answered from '{rollback_version().name}'")
+        elif args.command == "retire":
+            retire_version(args.name, drop=args.drop)
+            print(f"Retired embedding version '{args.name}'")
+    except EmbeddingVersionError as e:
+        raise SystemExit(str(e))
@@ -0,0 +1,225 @@
+"""Process-level cache of the FAISS index used by the Streamlit apps.
+
+Streamlit reruns the whole script for every interaction, so the apps used
+to deserialize ``faiss_index`` on each question. ``load_index`` keeps one
+open store per index directory and reopens it only when the files on disk
+change (size or mtime), e.g. after another process re-processed PDFs. The
+vectors are memory-mapped rather than read, so opening a large index costs
+little memory and pages are loaded as searches touch them.
+
+A memory-mapped index cannot be modified in place (FAISS aborts), so
+``update_index`` works on an in-memory copy. Each saved version gets its
+own directory beside ``index_dir`` (``.faiss_index.v<ns>``), and
+``index_dir`` is a symlink that is switched to it with one atomic rename,
+so readers see either the old files or the new ones, never a mix. Readers
+resolve the link once and read every file from the version it points to;
+the previous version is kept for readers that resolved it just before a
+switch. Chunks are identified by a hash of their source and text, so
+re-processing a PDF only embeds chunks that are new and drops those it no
+longer contains.
+"""
+import hashlib
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from embedding_providers import (
+    INDEX_METADATA_FILE, EmbeddingMismatchError, check_index_metadata, provider_info, write_index_metadata,
+)
+
+INDEX_FILES = ("index.faiss", "index.pkl", INDEX_METADATA_FILE)
+
+_lock = threading.RLock()
+_cache = {}
+
+
+def index_signature(index_dir: str) -> Optional[Tuple]:
+    """Version directory, size and mtime of the index files, or None if the index does not exist"""
+    version_dir = os.path.realpath(index_dir)
+    signature = [version_dir]
+    for name in INDEX_FILES:
+        path = os.path.join(version_dir, name)
+        if not os.path.exists(path):
+            if name == INDEX_METADATA_FILE:
+                continue
+            return None
+        stat = os.stat(path)
+        signature.append((name, stat.st_size, stat.st_mtime_ns))
+    return tuple(signature)
+
+
+def chunk_id(source: str, text: str) -> str:
+    return hashlib.sha1(f"{source}\0{text}".encode("utf-8")).hexdigest()
+
+
+def _read_vectors(index_dir: str, mmap: bool = True):
+    import faiss
+
+    flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) if mmap else 0
+    return faiss.read_index(os.path.join(index_dir, "index.faiss"), flags)
+
+
+def _read(index_dir: str, embeddings, mmap: bool = True):
+    from langchain_community.vectorstores import FAISS
+
+    index = _read_vectors(index_dir, mmap)
+    with open(os.path.join(index_dir, "index.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    return FAISS(embeddings, index, docstore, index_to_docstore_id)
+
+
+def _cached(index_dir: str, embeddings, signature):
+    entry = _cache.get(os.path.abspath(index_dir))
+    if entry and entry["signature"] == signature and entry["model_id"] == provider_info(embeddings)["model_id"]:
+        return entry["store"]
+    return None
+
+
+def _remember(index_dir: str, embeddings, signature, store):
+    _cache[os.path.abspath(index_dir)] = {
+        "signature": signature, "model_id": provider_info(embeddings)["model_id"], "store": store,
+    }
+
+
+def load_index(index_dir: str, embeddings):
+    """Open (or reuse) the FAISS store in ``index_dir``; treat it as read-only.
+
+    Raises FileNotFoundError if there is no index and EmbeddingMismatchError
+    if it was built with another model.
+    """
+    with _lock:
+        signature = index_signature(index_dir)
+        if signature is None:
+            raise FileNotFoundError(f"No FAISS index in {index_dir}")
+        store = _cached(index_dir, embeddings, signature)
+        if store is None:
+            # Read the version the signature names, even if index_dir is switched meanwhile
+            version_dir = signature[0]
+            check_index_metadata(version_dir, embeddings)
+            store = _read(version_dir, embeddings)
+            _remember(index_dir, embeddings, signature, store)
+        return store
+
+
+def _version_number(name: str, prefix: str) -> int:
+    try:
+        return int(name[len(prefix):]) if name.startswith(prefix) else -1
+    except ValueError:
+        return -1
+
+
+def _save(store, index_dir: str, embeddings):
+    """Write the store to a new version directory and point index_dir at it"""
+    index_dir = os.path.abspath(index_dir)
+    parent, name = os.path.split(index_dir.rstrip(os.sep))
+    prefix = f".{name}.v"
+    previous = os.path.basename(os.path.realpath(index_dir)) if os.path.islink(index_dir) else None
+    staging = tempfile.mkdtemp(prefix=f".{name}.tmp-", dir=parent)
+    try:
+        store.save_local(staging)
+        write_index_metadata(staging, embeddings)
+        if os.path.isdir(index_dir) and not os.path.islink(index_dir):
+            # An index saved before versioning becomes the previous version. A
+            # directory cannot be renamed over, so readers miss the index
+            # between this rename and the switch below, once.
+            previous = f"{prefix}{time.time_ns()}"
+            os.rename(index_dir, os.path.join(parent, previous))
+        version = f"{prefix}{time.time_ns()}"
+        os.rename(staging, os.path.join(parent, version))
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+    # rename() of a new link over the old one is the atomic switch
+    link = os.path.join(parent, f".{name}.link-{os.getpid()}-{threading.get_ident()}")
+    os.symlink(version, link)
+    os.replace(link, index_dir)
+
+    # Keep the version just replaced, for readers that resolved the link before the switch
+    keep = _version_number(previous if previous else version, prefix)
+    for entry in os.listdir(parent):
+        if -1 < _version_number(entry, prefix) < keep:
+            shutil.rmtree(os.path.join(parent, entry), ignore_errors=True)
+
+
+def update_index(index_dir: str, embeddings, chunks_by_source: Dict[str, List[str]]) -> Tuple[int, int]:
+    """Bring the chunks of each given source up to date; returns (added, removed).
+
+    Other sources already in the index are kept. An index built with a
+    different model is replaced, as rebuilding from scratch used to do.
+    """
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from langchain_community.vectorstores import FAISS
+
+    wanted = {}
+    for source, chunks in chunks_by_source.items():
+        for text in chunks:
+            wanted.setdefault(chunk_id(source, text), (text, {"source": source}))
+
+    with _lock:
+        try:
+            current = load_index(index_dir, embeddings)
+        except (FileNotFoundError, EmbeddingMismatchError):
+            current = None
+
+        if current is None:
+            if not wanted:
+                return 0, 0
+            ids = list(wanted)
+            store = FAISS.from_texts([wanted[i][0] for i in ids], embeddings,
+                                     metadatas=[wanted[i][1] for i in ids], ids=ids)
+            added, removed = len(ids), 0
+        else:
+            import faiss
+            from langchain_core.documents import Document
+
+            existing = set(current.index_to_docstore_id.values())
+            stale, untagged = [], {}
+            for doc_id in existing:
+                doc = current.docstore.search(doc_id)
+                source = (doc.metadata or {}).get("source")
+                if source is None:
+                    untagged[doc_id] = doc.page_content
+                elif doc_id not in wanted and source in chunks_by_source:
+                    stale.append(doc_id)
+            # Chunks saved before they were tagged with their source have random ids.
+            # The apps then rebuilt the index from the current uploads each time, so
+            # one that is being indexed again takes its chunk id and source (no new
+            # embedding) and the rest are dropped, as that rebuild would have done.
+            by_text = {}
+            for doc_id, (text, _) in wanted.items():
+                by_text.setdefault(text, doc_id)
+            retag = {}
+            for doc_id, text in untagged.items():
+                target = by_text.pop(text, None)
+                if target is not None and target not in existing:
+                    retag[doc_id] = target
+                else:
+                    stale.append(doc_id)
+            retagged = set(retag.values())
+            new = [doc_id for doc_id in wanted if doc_id not in existing and doc_id not in retagged]
+            if not stale and not new and not retag:
+                return 0, 0
+            # Modify copies of the store being updated: other sessions may be searching
+            # it, and a clone of a memory-mapped index would still be a read-only view
+            docs = dict(current.docstore._dict)
+            for doc_id, target in retag.items():
+                docs[target] = Document(page_content=docs.pop(doc_id).page_content, metadata=wanted[target][1])
+            store = FAISS(embeddings, faiss.deserialize_index(faiss.serialize_index(current.index)),
+                          InMemoryDocstore(docs),
+                          {i: retag.get(doc_id, doc_id) for i, doc_id in current.index_to_docstore_id.items()})
+            if stale:
+                store.delete(stale)
+            if new:
+                store.add_texts([wanted[i][0] for i in new], metadatas=[wanted[i][1] for i in new], ids=new)
+            added, removed = len(new), len(stale)
+
+        _save(store, index_dir, embeddings)
+        # Serve the saved files memory-mapped, reusing the docstore already in memory
+        signature = index_signature(index_dir)
+        _remember(index_dir, embeddings, signature,
+                  FAISS(embeddings, _read_vectors(signature[0]), store.docstore, store.index_to_docstore_id))
+        return added, removed
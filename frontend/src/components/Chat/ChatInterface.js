@@ -7,8 +7,33 @@ const ChatInterface = () => {
   const [inputValue, setInputValue] = useState('');
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState('');
+  const [historyCursor, setHistoryCursor] = useState(null);
+  const [sessionId, setSessionId] = useState(null);
   const messagesEndRef = useRef(null);
 
+  const historyToMessages = (items) =>
+    items
+      .slice()
+      .reverse()
+      .flatMap((item) => [
+        { id: `h${item.id}-q`, text: item.question, sender: 'user', timestamp: new Date(item.timestamp) },
+        { id: `h${item.id}-a`, text: item.answer, sender: 'assistant', timestamp: new Date(item.timestamp) }
+      ]);
+
+  const loadHistory = async (cursor = null) => {
+    try {
+      const response = await chatAPI.getHistory(cursor);
+      setMessages(prev => [...historyToMessages(response.data.items), ...prev]);
+      setHistoryCursor(response.data.next_cursor);
+    } catch (err) {
+      // History is a convenience; chatting still works without it
+    }
+  };
+
+  useEffect(() => {
+    loadHistory();
+  }, []);
+
   const scrollToBottom = () => {
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
   };
@@ -34,7 +59,13 @@ const ChatInterface = () => {
     setError('');
 
     try {
-      const response = await chatAPI.sendMessage(userMessage.text);
+      let currentSession = sessionId;
+      if (!currentSession) {
+        const session = await chatAPI.createSession();
+        currentSession = session.data.session_id;
+        setSessionId(currentSession);
+      }
+      const response = await chatAPI.sendMessage(userMessage.text, currentSession);
       
       const assistantMessage = {
         id: Date.now() + 1,
@@ -72,6 +103,11 @@ const ChatInterface = () => {
       {error && <div className="error-message">{error}</div>}
 
       <div className="chat-messages">
+        {historyCursor && (
+          <button type="button" className="load-history-button" onClick={() => loadHistory(historyCursor)}>
+            Load earlier messages
+          </button>
+        )}
         {messages.length === 0 ? (
           <div className="empty-state">
             Upload a PDF document and start asking questions about its content!
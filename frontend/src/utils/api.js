@@ -33,7 +33,9 @@ export const chatAPI = {
       headers: { 'Content-Type': 'multipart/form-data' }
     });
   },
-  sendMessage: (question) => api.post('/chat', { question }),
+  sendMessage: (question, session_id = null) => api.post('/chat', { question, session_id }),
+  createSession: () => api.post('/chat/sessions'),
+  getHistory: (cursor = null, limit = 20) => api.get('/history', { params: { cursor, limit } }),
   getStatus: () => api.get('/status'),
 };
 
@@ -0,0 +1,42 @@
+"""Production server: gunicorn managing uvicorn workers.
+
+    gunicorn main:app                  # picks up this file from the working directory
+    kill -HUP <master pid>             # graceful reload: new workers start, old ones finish in-flight requests
+    kill -USR2 <master pid>            # deploy new code: start a new master, then TERM the old one
+
+The app is imported once in the master (preload_app) and prepared there
+before any worker is forked: the schema is created and upgraded once
+rather than by every worker at the same time, and heavy modules and a
+local embedding model are loaded into pages the workers share. HUP
+replaces the workers but keeps the preloaded code; use USR2 for a new
+release, or set PRELOAD_APP=false to trade the shared memory for code
+reloads on HUP.
+"""
+import multiprocessing
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn_worker.UvicornWorker"
+# Without preloading each worker imports and prepares everything itself, but HUP also reloads the code
+preload_app = os.getenv("PRELOAD_APP", "true").lower() not in ("0", "false", "no")
+timeout = int(os.getenv("WORKER_TIMEOUT", 120))
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", 30))
+keepalive = 5
+# Recycle workers after this many requests (0 = never), staggered by the jitter
+max_requests = int(os.getenv("MAX_REQUESTS", 0))
+max_requests_jitter = int(os.getenv("MAX_REQUESTS_JITTER", 0))
+accesslog = os.getenv("ACCESS_LOG") or None
+
+
+def on_starting(server):
+    if server.cfg.preload_app:
+        # main was imported by preload_app; this is the same module object
+        import main
+        main.preload_shared_state()
+
+
+def post_fork(server, worker):
+    # Drop any pooled connection inherited from the master; the worker opens its own
+    from database import engine
+    engine.dispose(close=False)
@@ -1,66 +1,220 @@
+"""Copy a LangChain FAISS index (faiss_index/) into document_chunks.
+
+    python migrate_faiss_to_pgvector.py [--index-dir faiss_index] [--batch-size 5000]
+
+Vectors are read from a memory-mapped index in blocks with reconstruct_n
+and written with binary COPY, each block in its own transaction together
+with the checkpoint in faiss_migrations. An interrupted run picks up at the
+first block that was not committed, and a finished index is not migrated
+twice. Only the current block of vectors is held in memory; the docstore
+pickle (texts and metadata) is loaded whole, as LangChain stores it as one
+object. Each chunk keeps its docstore id and metadata in chunk_metadata.
+
+The vectors only fill document_chunks.embedding, so the migration refuses
+to run while another embedding version is written (see
+embedding_versions.py): migrate first, then create the version.
+"""
+import argparse
+import io
+import json
 import os
 import pickle
-from langchain_community.vectorstores import FAISS
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from database import get_db, DocumentChunk, create_tables
+import struct
+import time
+
+import faiss
+import numpy as np
 from dotenv import load_dotenv
+from sqlalchemy import text
+
+from database import EMBEDDING_DIMENSION, create_tables, engine
+from embedding_providers import EmbeddingMismatchError, read_index_metadata
+from embedding_versions import EmbeddingVersionError, lock_for_upload
 
 load_dotenv()
 
-def migrate_faiss_to_pgvector():
-    """Migrate existing FAISS data to PGVector if it exists"""
-    if not os.path.exists("faiss_index"):
+DOCUMENT_NAME = "migrated_from_faiss"
+COPY_COLUMNS = "content, embedding, embedding_model, document_name, chunk_index, chunk_metadata"
+COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+COPY_TRAILER = struct.pack(">h", -1)
+
+
+def read_index(index_dir: str):
+    """Memory-mapped FAISS index; flat indexes are then paged in as blocks are read"""
+    flag = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+    return faiss.read_index(os.path.join(index_dir, "index.faiss"), flag)
+
+
+def read_docstore(index_dir: str):
+    """(docstore, index_to_docstore_id) as written by FAISS.save_local"""
+    with open(os.path.join(index_dir, "index.pkl"), "rb") as f:
+        return pickle.load(f)
+
+
+def index_source(index_dir: str) -> str:
+    """Checkpoint key: the index file plus its size and mtime, so a rebuilt index migrates afresh"""
+    path = os.path.abspath(os.path.join(index_dir, "index.faiss"))
+    stat = os.stat(path)
+    return f"{path}@{stat.st_size}-{stat.st_mtime_ns}"
+
+
+def _text_field(value: str) -> bytes:
+    data = value.encode("utf-8")
+    return struct.pack(">i", len(data)) + data
+
+
+def encode_copy_rows(rows) -> io.BytesIO:
+    """Binary COPY payload for (content, vector, model_id, chunk_index, metadata) rows.
+
+    Formatting vectors as text costs about a millisecond each; binary COPY
+    takes the float32 bytes as they are.
+    """
+    out = io.BytesIO()
+    out.write(COPY_HEADER)
+    for content, vector, model_id, chunk_index, metadata in rows:
+        out.write(struct.pack(">h", 6))
+        # Postgres text cannot hold NUL characters
+        out.write(_text_field(content.replace("\x00", "")))
+        out.write(struct.pack(">ihh", 4 + 4 * len(vector), len(vector), 0))
+        out.write(vector.astype(">f4").tobytes())
+        out.write(_text_field(model_id))
+        out.write(_text_field(DOCUMENT_NAME))
+        out.write(struct.pack(">ii", 4, chunk_index))
+        # jsonb binary format: version byte, then the JSON text
+        metadata_json = json.dumps(metadata, default=str).encode("utf-8")
+        out.write(struct.pack(">ib", len(metadata_json) + 1, 1) + metadata_json)
+    out.write(COPY_TRAILER)
+    out.seek(0)
+    return out
+
+
+def block_rows(docstore, index_to_docstore_id, vectors, start: int, model_id: str):
+    """Rows for one block of vectors, and how many positions had no document"""
+    from langchain_core.documents import Document
+
+    rows, skipped = [], 0
+    for offset, vector in enumerate(vectors):
+        position = start + offset
+        doc_id = index_to_docstore_id.get(position)
+        # InMemoryDocstore.search returns an error string for unknown ids
+        doc = docstore.search(doc_id) if doc_id is not None else None
+        if not isinstance(doc, Document) or not np.isfinite(vector).all():
+            skipped += 1
+            continue
+        metadata = {"faiss_docstore_id": str(doc_id), **(doc.metadata or {})}
+        rows.append((doc.page_content, vector, model_id, position, metadata))
+    return rows, skipped
+
+
+def start_migration(source: str, model_id: str, total: int):
+    """Checkpoint row for this index, created on the first run"""
+    with engine.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO faiss_migrations (source, model_id, total, migrated, skipped, started_at, updated_at)
+            VALUES (:source, :model_id, :total, 0, 0, now(), now())
+            ON CONFLICT (source) DO NOTHING
+        """), {"source": source, "model_id": model_id, "total": total})
+        return conn.execute(
+            text("SELECT migrated, completed_at FROM faiss_migrations WHERE source = :source"), {"source": source}
+        ).one()
+
+
+def migrate_block(source: str, index, docstore, index_to_docstore_id, model_id: str, batch_size: int):
+    """Copy the next block after the checkpoint; returns the new position, or None when done"""
+    with engine.begin() as conn:
+        # Like an upload, hold the registry lock so no version can be created mid-block
+        versions = [version.name for version in lock_for_upload(conn) if not version.is_default]
+        if versions:
+            raise EmbeddingVersionError(
+                f"Embedding version(s) {', '.join(versions)} would not get vectors for the migrated chunks; "
+                "migrate before creating versions, or retire them"
+            )
+        # The row lock also keeps two runs from copying the same block
+        migrated, total = conn.execute(text("""
+            SELECT migrated, total FROM faiss_migrations WHERE source = :source FOR UPDATE
+        """), {"source": source}).one()
+        if migrated >= total:
+            return None
+        count = min(batch_size, total - migrated)
+        vectors = index.reconstruct_n(migrated, count)
+        rows, skipped = block_rows(docstore, index_to_docstore_id, vectors, migrated, model_id)
+        if rows:
+            cursor = conn.connection.driver_connection.cursor()
+            try:
+                cursor.copy_expert(f"COPY document_chunks ({COPY_COLUMNS}) FROM STDIN WITH (FORMAT binary)",
+                                   encode_copy_rows(rows))
+            finally:
+                cursor.close()
+        conn.execute(text("""
+            UPDATE faiss_migrations SET migrated = :migrated, skipped = skipped + :skipped, updated_at = now()
+            WHERE source = :source
+        """), {"source": source, "migrated": migrated + count, "skipped": skipped})
+        return migrated + count
+
+
+def migrate_faiss_to_pgvector(index_dir: str = "faiss_index", batch_size: int = 5000, backup: bool = True):
+    """Migrate existing FAISS data to PGVector if it exists, resuming an interrupted run"""
+    if not os.path.exists(index_dir):
         print("No FAISS index found. Skipping migration.")
         return
-    
-    print("Found existing FAISS index. Starting migration...")
-    
+
+    index_info = read_index_metadata(index_dir)
+    index = read_index(index_dir)
+    if index.d != EMBEDDING_DIMENSION or index_info["dimension"] != EMBEDDING_DIMENSION:
+        raise EmbeddingMismatchError(
+            f"FAISS index holds {index.d}-dimensional vectors from {index_info['model_id']}, "
+            f"but document_chunks.embedding is {EMBEDDING_DIMENSION}-dimensional"
+        )
+
+    source = index_source(index_dir)
+    with engine.connect() as conn:
+        checkpoints = conn.execute(text("SELECT COUNT(*) FROM faiss_migrations")).scalar()
+        legacy = conn.execute(text("SELECT COUNT(*) FROM document_chunks WHERE document_name = :name"),
+                              {"name": DOCUMENT_NAME}).scalar()
+    if not checkpoints and legacy:
+        # Migrated by an earlier version of this script, which kept no checkpoint
+        print(f"Database already has {legacy} migrated chunks. Skipping migration.")
+        return
+
+    migrated, completed_at = start_migration(source, index_info["model_id"], index.ntotal)
+    if completed_at is not None:
+        print(f"{index_dir} was already migrated on {completed_at:%Y-%m-%d %H:%M}. Skipping migration.")
+        return
+    print(f"Migrating {index.ntotal} vectors from {index_dir}" + (f", resuming at {migrated}" if migrated else ""))
+
+    docstore, index_to_docstore_id = read_docstore(index_dir)
+    start, resumed_at = time.perf_counter(), migrated
+    while True:
+        position = migrate_block(source, index, docstore, index_to_docstore_id, index_info["model_id"], batch_size)
+        if position is None:
+            break
+        rate = (position - resumed_at) / (time.perf_counter() - start)
+        print(f"  {position}/{index.ntotal} vectors ({rate:.0f}/s)")
+
+    with engine.begin() as conn:
+        skipped = conn.execute(text("""
+            UPDATE faiss_migrations SET completed_at = now(), updated_at = now()
+            WHERE source = :source RETURNING skipped
+        """), {"source": source}).scalar()
+        conn.execute(text("ANALYZE document_chunks"))
+    print(f"Successfully migrated {index.ntotal - skipped} chunks from FAISS to PGVector"
+          + (f" ({skipped} vectors without a document skipped)" if skipped else ""))
+
+    backup_dir = f"{index_dir.rstrip(os.sep)}_backup"
+    if backup and not os.path.exists(backup_dir):
+        os.rename(index_dir, backup_dir)
+        print(f"FAISS index backed up to {backup_dir}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index-dir", default="faiss_index")
+    parser.add_argument("--batch-size", type=int, default=5000, help="vectors read and committed per block")
+    parser.add_argument("--no-backup", action="store_true", help="leave the index directory in place when done")
+    args = parser.parse_args()
+    create_tables()
     try:
-        embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
-        vector_store = FAISS.load_local("faiss_index", embeddings, allow_dangerous_deserialization=True)
-        
-        db = next(get_db())
-        
-        existing_count = db.query(DocumentChunk).count()
-        if existing_count > 0:
-            print(f"Database already has {existing_count} chunks. Skipping migration.")
-            return
-        
-        texts = []
-        embeddings_list = []
-        
-        docstore = vector_store.docstore
-        index_to_docstore_id = vector_store.index_to_docstore_id
-        
-        for i in range(vector_store.index.ntotal):
-            doc_id = index_to_docstore_id[i]
-            doc = docstore.search(doc_id)
-            if doc:
-                texts.append(doc.page_content)
-                embedding = vector_store.index.reconstruct(i)
-                embeddings_list.append(embedding.tolist())
-        
-        for i, (text, embedding) in enumerate(zip(texts, embeddings_list)):
-            doc_chunk = DocumentChunk(
-                content=text,
-                embedding=embedding,
-                document_name="migrated_from_faiss",
-                chunk_index=i
-            )
-            db.add(doc_chunk)
-        
-        db.commit()
-        print(f"Successfully migrated {len(texts)} chunks from FAISS to PGVector")
-        
-        backup_dir = "faiss_index_backup"
-        if not os.path.exists(backup_dir):
-            os.rename("faiss_index", backup_dir)
-            print(f"FAISS index backed up to {backup_dir}")
-        
+        migrate_faiss_to_pgvector(args.index_dir, args.batch_size, backup=not args.no_backup)
     except Exception as e:
         print(f"Migration failed: {str(e)}")
         raise
-
-if __name__ == "__main__":
-    create_tables()
-    migrate_faiss_to_pgvector()
@@ -0,0 +1,356 @@
+"""Request tracing, per-stage latency metrics and an opt-in sampling profiler.
+
+Metrics are kept in-process and rendered in the Prometheus text exposition
+format by ``render_metrics()``. Handlers wrap each step in ``stage()``:
+
+    with stage("chat", "vector_search"):
+        rows = search_similar_chunks(db, embedding)
+
+which feeds ``pdfchat_stage_duration_seconds``, counts failures per stage and
+records the timing on the current request's trace, so a slow or failing
+request can be attributed to embedding, the database or the model.
+"""
+import bisect
+import contextvars
+import logging
+import sys
+import threading
+import time
+import uuid
+from collections import Counter as TallyCounter
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+_registry = []
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _format_labels(self, key: Tuple[str, ...], extra: Optional[Tuple[str, str]] = None) -> str:
+        pairs = list(zip(self.labelnames, key))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ""
+        escaped = (v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in pairs)
+        return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        with self._lock:
+            lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        return [f"{self.name}{self._format_labels(k)} {v}" for k, v in sorted(self._values.items())]
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def _samples(self):
+        return [f"{self.name}{self._format_labels(k)} {v}" for k, v in sorted(self._values.items())]
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._series.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[index] += 1
+            self._series[key] = (counts, total + value)
+
+    def _samples(self):
+        lines = []
+        for key, (counts, total) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{self._format_labels(key, ('le', repr(float(bound))))} {cumulative}")
+            cumulative += counts[-1]
+            lines.append(f"{self.name}_bucket{self._format_labels(key, ('le', '+Inf'))} {cumulative}")
+            lines.append(f"{self.name}_sum{self._format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{self._format_labels(key)} {cumulative}")
+        return lines
+
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "pdfchat_http_request_duration_seconds", "HTTP request latency by route.", ["method", "route", "status"]
+)
+STAGE_SECONDS = Histogram(
+    "pdfchat_stage_duration_seconds", "Latency of each processing stage within an operation.", ["operation", "stage"]
+)
+STAGE_ERRORS = Counter(
+    "pdfchat_stage_errors_total", "Exceptions raised inside a processing stage.", ["operation", "stage"]
+)
+LLM_TOKENS = Counter("pdfchat_llm_tokens_total", "Model tokens consumed.", ["operation", "kind"])
+LLM_PROMPT_TOKENS = Histogram(
+    "pdfchat_llm_prompt_tokens", "Prompt tokens per model call.", ["operation"], buckets=TOKEN_BUCKETS
+)
+CACHE_REQUESTS = Counter("pdfchat_cache_requests_total", "Cache lookups by outcome.", ["cache", "result"])
+DB_POOL_CONNECTIONS = Gauge("pdfchat_db_pool_connections", "SQLAlchemy pool connections by state.", ["state"])
+
+
+class RequestTrace:
+    """Per-request record of stage timings, shared by the middleware and handlers"""
+
+    def __init__(self, request_id: str):
+        self.request_id = request_id
+        self.stages: List[Tuple[str, float]] = []
+        self.failed_stage: Optional[str] = None
+
+    def server_timing(self) -> str:
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages)
+
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("request_trace", default=None)
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _current_trace.get()
+
+
+def current_request_id() -> str:
+    trace = _current_trace.get()
+    return trace.request_id if trace else "-"
+
+
+def failed_stage() -> str:
+    """Name of the stage that raised in the current request, for error messages"""
+    trace = _current_trace.get()
+    return trace.failed_stage if trace and trace.failed_stage else "unknown"
+
+
+def _is_client_error(error: Exception) -> bool:
+    # Duck-typed so this module does not import FastAPI
+    status_code = getattr(error, "status_code", None)
+    return isinstance(status_code, int) and status_code < 500
+
+
+@contextmanager
+def stage(operation: str, name: str):
+    """Time a block as one stage of an operation, recording failures against it"""
+    trace = _current_trace.get()
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        # An HTTPException below 500 (404, 400...) is an answer to the client, not a failure of the stage
+        if not _is_client_error(e):
+            STAGE_ERRORS.inc(operation=operation, stage=name)
+            if trace is not None and trace.failed_stage is None:
+                trace.failed_stage = name
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, operation=operation, stage=name)
+        if trace is not None:
+            trace.stages.append((name, elapsed))
+
+
+def record_cache(cache: str, hit: bool):
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def record_pool_stats(engine):
+    """Refresh the pool gauges from a SQLAlchemy engine; called at scrape time"""
+    pool = engine.pool
+    for state, getter in (("size", "size"), ("checked_out", "checkedout"),
+                          ("checked_in", "checkedin"), ("overflow", "overflow")):
+        if hasattr(pool, getter):
+            DB_POOL_CONNECTIONS.set(getattr(pool, getter)(), state=state)
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+_token_usage_handler_class = None
+
+
+def token_usage_handler(operation: str):
+    """LangChain callback that records token usage reported by the model.
+
+    The handler also totals the tokens of the calls it saw in
+    ``input_tokens``/``output_tokens`` for per-request accounting.
+
+    The class is built on first use so importing this module does not pull
+    in langchain_core.
+    """
+    global _token_usage_handler_class
+    if _token_usage_handler_class is None:
+        from langchain_core.callbacks import BaseCallbackHandler
+
+        class TokenUsageHandler(BaseCallbackHandler):
+            def __init__(self, operation: str):
+                self.operation = operation
+                self.input_tokens = 0
+                self.output_tokens = 0
+
+            def on_llm_end(self, response, **kwargs):
+                for generations in response.generations:
+                    for generation in generations:
+                        usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                        if not usage:
+                            continue
+                        LLM_TOKENS.inc(usage.get("input_tokens", 0), operation=self.operation, kind="input")
+                        LLM_TOKENS.inc(usage.get("output_tokens", 0), operation=self.operation, kind="output")
+                        LLM_PROMPT_TOKENS.observe(usage.get("input_tokens", 0), operation=self.operation)
+                        self.input_tokens += usage.get("input_tokens", 0)
+                        self.output_tokens += usage.get("output_tokens", 0)
+
+        _token_usage_handler_class = TokenUsageHandler
+    return _token_usage_handler_class(operation)
+
+
+class RequestIdFilter(logging.Filter):
+    """Adds ``request_id`` to every log record so it can be used in format strings"""
+
+    def filter(self, record):
+        record.request_id = current_request_id()
+        return True
+
+
+def configure_logging(level: int = logging.INFO):
+    handler = logging.StreamHandler()
+    handler.addFilter(RequestIdFilter())
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s"))
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(level)
+
+
+class TracingMiddleware:
+    """ASGI middleware assigning request IDs and timing every HTTP request.
+
+    An incoming ``X-Request-ID`` is reused so IDs can be followed across
+    services; the ID and a ``Server-Timing`` summary of recorded stages are
+    returned as response headers.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.logger = logging.getLogger("pdfchat.access")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        request_id = headers.get(b"x-request-id", b"").decode("latin-1") or uuid.uuid4().hex
+        trace = RequestTrace(request_id)
+        token = _current_trace.set(trace)
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_with_headers(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                extra = [(b"x-request-id", request_id.encode("latin-1"))]
+                if trace.stages:
+                    extra.append((b"server-timing", trace.server_timing().encode("latin-1")))
+                message["headers"] = list(message.get("headers", [])) + extra
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            elapsed = time.perf_counter() - start
+            route = scope.get("route")
+            route_path = getattr(route, "path", "unmatched")
+            HTTP_REQUEST_SECONDS.observe(elapsed, method=scope["method"], route=route_path, status=str(status_code))
+            self.logger.info("%s %s %s %.1fms", scope["method"], scope["path"], status_code, elapsed * 1000)
+            _current_trace.reset(token)
+
+
+class SamplingProfiler:
+    """Wall-clock stack sampler for finding hot paths in a running server.
+
+    A daemon thread snapshots every other thread's stack each ``interval``
+    seconds and tallies them; ``collapsed()`` returns the folded-stack format
+    consumed by flamegraph.pl and speedscope. Only used when explicitly
+    enabled, since sampling all threads costs CPU proportional to the rate.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples = TallyCounter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}")
+                    frame = frame.f_back
+                self.samples[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def collapsed(self) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in self.samples.most_common()) + "\n"
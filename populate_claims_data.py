@@ -1,54 +1,21 @@
-import pandas as pd
-from sqlalchemy.orm import Session
-from database import get_db, create_tables, ClaimsList, ClaimsDetail
-from datetime import datetime
-import os
+from database import get_db, create_tables, engine, ClaimsList, ClaimsDetail
+from claims_loader import load_claims_csv
 
 def populate_claims_data():
     """Populate the claims tables with data from CSV files"""
     
     create_tables()
     
-    claims_list_df = pd.read_csv('/home/ubuntu/attachments/3f2b4685-d503-4d29-a1c8-fd1ef23efab9/claim_list_data.csv')
-    claims_detail_df = pd.read_csv('/home/ubuntu/attachments/6f16af9c-4da0-42bc-9542-a63111f3529e/claim_detail_data.csv')
-    
     db = next(get_db())
     
     try:
-        db.query(ClaimsDetail).delete()
-        db.query(ClaimsList).delete()
-        db.commit()
-        
         print("Populating Claims List table...")
-        
-        for _, row in claims_list_df.iterrows():
-            claim = ClaimsList(
-                id=int(row['id']),
-                patient_name=str(row['patient_name']),
-                billed_amount=float(row['billed_amount']),
-                paid_amount=float(row['paid_amount']),
-                status=str(row['status']),
-                insurer_name=str(row['insurer_name']),
-                discharge_date=datetime.strptime(row['discharge_date'], '%Y-%m-%d').date()
-            )
-            db.add(claim)
-        
-        db.commit()
-        print(f"Successfully inserted {len(claims_list_df)} records into Claims List table")
+        result = load_claims_csv('/home/ubuntu/attachments/3f2b4685-d503-4d29-a1c8-fd1ef23efab9/claim_list_data.csv', 'claims_list', engine)
+        print(f"Successfully inserted {result.rows_loaded} records into Claims List table")
         
         print("Populating Claims Detail table...")
-        
-        for _, row in claims_detail_df.iterrows():
-            detail = ClaimsDetail(
-                id=int(row['id']),
-                claim_id=int(row['claim_id']),
-                denial_reason=str(row['denial_reason']) if pd.notna(row['denial_reason']) and row['denial_reason'] != 'N/A' else None,
-                cpt_codes=str(row['cpt_codes']) if pd.notna(row['cpt_codes']) else None
-            )
-            db.add(detail)
-        
-        db.commit()
-        print(f"Successfully inserted {len(claims_detail_df)} records into Claims Detail table")
+        result = load_claims_csv('/home/ubuntu/attachments/6f16af9c-4da0-42bc-9542-a63111f3529e/claim_detail_data.csv', 'claims_detail', engine, skip_bad_lines=True)
+        print(f"Successfully inserted {result.rows_loaded} records into Claims Detail table")
         
         claims_count = db.query(ClaimsList).count()
         details_count = db.query(ClaimsDetail).count()
@@ -0,0 +1,421 @@
+"""Optional in-memory vector index for retrieval, split into shards searched in parallel.
+
+With VECTOR_INDEX_SHARDS=N (N > 0) each API process keeps the vectors of
+the active embedding version in N shards, each a contiguous float32
+matrix, and /chat and /chat/batch search them instead of scanning pgvector.
+A query is scored against every shard at once on a thread pool (NumPy
+releases the GIL in the matrix products), each shard returns its own top
+k, and the sorted per-shard lists are merged (k-way) into the final top k.
+Distances are L2 like pgvector's <->, and the search is exact.
+
+The index follows the database through vector_index_changes, a log that
+triggers on document_chunks and the version tables fill with the chunk
+ids every insert, update and delete touches. Every
+VECTOR_INDEX_SYNC_SECONDS, or straight away after an upload in the same
+process, a background thread reads the log past the last seq it applied
+and loads or hides just those chunks. A transaction that was still open
+at the previous read may commit log rows below that seq, so rows whose
+transaction id is at or above that read's snapshot xmin are read again,
+skipping those already applied. Deleted vectors are hidden with an
+infinite norm, and a shard is compacted once more than
+VECTOR_INDEX_COMPACT_FRACTION of it is hidden. An index that has not read
+the log for longer than it is kept (VECTOR_CHANGE_RETENTION_SECONDS), or
+that is for another embedding version than the active one, is rebuilt;
+until an index for the active version is loaded, searches go to pgvector.
+
+Under gunicorn with preload_app the index is built once in the master, so
+the workers share its pages copy-on-write. Each worker then syncs new
+chunks into its own memory.
+"""
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import text
+
+from database import VECTOR_CHANGE_RETENTION_SECONDS
+from embedding_versions import vector_source
+from observability import Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+VECTOR_INDEX_CHUNKS = Gauge("pdfchat_vector_index_chunks", "Chunk vectors held by the in-memory vector index.")
+VECTOR_INDEX_SYNC_SECONDS = Histogram("pdfchat_vector_index_sync_seconds",
+                                      "Time to bring the in-memory vector index up to date.", ["kind"])
+
+LOAD_BATCH_ROWS = 10000
+# Distance matrix elements (stored vectors x queries) scored at a time per shard
+SCORE_BLOCK = 1 << 22
+
+
+class _Shard:
+    """Vectors in rows [0, size) of preallocated arrays.
+
+    Only the sync thread writes. It fills rows past ``size`` and then
+    publishes a new ``view``, so a search always sees a consistent
+    (vectors, squared norms, ids, size) tuple.
+    """
+
+    def __init__(self, dimension: int):
+        self.dimension = dimension
+        self.view = (np.empty((0, dimension), np.float32), np.empty(0, np.float32), np.empty(0, np.int64), 0)
+        self.removed = 0
+
+    @property
+    def size(self) -> int:
+        return self.view[3]
+
+    def reserve(self, capacity: int):
+        """Make room for ``capacity`` vectors; untouched rows take no memory until written"""
+        stored, norms, stored_ids, size = self.view
+        if capacity <= len(stored_ids):
+            return
+        grown = (np.empty((capacity, self.dimension), np.float32), np.empty(capacity, np.float32),
+                 np.empty(capacity, np.int64))
+        grown[0][:size], grown[1][:size], grown[2][:size] = stored[:size], norms[:size], stored_ids[:size]
+        self.view = grown + (size,)
+
+    def append(self, ids: np.ndarray, vectors: np.ndarray):
+        end = self.size + len(ids)
+        if end > len(self.view[2]):
+            self.reserve(max(end, len(self.view[2]) * 3 // 2, 1024))
+        stored, norms, stored_ids, size = self.view
+        stored[size:end] = vectors
+        norms[size:end] = np.einsum("ij,ij->i", vectors, vectors)
+        stored_ids[size:end] = ids
+        self.view = (stored, norms, stored_ids, end)
+
+    def remove(self, ids: np.ndarray) -> int:
+        """Hide vectors from searches; an infinite norm never ranks"""
+        _, norms, stored_ids, size = self.view
+        found = np.isin(stored_ids[:size], ids) & np.isfinite(norms[:size])
+        norms[:size][found] = np.inf
+        removed = int(found.sum())
+        self.removed += removed
+        return removed
+
+    def contains(self, ids: np.ndarray) -> np.ndarray:
+        _, norms, stored_ids, size = self.view
+        return np.isin(ids, stored_ids[:size][np.isfinite(norms[:size])])
+
+    def compact(self):
+        """Copy the searchable vectors into new arrays of the same capacity, dropping removed ones.
+
+        Searches keep the old view until the new one is published. In a
+        forked worker the new arrays are private memory.
+        """
+        stored, norms, stored_ids, size = self.view
+        live = np.isfinite(norms[:size])
+        count = int(live.sum())
+        capacity = len(stored_ids)
+        compacted = (np.empty((capacity, self.dimension), np.float32), np.empty(capacity, np.float32),
+                     np.empty(capacity, np.int64))
+        compacted[0][:count], compacted[1][:count], compacted[2][:count] = \
+            stored[:size][live], norms[:size][live], stored_ids[:size][live]
+        self.view = compacted + (count,)
+        self.removed = 0
+
+    def top_k(self, queries: np.ndarray, query_norms: np.ndarray, k: int) -> List[List[Tuple[float, int]]]:
+        """Sorted (distance, id) lists of the k nearest vectors for each query"""
+        stored, norms, stored_ids, size = self.view
+        results = [[] for _ in queries]
+        if size == 0:
+            return results
+        k = min(k, size)
+        step = max(1, SCORE_BLOCK // size)
+        for start in range(0, len(queries), step):
+            block = queries[start:start + step]
+            # |x - q|^2 = |x|^2 - 2 x.q + |q|^2; |q|^2 does not change the order
+            scores = norms[:size, None] - 2 * (stored[:size] @ block.T)
+            nearest = np.argpartition(scores, k - 1, axis=0)[:k] if k < size else \
+                np.broadcast_to(np.arange(size)[:, None], scores.shape)
+            for column in range(block.shape[0]):
+                rows = nearest[:, column]
+                row_scores = scores[rows, column]
+                keep = np.isfinite(row_scores)
+                rows, row_scores = rows[keep], row_scores[keep]
+                order = np.argsort(row_scores, kind="stable")
+                distances = np.sqrt(np.maximum(row_scores[order] + query_norms[start + column], 0))
+                results[start + column] = list(zip(distances.tolist(), stored_ids[rows[order]].tolist()))
+        return results
+
+
+class ShardedVectorIndex:
+    """Exact L2 nearest-neighbour search over vectors spread across ``shards`` contiguous blocks"""
+
+    def __init__(self, dimension: int, shards: int, threads: Optional[int] = None):
+        self.dimension = dimension
+        self.shards = [_Shard(dimension) for _ in range(max(1, shards))]
+        self.threads = threads or min(len(self.shards), os.cpu_count() or 1)
+        self._pool = None
+        self._pool_pid = None
+
+    def __len__(self):
+        """Vectors searched, not counting removed ones"""
+        return sum(shard.size for shard in self.shards) - self.removed
+
+    @property
+    def removed(self) -> int:
+        """Vectors hidden from searches but not yet compacted away"""
+        return sum(shard.removed for shard in self.shards)
+
+    def reserve(self, count: int):
+        per_shard = -(-count // len(self.shards))
+        for shard in self.shards:
+            shard.reserve(per_shard)
+
+    def add(self, ids: Sequence[int], vectors):
+        """Append vectors, topping up the smallest shards first so the shards stay balanced"""
+        ids = np.asarray(ids, dtype=np.int64)
+        if not len(ids):
+            return
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(ids), self.dimension)
+        target = -(-(sum(shard.size for shard in self.shards) + len(ids)) // len(self.shards))
+        start = 0
+        for shard in sorted(self.shards, key=lambda shard: shard.size):
+            end = min(start + max(target - shard.size, 0), len(ids))
+            if end > start:
+                shard.append(ids[start:end], vectors[start:end])
+            start = end
+
+    def remove(self, ids: Sequence[int]) -> int:
+        ids = np.asarray(ids, dtype=np.int64)
+        return sum(shard.remove(ids) for shard in self.shards) if len(ids) else 0
+
+    def contains(self, ids: Sequence[int]) -> np.ndarray:
+        """Whether each id is searched"""
+        ids = np.asarray(ids, dtype=np.int64)
+        found = np.zeros(len(ids), dtype=bool)
+        for shard in self.shards:
+            found |= shard.contains(ids)
+        return found
+
+    def compact(self, fraction: float) -> int:
+        """Compact the shards in which more than ``fraction`` of the vectors are removed; returns how many"""
+        compacted = 0
+        for shard in self.shards:
+            if shard.removed and shard.removed > fraction * shard.size:
+                shard.compact()
+                compacted += 1
+        return compacted
+
+    def _executor(self) -> ThreadPoolExecutor:
+        # Threads do not survive a fork: a worker inheriting the index starts its own pool
+        if self._pool is None or self._pool_pid != os.getpid():
+            self._pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="vector-shard")
+            self._pool_pid = os.getpid()
+        return self._pool
+
+    def search(self, query_embeddings, k: int = 4) -> List[List[Tuple[float, int]]]:
+        """(distance, id) lists of the k nearest vectors, nearest first, one list per query"""
+        queries = np.asarray(query_embeddings, dtype=np.float32).reshape(-1, self.dimension)
+        query_norms = np.einsum("ij,ij->i", queries, queries)
+        if len(self.shards) == 1 or self.threads == 1:
+            per_shard = [shard.top_k(queries, query_norms, k) for shard in self.shards]
+        else:
+            per_shard = list(self._executor().map(lambda shard: shard.top_k(queries, query_norms, k), self.shards))
+        return [
+            list(itertools.islice(heapq.merge(*(results[i] for results in per_shard)), k))
+            for i in range(len(queries))
+        ]
+
+
+class SyncedVectorIndex:
+    """A ShardedVectorIndex of the active embedding version, kept in sync with the database.
+
+    ``target`` returns the (model_id, version) that questions are searched
+    against, as in main.get_retrieval_model.
+    """
+
+    def __init__(self, target: Callable, shards: int, threads: Optional[int] = None,
+                 sync_seconds: float = 5.0, compact_fraction: float = 0.2, engine=None):
+        self.target = target
+        self.shards = shards
+        self.threads = threads
+        self.sync_seconds = sync_seconds
+        self.compact_fraction = compact_fraction
+        self._engine = engine
+        self._index = None
+        self._key = None
+        # Position in vector_index_changes: last seq applied, snapshot xmin of the
+        # last read, seqs applied at or above that xmin, and when it was read
+        self._seq = 0
+        self._xmin = 0
+        self._applied = set()
+        self._read_at = 0.0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_sync = None
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            from database import engine
+            self._engine = engine
+        return self._engine
+
+    @staticmethod
+    def _source_key(model_id: str, version) -> tuple:
+        # The default version and no version both search document_chunks.embedding filtered by model
+        if version is None or version.is_default:
+            return ("document_chunks", model_id)
+        return (version.table_name, version.model_id)
+
+    def search(self, query_embeddings, model_id: str, version, k: int = 4) -> Optional[List[List[Tuple[float, int]]]]:
+        """Nearest (distance, id) lists, or None if the index does not hold this version's vectors"""
+        index = self._index
+        if index is None or self._key != self._source_key(model_id, version):
+            return None
+        return index.search(query_embeddings, k)
+
+    def _vectors(self, conn, model_id: str, version, where: str = "TRUE", params: dict = None):
+        """(ids, vectors) batches from a server-side cursor, in id order"""
+        source, vector, condition = vector_source(version)
+        result = conn.execution_options(stream_results=True, max_row_buffer=LOAD_BATCH_ROWS).execute(text(f"""
+            SELECT c.id, vector_send({vector}) FROM {source}
+            WHERE {condition} AND {vector} IS NOT NULL AND {where}
+            ORDER BY c.id
+        """), {"model_id": model_id, **(params or {})})
+        for rows in result.partitions(LOAD_BATCH_ROWS):
+            ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+            # vector_send: int16 dimension, int16 unused, then big-endian float4 values
+            vectors = np.frombuffer(b"".join(bytes(row[1])[4:] for row in rows), dtype=">f4")
+            yield ids, vectors.astype(np.float32).reshape(len(rows), -1)
+
+    def _count(self, conn, model_id: str, version) -> int:
+        source, vector, condition = vector_source(version)
+        return conn.execute(text(f"SELECT COUNT(*) FROM {source} WHERE {condition} AND {vector} IS NOT NULL"),
+                            {"model_id": model_id}).scalar()
+
+    def build(self, model_id: str, version) -> ShardedVectorIndex:
+        """Load every vector of the version into a new index and search it from now on"""
+        with self._lock:
+            return self._build(model_id, version)
+
+    def _build(self, model_id: str, version) -> ShardedVectorIndex:
+        start = time.perf_counter()
+        # The previous version's index is no longer searched; free it before loading
+        self._index, self._key = None, None
+        from database import EMBEDDING_DIMENSION
+        dimension = EMBEDDING_DIMENSION if version is None or version.is_default else version.dimension
+        index = ShardedVectorIndex(dimension, self.shards, self.threads)
+        with self.engine.connect() as conn:
+            # Read the log position first: changes committed while loading are applied
+            # again by the next sync, which is harmless
+            self._seq, self._xmin = conn.execute(text("""
+                SELECT COALESCE(MAX(seq), 0), pg_snapshot_xmin(pg_current_snapshot())::text::bigint
+                FROM vector_index_changes
+            """)).one()
+            self._applied, self._read_at = set(), time.time()
+            # Sized up front with room for later uploads: growing a shard copies it, and in a
+            # forked worker the copy is private. Rows not yet written take no memory.
+            count = self._count(conn, model_id, version)
+            index.reserve(count + count // 4 + LOAD_BATCH_ROWS)
+            for ids, vectors in self._vectors(conn, model_id, version):
+                index.add(ids, vectors)
+        self._index, self._key = index, self._source_key(model_id, version)
+        self._record("build", start)
+        logger.info("Loaded %d vectors into %d shards in %.1fs", len(index), len(index.shards),
+                    time.perf_counter() - start)
+        return index
+
+    def _update(self, model_id: str, version) -> int:
+        """Apply the logged changes to the version's vectors since the last sync; returns vectors added"""
+        start = time.perf_counter()
+        index = self._index
+        with self.engine.connect() as conn:
+            # One statement, so the xmin belongs to the snapshot the rows were read in
+            rows = conn.execute(text("""
+                SELECT s.xmin, v.seq, v.chunk_id, v.op, v.xid
+                FROM (SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint AS xmin) s
+                LEFT JOIN vector_index_changes v
+                  ON v.table_name = :table_name AND (v.seq > :seq OR v.xid >= :xmin)
+            """), {"table_name": self._key[0], "seq": self._seq, "xmin": self._xmin}).fetchall()
+            read_at = time.time()
+            xmin = rows[0][0]
+            changes = [row for row in rows if row[1] is not None and row[1] not in self._applied]
+            added = self._apply(conn, index, model_id, version, changes) if changes else 0
+        self._seq = max([self._seq] + [row[1] for row in changes])
+        self._xmin, self._read_at = xmin, read_at
+        # Rows of transactions that were open at this read are read again next time
+        self._applied = {row[1] for row in rows if row[1] is not None and row[4] >= xmin}
+        compacted = index.compact(self.compact_fraction)
+        if compacted:
+            logger.info("Compacted %d vector index shards", compacted)
+        self._record("incremental", start)
+        return added
+
+    def _apply(self, conn, index: ShardedVectorIndex, model_id: str, version, changes) -> int:
+        """Hide updated and deleted chunks, then load those stored and not searched"""
+        ids = np.unique(np.fromiter((row[2] for row in changes), dtype=np.int64, count=len(changes)))
+        changed = np.unique(np.fromiter((row[2] for row in changes if row[3] != "I"), dtype=np.int64))
+        removed = index.remove(changed)
+        # Inserts read again after an earlier sync or the build already loaded them
+        missing = ids[~index.contains(ids)]
+        added = 0
+        for start in range(0, len(missing), LOAD_BATCH_ROWS):
+            batch = missing[start:start + LOAD_BATCH_ROWS].tolist()
+            for batch_ids, vectors in self._vectors(conn, model_id, version, "c.id = ANY(:ids)", {"ids": batch}):
+                index.add(batch_ids, vectors)
+                added += len(batch_ids)
+        logger.debug("Applied %d vector index changes: %d vectors added, %d removed", len(changes), added, removed)
+        return added
+
+    def _record(self, kind: str, start: float):
+        self._last_sync = time.time()
+        VECTOR_INDEX_SYNC_SECONDS.observe(time.perf_counter() - start, kind=kind)
+        VECTOR_INDEX_CHUNKS.set(len(self._index) if self._index is not None else 0)
+
+    def sync(self) -> int:
+        """Bring the index up to date with the active version, building it if needed; returns vectors added"""
+        model_id, version = self.target()
+        with self._lock:
+            if self._index is None or self._key != self._source_key(model_id, version) \
+                    or time.time() - self._read_at > VECTOR_CHANGE_RETENTION_SECONDS:
+                return len(self._build(model_id, version))
+            return self._update(model_id, version)
+
+    def notify(self):
+        """Sync soon, e.g. after chunks were stored"""
+        self._wake.set()
+
+    def start(self):
+        """Keep the index in sync from a background thread in this process"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="vector-index-sync", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.sync()
+            except Exception as e:
+                logger.warning("Vector index sync failed: %s", e)
+            self._wake.wait(self.sync_seconds)
+            self._wake.clear()
+
+    def stats(self) -> dict:
+        index = self._index
+        return {
+            "shards": self.shards,
+            "threads": index.threads if index is not None else None,
+            "source": self._key[0] if self._key else None,
+            "vectors": len(index) if index is not None else 0,
+            "shard_sizes": [shard.size for shard in index.shards] if index is not None else [],
+            "removed": index.removed if index is not None else 0,
+            "last_sync": self._last_sync,
+        }